@@ -1,18 +1,9 @@
 from torchaudio import transforms as T
 from torchaudio import load
-import numpy as np 
-import os
-
-import re
-from transformers import pipeline
-
-from dataclasses import dataclass
-
-from collections import defaultdict
-from pathlib import Path
 
 import torch
-from transformers import WhisperProcessor, WhisperTokenizer, GenerationConfig, WhisperForConditionalGeneration
+import psutil
+from transformers import GenerationConfig, WhisperForConditionalGeneration
 
 
 
@@ -25,6 +16,14 @@ from batchalign.pipelines.asr.utils import *
 from batchalign.models.utils import _extract_token_timestamps as ett
 from batchalign.models.utils import ASRAudioFile
 
+from audio_io import AudioWindow, StreamingAudioFile, can_stream, count_windows, iter_windows, load_pcm, stitch_window_words
+from vad import detect_speech
+from asr_postprocess import words_to_turns
+from hf_models import load_pretrained
+from asr_backends import CHUNK_LENGTH_S, STRIDE_LENGTH_S, get_backend
+from collections import deque
+import progress
+
 
 WhisperForConditionalGeneration._extract_token_timestamps = ett
 
@@ -32,10 +31,6 @@ WhisperForConditionalGeneration._extract_token_timestamps = ett
 import logging
 L = logging.getLogger("batchalign")
 
-# DEVICE = torch.device('cuda') if torch.cuda.is_available() else torch.device('cpu')
-# DEVICE = torch.device('cuda') if torch.cuda.is_available() else torch.device('cpu')
-DEVICE = torch.device('cuda') if torch.cuda.is_available() else torch.device("mps") if torch.backends.mps.is_available() else torch.device('cpu')
-# PYTORCH_ENABLE_MPS_FALLBACK=1
 # pretrained model path
 # # PRETRAINED = "openai/whisper-small"
 # PRETRAINED = "talkbank/CHATWhisper-en-large-v1"
@@ -54,6 +49,26 @@ class ArbatraryASRModel(object):
         The model path to load from.
     target_sample_rate : optional, int
         The sample rate to cast to. Defaults 16000 by Whisper.
+    batch_size : optional, int | "auto"
+        How many 25 second chunks to decode per forward pass. "auto" picks
+        the batch size from the free (V)RAM. Defaults to 1.
+    streaming : optional, bool
+        Decode and feed the audio to the model block by block, so that memory
+        use does not grow with the length of the recording. Defaults to False.
+    vad : optional, bool
+        Find the speech with a CPU voice activity detection pass first and only
+        send those regions to whisper, cut at pauses instead of fixed windows.
+        Defaults to False.
+    precision : optional, str
+        "fp32", "bf16", "fp16" (GPU only) or "int8" (dynamic quantization of the
+        linear layers, CPU only). Falls back to fp32 where the device does not
+        support the requested precision. Defaults to "fp32".
+    backend : optional, str
+        The inference engine, "hf" for the transformers pipeline or "onnx" for
+        ONNX Runtime on the CPU, see asr_backends. Defaults to "hf".
+    device : optional, str
+        "auto", "cpu" or "cuda", where the model runs, see
+        asr_backends.resolve_device. Defaults to "auto", the GPU if there is one.
 
     Example
     -------
@@ -62,24 +77,17 @@ class ArbatraryASRModel(object):
     >>> engine(file.chunk(7000, 13000)) # transcribes 7000th ms to 13000th ms
     """
 
-    def __init__(self, model, base="openai/whisper-large-v3", language=None, target_sample_rate=16000):
+    def __init__(self, model, base="openai/whisper-large-v3", language=None, target_sample_rate=16000, batch_size=1, streaming=False, vad=False, precision="fp32", backend="hf", device=None):
         self.name = model
         L.debug(f"Initializing {self.name} model...")
-        self.__config = GenerationConfig.from_pretrained(base)
+        # from the local snapshot when the base model is downloaded, see hf_models.load_pretrained
+        self.__config = load_pretrained(GenerationConfig.from_pretrained, base)
         self.__config.no_repeat_ngram_size = 4
 
-        self.pipe = pipeline(
-            "automatic-speech-recognition",
-            model=model,
-            tokenizer=WhisperTokenizer.from_pretrained(base),
-            chunk_length_s=25,
-            stride_length_s=3,
-            device=DEVICE,
-            torch_dtype=torch.float32,
-            return_timestamps="word",
-        )
-        L.debug("Done, initalizing processor and config...")
-        processor = WhisperProcessor.from_pretrained(base)
+        self.backend = get_backend(backend, model, base=base, precision=precision, device=device).load()
+        self.precision = self.backend.precision
+        self.device = self.backend.device
+        L.debug(f"{self.name} running in {self.precision} on {self.device} with the {self.backend.name} backend")
         L.debug(f"{self.name} initialization done.")
 
         # force decoder IDs to create language
@@ -88,6 +96,31 @@ class ArbatraryASRModel(object):
         # save the target sample rate
         self.sample_rate = target_sample_rate
 
+        self.streaming = streaming
+        self.vad = vad
+        self.batch_size = self.auto_batch_size() if batch_size == "auto" else max(1, int(batch_size or 1))
+        L.debug(f"{self.name} using batch size {self.batch_size}")
+
+    def auto_batch_size(self, max_batch_size=32):
+        """Picks a batch size from the memory that is free on the inference device.
+
+        Every chunk in a batch needs its own encoder activations and decoder
+        cache, which we estimate as a fraction of the model weights.
+
+        Returns
+        -------
+        int
+            The number of chunks to decode per forward pass.
+        """
+        model_bytes = self.backend.model_bytes()
+        per_chunk = max(64 * 2**20, model_bytes // 8)
+        if self.device.type == "cuda":
+            free = torch.cuda.mem_get_info()[0]
+        else:
+            # leave half of the free RAM to the rest of the pipeline
+            free = psutil.virtual_memory().available // 2
+        return int(max(1, min(max_batch_size, free // per_chunk)))
+
     def load(self, f):
         """Load an audio file for procesing.
 
@@ -100,9 +133,15 @@ class ArbatraryASRModel(object):
 
         Returns
         -------
-        Tuple[ASRAudioFile, List[dict]]
-            Return processed audio file and speaker segments.
+        ASRAudioFile | StreamingAudioFile
+            Return processed audio file. In streaming mode the audio is only read
+            from disk once it is needed.
         """
+        if self.streaming:
+            return StreamingAudioFile(f, self.sample_rate)
+        if not can_stream(f):
+            # ex: videos, have ffmpeg decode straight to 16 kHz mono instead of going through a converted file
+            return ASRAudioFile(f, load_pcm(f, self.sample_rate), self.sample_rate)
 
         # function: load and resample audio
         audio_arr, rate = load(f)
@@ -118,37 +157,10 @@ class ArbatraryASRModel(object):
         return ASRAudioFile(f, resampled, self.sample_rate)
 
     def __call__(self, data, segments=None):
-        # we now perform the sweep line algorithm to align the
-        # segment timestamps against the words
-        groups = []
-
-        L.info(f"{self.name} transcribing file...")
-        L.debug(f"{self.name} Preprocessing...")
-        if segments is not None:
-            secs = np.array(range(len(segments))) * 0.5 + 0.1 / 2.0
-            cur_start = 0
-            cur_spk = segments[0]
-
-            for indx, i in zip(secs, segments):
-                if i != cur_spk:
-                    # results is by 0.1 second steps
-                    groups.append({
-                        "type": "segment",
-                        "start": cur_start/10,
-                        "end": indx/10,
-                        "payload": int(cur_spk)
-                    })
-                    cur_start = indx
-                    cur_spk = i
-        else:
-            groups.append({
-                "type": "segment",
-                "start": 0,
-                "end": len(data)/self.sample_rate,
-                "payload": 0
-            })
-
-        L.debug(f"{self.name} Transcribing...")
+        return self.transcribe_many([data], [segments])[0]
+
+    def generate_config(self):
+        """The generate kwargs passed to the HF pipeline."""
         config = {
             "repetition_penalty": 1.001,
             "generation_config": self.__config,
@@ -165,93 +177,144 @@ class ArbatraryASRModel(object):
                 # "task": "transcribe",
                 # "language": self.lang
             }
-        words = None
+        return config
+
+    def transcribe_many(self, datas, segments=None):
+        """Transcribes several audio arrays at once.
+
+        The chunks of all the inputs are packed into the same batches, so
+        short files fill up a batch together instead of each running alone.
+
+        Parameters
+        ----------
+        datas : List[torch.Tensor | StreamingAudioFile]
+            The audio of each file, as returned by `load(f).all()`, or `load(f)`
+            itself in streaming mode.
+        segments : optional, List[Optional[List[int]]]
+            The speaker frames of each file.
+
+        Returns
+        -------
+        List[dict]
+            The monologues of each file, in the same order as the inputs.
+        """
+        segments = segments or [None] * len(datas)
+        L.info(f"{self.name} transcribing {len(datas)} file(s) with batch size {self.batch_size}...")
+        words = self.transcribe_words(datas)
+        return [self.postprocess(chunks, len(data), segs) for chunks, data, segs in zip(words, datas, segments)]
+
+    def transcribe_words(self, datas):
+        """Transcribes several audio arrays at once, without turning the words into monologues.
+
+        Parameters
+        ----------
+        datas : List[torch.Tensor | StreamingAudioFile]
+            See `transcribe_many`.
+
+        Returns
+        -------
+        List[List[dict]]
+            The word chunks of each file, {"text": str, "timestamp": (start, end)} in seconds.
+        """
+        # the speech regions are only known once VAD ran, so there is no total then
+        self.track_progress(None if self.vad else sum(count_windows(len(data), self.sample_rate, CHUNK_LENGTH_S, STRIDE_LENGTH_S) for data in datas))
+        try:
+            if self.vad:
+                words = self.transcribe_speech(datas)
+                return [words.get(i, []) for i in range(len(datas))]
+            if self.streaming or any(isinstance(data, StreamingAudioFile) for data in datas):
+                words = self.transcribe_windows(datas)
+                return [words.get(i, []) for i in range(len(datas))]
+            return [output["chunks"] for output in self.run_pipe([data.cpu().numpy() for data in datas])]
+        finally:
+            self.backend.on_batch = None
+
+    def track_progress(self, total):
+        """Reports the decoded windows as "chunks" progress events, see progress.py.
+
+        Parameters
+        ----------
+        total : int | None
+            How many windows will be decoded, None if unknown.
+        """
+        done = 0
+
+        def on_batch(n):
+            nonlocal done
+            done += n
+            progress.report("chunks", done=done, total=total)
+
+        self.backend.on_batch = on_batch
+        progress.report("chunks", done=0, total=total)
+
+    def run_pipe(self, inputs):
+        config = self.generate_config()
         try:
-            words = self.pipe(data.cpu().numpy(),
-                                batch_size=1, 
-                                generate_kwargs=config)
+            return self.backend.transcribe(inputs,
+                                           batch_size=self.batch_size,
+                                           generate_kwargs=config)
         except ValueError as e:
-            if e.args[0].startswith('Cannot specify `task` or `language`'):
-                words = self.pipe(data.cpu().numpy(),
-                                batch_size=1, 
-                                generate_kwargs=config)
+            if not e.args[0].startswith('Cannot specify `task` or `language`'):
+                raise
+            config = {k: v for k, v in config.items() if k not in ("task", "language")}
+            return self.backend.transcribe(inputs,
+                                           batch_size=self.batch_size,
+                                           generate_kwargs=config)
+
+    def transcribe_windows(self, datas):
+        """Feeds the audio to the pipeline as a stream of 25 second windows, so only a
+        few windows are ever in memory, then puts the words back on each file's timeline.
+
+        Returns
+        -------
+        Dict[int, List[dict]]
+            The word chunks by index into `datas`.
+        """
+        windows = deque()
 
-        # to filter out the one word prompt
-        words = words["chunks"]
+        def stream():
+            for i, data in enumerate(datas):
+                if isinstance(data, StreamingAudioFile):
+                    yield from data.windows(CHUNK_LENGTH_S, STRIDE_LENGTH_S, index=i, windows=windows)
+                else:
+                    yield from iter_windows([data.cpu().numpy()], self.sample_rate, CHUNK_LENGTH_S, STRIDE_LENGTH_S, index=i, windows=windows)
 
-        # filter out the elements in the prompt, which has timestamp (0,0)
-        # words = list(filter(lambda x:x["timestamp"] != (0.0, 0.0), words))
+        return stitch_window_words(self.run_pipe(stream()), windows)
 
+    def transcribe_speech(self, datas):
+        """Only sends the regions with speech in them to the pipeline, then puts the
+        words back on each file's timeline.
 
+        Returns
+        -------
+        Dict[int, List[dict]]
+            The word chunks by index into `datas`.
+        """
+        windows = deque()
+
+        def stream():
+            for i, data in enumerate(datas):
+                streamed = isinstance(data, StreamingAudioFile)
+                audio = None if streamed else data.cpu().numpy()
+                regions = detect_speech(data.blocks() if streamed else [audio], self.sample_rate)
+                skipped = len(data) / self.sample_rate - sum(end - start for start, end in regions)
+                L.debug(f"{self.name} VAD found {len(regions)} speech regions, skipping {skipped:.1f}s of silence")
+                # a streamed file is read once more for all its regions, not once per region
+                cuts = data.regions(regions) if streamed else None
+                for start, end in regions:
+                    windows.append(AudioWindow(index=i, offset=start, keep_start=float("-inf"), keep_end=float("inf")))
+                    if streamed:
+                        region = next(cuts)
+                    else:
+                        region = audio[int(start * self.sample_rate):int(end * self.sample_rate)]
+                    yield {"raw": region, "sampling_rate": self.sample_rate}
+
+        return stitch_window_words(self.run_pipe(stream()), windows)
+
+    def postprocess(self, words, data_len, segments=None):
+        # sweep the words against the speaker segments, see asr_postprocess
         L.debug(f"{self.name} Postprocessing...")
-        for word in words:
-            groups.append({
-                "type": "text",
-                "start": word["timestamp"][0],
-                "end": word["timestamp"][1],
-                "payload": word["text"]
-            })
-
-        # sorting the output to perform sweep
-        groups = list(sorted(groups, key=lambda x:x["start"]))
-
-        # tally turns together
-        turns = []
-        current_speaker = 0
-        current_turn = []
-
-        current_segment = groups.pop(0)
-        while len(groups) > 0:
-            element = groups.pop(0)
-
-            if element["type"] == "text":
-                pl = element["payload"].strip()
-                pl = pl.replace("「", "")
-                pl = pl.replace("」", "")
-                before = re.findall(r"^\W+", pl)
-                after = re.findall(r"\W+$", pl)
-                texts = []
-                if len(before) > 0:
-                    texts.append({
-                        "type": "punct",
-                        "ts": element["start"],
-                        "end_ts": element["end"] if element["end"] else element["start"]+1,
-                        "value": before[0],
-                    })
-                    pl = pl.strip(before[0])
-                if len(after) > 0:
-                    pl = pl.strip(after[0])
-                texts.append({
-                    "type": "text",
-                    "ts": element["start"],
-                    "end_ts": element["end"] if element["end"] else element["start"]+1,
-                    "value": pl.strip(),
-                })
-                if len(after) > 0:
-                    texts.append({
-                        "type": "punct",
-                        "ts": element["start"],
-                        "end_ts": element["end"] if element["end"] else element["start"]+1,
-                        "value": after[0],
-                    })
-
-                for text in texts:
-                    if text["ts"] != text["end_ts"] and text["value"].strip() != "…" and text["value"].strip() != "":
-                        # text with no DTW time is likely a spurious retrace
-                        current_turn.append(text)
-            elif element["type"] == "segment" and current_speaker != element["payload"]:
-                turns.append({
-                    "elements": current_turn,
-                    "speaker": current_speaker[0] if type(current_speaker) == tuple else current_speaker
-                })
-                current_speaker = element["payload"],
-                current_turn = []
-
-        turns.append({
-            "elements": current_turn,
-            "speaker": current_speaker[0] if type(current_speaker) == tuple else current_speaker
-        })
-
+        result = words_to_turns(words, data_len/self.sample_rate, segments)
         L.debug(f"{self.name} Done.")
-        return ({"monologues": turns})
+        return result
 
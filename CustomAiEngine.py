@@ -1,19 +1,27 @@
 from batchalign.document import *
 from batchalign.pipelines.base import *
 from batchalign.pipelines.asr.utils import *
-from batchalign.models import WhisperASRModel, BertUtteranceModel, BertCantoneseUtteranceModel
+from batchalign.models import BertUtteranceModel, BertCantoneseUtteranceModel
 
 import pycountry
+import torch
 
 import logging
+import os
 
 from ArbitraryASRModel import ArbatraryASRModel
+from asr_postprocess import words_to_turns
+from audio_io import StreamingAudioFile, can_stream
+from sharding import ShardPool, transcribe_sharded
+from profiling import audio_duration
 
 L = logging.getLogger("batchalign")
 
+# most audio `prefetch` runs ahead at once, 10 minutes at 16 kHz is about 40MB of samples
+PREFETCH_SECONDS = 600
+
 from batchalign.utils.utils import correct_timing
-from huggingface_hub.hf_api import repo_exists as is_valid_model_id
-from batchalign.pipelines.asr.whisper import WhisperEngine
+from hf_models import is_model_available
 from batchalign.models import resolve
 
 class CustomAiEngine(BatchalignEngine):
@@ -27,8 +35,8 @@ class CustomAiEngine(BatchalignEngine):
         else:
             return [ Task.ASR ]
 
-    def __init__(self, model=None, lang="eng"):
-        if not is_valid_model_id(model):
+    def __init__(self, model=None, lang="eng", batch_size=1, streaming=False, vad=False, precision="fp32", backend="hf", shards=1, device=None):
+        if not is_model_available(model):
             raise Exception(f"{model} is not a valid model!")
             model = "talkbank/CHATUtterance-en"
         try:
@@ -39,8 +47,20 @@ class CustomAiEngine(BatchalignEngine):
                 language = "Greek"
         except:
             language = None
-        self.__whisper = ArbatraryASRModel(model, language=language)
+        self.__whisper_kwargs = dict(model=model, language=language, batch_size=batch_size, streaming=streaming, vad=vad, precision=precision, backend=backend, device=device)
+        # long recordings get their ASR split over this many processes, see sharding.py
+        self.__shards = max(1, int(shards or 1))
+        if self.__shards > 1:
+            # the shard processes have the model, this one only loads it for a file they cant read
+            self.__whisper = None
+            # the shards are small enough to be read whole
+            self.__pool = ShardPool({**self.__whisper_kwargs, "streaming": False}, self.__shards)
+        else:
+            self.__whisper = ArbatraryASRModel(**self.__whisper_kwargs)
+            self.__pool = None
         self.__lang = lang
+        # ASR results that were computed ahead of time, by `__prefetch_key`
+        self.__prefetched = {}
 
         if resolve("utterance", self.__lang or 'eng') != None:
             L.debug("Initializing utterance model...")
@@ -53,8 +73,76 @@ class CustomAiEngine(BatchalignEngine):
         else:
             self.__engine = None
 
+    def warm_up(self):
+        """Runs whisper once on a second of silence, so the first file does not pay for the first inference."""
+        if self.__pool is not None:
+            self.__pool.warm_up()
+            return
+        self.__whisper(torch.zeros(self.__whisper.sample_rate))
+
+    def close(self):
+        """Stops the shard processes, see `transcribe_proc.release_engines`."""
+        if self.__pool is not None:
+            self.__pool.close()
+
+    def __model(self):
+        if self.__whisper is None:
+            self.__whisper = ArbatraryASRModel(**self.__whisper_kwargs)
+        return self.__whisper
+
+    def __load(self, source_path):
+        audio = self.__model().load(source_path)
+        # streamed files are read by the model as it goes
+        return audio if isinstance(audio, StreamingAudioFile) else audio.all()
+
+    @staticmethod
+    def __prefetch_key(source_path):
+        # a file that was changed since it was run ahead is run again
+        try:
+            stat = os.stat(source_path)
+        except OSError:
+            return None
+        return (os.path.abspath(source_path), stat.st_size, stat.st_mtime_ns)
+
+    def forget_prefetched(self, keep=()):
+        """Drops the results run ahead for files that are not in keep, ex: a file that came from the
+        cache or a checkpoint instead, or failed before its ASR, so it never got to `generate`."""
+        keys = {self.__prefetch_key(path) for path in keep}
+        for key in [key for key in self.__prefetched if key not in keys]:
+            del self.__prefetched[key]
+
+    def prefetch(self, source_paths, max_seconds=PREFETCH_SECONDS):
+        """Runs the ASR for several files at once so that their chunks share batches.
+        The results are picked up by `generate` when each file reaches this engine.
+
+        Only the first files that add up to max_seconds of audio are run, so a long queue is
+        never all in memory at once, the rest are run ahead when they come up.
+        """
+        if self.__shards > 1:
+            # sharded files already use all the cores, one at a time
+            return
+        todo, seconds = [], 0.0
+        for path in source_paths:
+            if self.__prefetch_key(path) in self.__prefetched or path in todo:
+                continue
+            seconds += audio_duration(path) or float("inf")
+            if seconds > max_seconds:
+                break
+            todo.append(path)
+        if len(todo) < 2:
+            # a single file runs just as well when it gets here
+            return
+        results = self.__model().transcribe_many([self.__load(p) for p in todo])
+        for key, res in zip(map(self.__prefetch_key, todo), results):
+            if key is not None:
+                self.__prefetched[key] = res
+
     def generate(self, source_path, **kwargs):
-        res = self.__whisper(self.__whisper.load(source_path).all())
+        res = self.__prefetched.pop(self.__prefetch_key(source_path), None)
+        if res is None and self.__pool is not None and can_stream(source_path):
+            res = words_to_turns(transcribe_sharded(source_path, self.__pool), audio_duration(source_path))
+        if res is None:
+            res = self.__model()(self.__load(source_path))
         # for some reason the lang needs to be set here even if we previously didnt want to use it
         doc = process_generation(res, self.__lang or 'eng', utterance_engine=self.__engine)
 
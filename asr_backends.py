@@ -0,0 +1,344 @@
+"""Inference engines that ArbatraryASRModel can run whisper with.
+
+Every backend has the same contract:
+    load()            loads the model, only called once, before the first transcribe.
+    transcribe(...)   turns audio windows into word chunks with timestamps, like the HF pipeline.
+    capabilities()    what the backend supports on this machine, so callers can pick one.
+
+The "hf" backend is the transformers pipeline the transcriber always used. The
+"onnx" backend runs an ONNX export of the same model with ONNX Runtime on the CPU,
+which is often faster than pytorch on machines without a GPU. The export is done
+once, locally, and kept under ~/.cfg/onnx_models.
+"""
+import logging
+import re
+from pathlib import Path
+
+import torch
+from transformers import WhisperTokenizer, pipeline
+
+from hf_models import load_pretrained, local_model_path
+from user_config import CONFIG_DIR
+
+L = logging.getLogger("batchalign")
+
+DEVICE = torch.device('cuda') if torch.cuda.is_available() else torch.device("mps") if torch.backends.mps.is_available() else torch.device('cpu')
+# how the audio is cut into windows for whisper, in seconds
+CHUNK_LENGTH_S = 25
+STRIDE_LENGTH_S = 3
+# where the model can be asked to run, "auto" is DEVICE
+DEVICES = ("auto", "cpu", "cuda")
+# numeric precision the model can run in, see `resolve_precision`
+PRECISIONS = ("fp32", "bf16", "fp16", "int8")
+TORCH_DTYPES = {"fp32": torch.float32, "bf16": torch.bfloat16, "fp16": torch.float16, "int8": torch.float32}
+# where the onnx exports are kept
+ONNX_DIR = CONFIG_DIR / "onnx_models"
+
+
+def bf16_supported(device=DEVICE) -> bool:
+    """
+    Returns:
+        bool: if the device has fast bfloat16 math (ex: AVX512-BF16/AMX CPUs, Ampere+ GPUs).
+    """
+    if device.type == "cuda":
+        return torch.cuda.is_bf16_supported()
+    if device.type == "cpu":
+        try:
+            return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+        except Exception:
+            return False
+    return False
+
+
+def resolve_precision(precision, device=DEVICE) -> str:
+    """Picks the precision to actually run in, falling back to fp32 when the device cant do the requested one.
+
+    Args:
+        precision (str): one of PRECISIONS. "int8" is dynamic quantization of the linear layers and always runs on the CPU.
+        device (torch.device): the device the model would run on.
+
+    Returns:
+        str: the precision to use.
+    """
+    precision = str(precision or "fp32").lower()
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision {precision}, expected one of {', '.join(PRECISIONS)}")
+    if precision == "bf16" and not bf16_supported(device):
+        L.warning(f"bf16 is not supported on {device}, using fp32")
+        return "fp32"
+    if precision == "fp16" and device.type == "cpu":
+        L.warning("fp16 is only supported on a GPU, using fp32")
+        return "fp32"
+    return precision
+
+
+def resolve_device(device=None) -> torch.device:
+    """Picks the device to actually run on, falling back to DEVICE when the requested one is not there.
+
+    Args:
+        device (str, optional): one of DEVICES, None is "auto".
+
+    Returns:
+        torch.device: the device.
+    """
+    device = str(device or "auto").lower()
+    if device not in DEVICES:
+        raise ValueError(f"Unknown device {device}, expected one of {', '.join(DEVICES)}")
+    if device == "cuda" and not torch.cuda.is_available():
+        L.warning(f"There is no GPU, running on {DEVICE} instead")
+        return DEVICE
+    return DEVICE if device == "auto" else torch.device(device)
+
+
+class ASRBackend:
+    """Base class of the inference engines, see the module docstring for the contract."""
+    name = None
+    # called with the number of windows in every batch that gets decoded, see `watch_batches`
+    on_batch = None
+
+    def __init__(self, model, base="openai/whisper-large-v3", precision="fp32", device=None):
+        """
+        Args:
+            model (str): huggingface model id (or local path) of the whisper model.
+            base (str): the whisper model the tokenizer comes from.
+            precision (str): one of PRECISIONS, backends fall back to what they support.
+            device (str, optional): one of DEVICES, backends that only run on the CPU ignore it.
+        """
+        self.model = model
+        self.base = base
+        self.precision = precision
+        self.device = torch.device("cpu")
+
+    def load(self):
+        raise NotImplementedError
+
+    def watch_batches(self, model):
+        """Wraps the model's generate so that every decoded batch is reported to `on_batch`, for the progress of long files."""
+        generate = model.generate
+
+        def counted(*args, **kwargs):
+            output = generate(*args, **kwargs)
+            features = args[0] if args else kwargs.get("input_features", kwargs.get("inputs"))
+            if self.on_batch is not None and getattr(features, "shape", None) is not None:
+                self.on_batch(int(features.shape[0]))
+            return output
+
+        model.generate = counted
+
+    def transcribe(self, inputs, batch_size=1, generate_kwargs=None):
+        """
+        Args:
+            inputs (Iterable[dict] | List[np.ndarray]): audio, either whole 16 kHz arrays (cut into
+                windows by the backend) or {"raw": np.ndarray, "sampling_rate": int} windows.
+            batch_size (int): windows per forward pass.
+            generate_kwargs (dict, optional): passed to whisper's generate.
+
+        Returns:
+            Iterable[dict]: {"text": str, "chunks": [{"text": str, "timestamp": (start, end)}]} per input, in order.
+        """
+        raise NotImplementedError
+
+    def capabilities(self) -> dict:
+        """
+        Returns:
+            dict: word_timestamps (bool), batching (bool), devices (List[str]) and precisions (List[str]).
+        """
+        raise NotImplementedError
+
+    def model_bytes(self) -> int:
+        """
+        Returns:
+            int: rough size of the loaded weights, used to pick a batch size.
+        """
+        return 0
+
+
+class HFPipelineBackend(ASRBackend):
+    """The transformers pipeline, in pytorch. Runs on any device and in any of the PRECISIONS."""
+    name = "hf"
+
+    def __init__(self, model, base="openai/whisper-large-v3", precision="fp32", device=None):
+        device = resolve_device(device)
+        super().__init__(model, base, resolve_precision(precision, device))
+        # quantized linear layers only have CPU kernels
+        self.device = torch.device("cpu") if self.precision == "int8" else device
+        self.pipe = None
+
+    def load(self):
+        self.pipe = pipeline(
+            "automatic-speech-recognition",
+            # downloaded models load without the network, see hf_models.load_pretrained
+            model=local_model_path(self.model) or self.model,
+            tokenizer=load_pretrained(WhisperTokenizer.from_pretrained, self.base),
+            chunk_length_s=CHUNK_LENGTH_S,
+            stride_length_s=STRIDE_LENGTH_S,
+            device=self.device,
+            torch_dtype=TORCH_DTYPES[self.precision],
+            return_timestamps="word",
+        )
+        if self.precision == "int8":
+            self.pipe.model = torch.ao.quantization.quantize_dynamic(self.pipe.model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.watch_batches(self.pipe.model)
+        return self
+
+    def transcribe(self, inputs, batch_size=1, generate_kwargs=None):
+        return self.pipe(inputs, batch_size=batch_size, generate_kwargs=generate_kwargs or {})
+
+    def capabilities(self) -> dict:
+        devices = ["cpu"] + (["cuda"] if torch.cuda.is_available() else []) + (["mps"] if torch.backends.mps.is_available() else [])
+        return {
+            "word_timestamps": True,
+            "batching": True,
+            "devices": devices,
+            "precisions": ["fp32", "int8"] + (["bf16"] if bf16_supported(DEVICE) else []) + (["fp16"] if DEVICE.type != "cpu" else []),
+        }
+
+    def model_bytes(self) -> int:
+        return sum(p.numel() * p.element_size() for p in self.pipe.model.parameters())
+
+
+def onnx_model_dir(model) -> Path:
+    """
+    Returns:
+        Path: where the onnx export of the model is kept.
+    """
+    return ONNX_DIR / re.sub(r"[^\w.-]+", "--", str(model))
+
+
+def export_onnx(model, output_dir=None) -> Path:
+    """Exports a whisper model to ONNX once, so the onnx backend can load it.
+
+    Args:
+        model (str): huggingface model id (or local path).
+        output_dir (str | Path, optional): defaults to `onnx_model_dir(model)`.
+
+    Returns:
+        Path: the directory with the exported model and its processor.
+    """
+    from optimum.onnxruntime import ORTModelForSpeechSeq2Seq
+    from transformers import AutoProcessor
+
+    output_dir = Path(output_dir or onnx_model_dir(model))
+    L.info(f"Exporting {model} to ONNX in {output_dir}, this only happens once...")
+    ORTModelForSpeechSeq2Seq.from_pretrained(local_model_path(model) or model, export=True).save_pretrained(output_dir)
+    load_pretrained(AutoProcessor.from_pretrained, model).save_pretrained(output_dir)
+    return output_dir
+
+
+def words_from_segments(chunks):
+    """Spreads each timestamped segment over its words, in proportion to their length.
+    Used when a backend can only give segment level timestamps.
+
+    Returns:
+        List[dict]: {"text": str, "timestamp": (start, end)} per word.
+    """
+    words = []
+    for chunk in chunks:
+        start, end = chunk["timestamp"]
+        tokens = chunk["text"].split()
+        if not tokens:
+            continue
+        if start is None or end is None or end <= start:
+            words.extend({"text": f" {token}", "timestamp": (start, end)} for token in tokens)
+            continue
+        total = sum(len(token) for token in tokens)
+        t = start
+        for token in tokens:
+            length = (end - start) * len(token) / total
+            words.append({"text": f" {token}", "timestamp": (round(t, 2), round(t + length, 2))})
+            t += length
+    return words
+
+
+class ONNXBackend(ASRBackend):
+    """An ONNX export of the model run by ONNX Runtime on the CPU, through optimum.
+
+    The exported decoder does not return the cross attentions that word level timestamps
+    are computed from, so the words get timestamps spread over their segment instead.
+    The forced alignment step later in the pipeline fixes up the word timings.
+    """
+    name = "onnx"
+
+    def __init__(self, model, base="openai/whisper-large-v3", precision="fp32", device=None):
+        precision = str(precision or "fp32").lower()
+        if precision != "fp32":
+            L.warning(f"The onnx backend only runs in fp32, ignoring precision {precision}")
+        if str(device or "auto").lower() not in ("auto", "cpu"):
+            L.warning(f"The onnx backend only runs on the CPU, ignoring device {device}")
+        super().__init__(model, base, "fp32")
+        self.pipe = None
+
+    def load(self):
+        try:
+            from optimum.onnxruntime import ORTModelForSpeechSeq2Seq
+        except ImportError as e:
+            raise ImportError("The onnx ASR backend needs optimum, install it with: pip install optimum[onnxruntime]") from e
+        from transformers import AutoFeatureExtractor
+
+        model_dir = onnx_model_dir(self.model)
+        if not (model_dir / "config.json").exists():
+            export_onnx(self.model, model_dir)
+        self.pipe = pipeline(
+            "automatic-speech-recognition",
+            model=ORTModelForSpeechSeq2Seq.from_pretrained(model_dir, provider="CPUExecutionProvider"),
+            tokenizer=load_pretrained(WhisperTokenizer.from_pretrained, self.base),
+            feature_extractor=AutoFeatureExtractor.from_pretrained(model_dir),
+            chunk_length_s=CHUNK_LENGTH_S,
+            stride_length_s=STRIDE_LENGTH_S,
+            return_timestamps=True,
+        )
+        self.watch_batches(self.pipe.model)
+        return self
+
+    def transcribe(self, inputs, batch_size=1, generate_kwargs=None):
+        outputs = self.pipe(inputs, batch_size=batch_size, generate_kwargs=generate_kwargs or {})
+        to_words = lambda output: {**output, "chunks": words_from_segments(output.get("chunks", []))}
+        # lists are transcribed right away, streams as they are consumed, same as the pipeline
+        return [to_words(output) for output in outputs] if isinstance(outputs, list) else map(to_words, outputs)
+
+    def capabilities(self) -> dict:
+        try:
+            import onnxruntime
+            available = "CPUExecutionProvider" in onnxruntime.get_available_providers()
+        except ImportError:
+            available = False
+        return {
+            "word_timestamps": False,
+            "batching": True,
+            "devices": ["cpu"] if available else [],
+            "precisions": ["fp32"],
+        }
+
+    def model_bytes(self) -> int:
+        model_dir = onnx_model_dir(self.model)
+        return sum(f.stat().st_size for f in model_dir.glob("*.onnx*")) if model_dir.exists() else 0
+
+
+BACKENDS = {
+    HFPipelineBackend.name: HFPipelineBackend,
+    ONNXBackend.name: ONNXBackend,
+}
+
+
+def get_backend(name, model, base="openai/whisper-large-v3", precision="fp32", device=None) -> ASRBackend:
+    """
+    Args:
+        name (str): one of BACKENDS, ex: "hf" or "onnx".
+        device (str, optional): one of DEVICES, see `resolve_device`.
+
+    Returns:
+        ASRBackend: the backend, not loaded yet.
+    """
+    name = str(name or "hf").lower()
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown ASR backend {name}, expected one of {', '.join(BACKENDS)}")
+    return BACKENDS[name](model, base=base, precision=precision, device=device)
+
+
+if __name__ == "__main__":
+    # python asr_backends.py export <model id> [output dir]
+    import sys
+    if len(sys.argv) < 3 or sys.argv[1] != "export":
+        print(f"Usage: {sys.argv[0]} export <model id> [output dir]")
+        sys.exit(1)
+    print(export_onnx(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None))
@@ -0,0 +1,128 @@
+"""Turns the word chunks of the whisper pipeline into batchalign's monologue format.
+
+This used to live in `ArbatraryASRModel.postprocess`, which drained a sorted list
+with `pop(0)` (quadratic in the number of words) and ran uncompiled regexes and a
+handful of string passes per word. Here it is a single pass over the sorted words
+with the patterns compiled once. Speaker turns come from a run-length encoding of
+the diarization frames, and each word goes to the turn it overlaps the most. It
+only needs the standard library and numpy so it can be benchmarked without
+loading any model.
+"""
+import re
+
+import numpy as np
+
+# punctuation glued to the start or end of a word becomes its own element
+LEADING_PUNCT = re.compile(r"^\W+")
+TRAILING_PUNCT = re.compile(r"\W+$")
+# japanese quotes that whisper likes to emit
+QUOTES = str.maketrans("", "", "「」")
+# diarization frame i starts at i * FRAME_SECONDS + FRAME_OFFSET seconds
+FRAME_SECONDS = 0.05
+FRAME_OFFSET = 0.005
+
+
+def speaker_runs(segments, duration):
+    """Run-length encodes the per-frame speaker labels of the diarization.
+
+    Args:
+        segments (List[int]): speaker label of every diarization frame.
+        duration (float): length of the audio in seconds, the last run is stretched to it.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: start and end in seconds, and speaker, of every run.
+    """
+    labels = np.asarray(segments)
+    if len(labels) == 0:
+        return np.zeros(0), np.zeros(0), np.zeros(0, dtype=int)
+    first = np.concatenate([[0], np.flatnonzero(labels[1:] != labels[:-1]) + 1])
+    starts = first * FRAME_SECONDS + FRAME_OFFSET
+    # the first run covers everything before the first frame
+    starts[0] = 0.0
+    ends = np.append(starts[1:], max(duration, len(labels) * FRAME_SECONDS + FRAME_OFFSET))
+    return starts, ends, labels[first].astype(int)
+
+
+def assign_speakers(word_starts, word_ends, run_starts, run_ends, run_speakers):
+    """Gives every word the speaker of the run it overlaps the most.
+
+    Words inside a single run are looked up with a binary search, only the few words
+    that straddle a turn boundary have their overlaps compared one by one.
+
+    Args:
+        word_starts, word_ends (np.ndarray): the words, in seconds. A word with no length belongs to the run it is in.
+        run_starts, run_ends, run_speakers (np.ndarray): from `speaker_runs`.
+
+    Returns:
+        np.ndarray: the speaker of every word.
+    """
+    n = len(run_starts)
+    word_ends = np.maximum(word_ends, word_starts)
+    first = np.clip(np.searchsorted(run_ends, word_starts, side="right"), 0, n - 1)
+    last = np.clip(np.searchsorted(run_starts, word_ends, side="left") - 1, first, n - 1)
+    best = first.copy()
+    for w in np.flatnonzero(last > first):
+        runs = np.arange(first[w], last[w] + 1)
+        overlap = np.minimum(word_ends[w], run_ends[runs]) - np.maximum(word_starts[w], run_starts[runs])
+        best[w] = runs[np.argmax(overlap)]
+    return run_speakers[best]
+
+
+def split_word(text, start, end):
+    """Splits one whisper word into its leading punctuation, the word and its trailing punctuation.
+
+    Returns:
+        List[dict]: the elements worth keeping, empty if the word should be dropped.
+    """
+    end_ts = end if end else start + 1
+    if start == end_ts:
+        # text with no DTW time is likely a spurious retrace
+        return []
+    pl = text.strip().translate(QUOTES)
+    before = LEADING_PUNCT.search(pl)
+    after = TRAILING_PUNCT.search(pl)
+    pieces = []
+    if before:
+        pieces.append(("punct", before.group()))
+        pl = pl.strip(before.group())
+    if after:
+        pl = pl.strip(after.group())
+    pieces.append(("text", pl.strip()))
+    if after:
+        pieces.append(("punct", after.group()))
+    return [
+        {"type": kind, "ts": start, "end_ts": end_ts, "value": value}
+        for kind, value in pieces
+        if value.strip() not in ("", "…")
+    ]
+
+
+def words_to_turns(words, duration, segments=None):
+    """Groups the words into speaker turns.
+
+    Args:
+        words (List[dict]): whisper word chunks, {"text": str, "timestamp": (start, end)}.
+        duration (float): length of the audio in seconds.
+        segments (List[int] | None): speaker label per diarization frame, or None for a single speaker.
+
+    Returns:
+        dict: {"monologues": [{"elements": [...], "speaker": int}]}.
+    """
+    words = sorted(words, key=lambda word: word["timestamp"][0])
+    if segments is None or len(segments) == 0:
+        speakers = [0] * len(words)
+    else:
+        starts = np.array([word["timestamp"][0] for word in words], dtype=float)
+        ends = np.array([word["timestamp"][1] or word["timestamp"][0] for word in words], dtype=float)
+        speakers = assign_speakers(starts, ends, *speaker_runs(segments, duration)).tolist()
+
+    turns = []
+    for word, speaker in zip(words, speakers):
+        elements = split_word(word["text"], *word["timestamp"])
+        if not elements:
+            continue
+        if turns and turns[-1]["speaker"] == speaker:
+            turns[-1]["elements"].extend(elements)
+        else:
+            turns.append({"elements": elements, "speaker": speaker})
+    return {"monologues": turns or [{"elements": [], "speaker": 0}]}
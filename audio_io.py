@@ -0,0 +1,280 @@
+"""Audio loading helpers that never hold more than a few blocks of a recording in memory.
+
+`ArbatraryASRModel.load` used to decode the whole file, resample every channel at
+full length and then downmix, which for a multi-hour stereo recording means
+several full length float32 copies in RAM. The helpers here decode, downmix and
+resample one block at a time instead.
+"""
+from dataclasses import dataclass
+from math import ceil, gcd
+
+import ffmpeg
+import numpy as np
+import soundfile
+import torch
+from torchaudio.functional import resample
+
+from ffmpeg_utils import PCM_SAMPLE_RATE, decode_to_pcm, iter_pcm_blocks
+
+# how much audio is decoded at a time
+BLOCK_SECONDS = 60.0
+# extra audio read on each side of a block so the resampling filter has context, in seconds
+RESAMPLE_CONTEXT_SECONDS = 0.05
+
+
+def can_stream(path) -> bool:
+    """
+    Returns:
+        bool: True if the file can be read block by block with soundfile.
+    """
+    try:
+        soundfile.info(str(path))
+        return True
+    except Exception:
+        return False
+
+
+def iter_audio_blocks(path, target_rate=16000, block_s=BLOCK_SECONDS, start_s=0.0, end_s=None):
+    """Decodes an audio file block by block, downmixed to mono and resampled to target_rate.
+
+    Blocks are read with a little extra context on each side, which is resampled and then
+    cut off again, so that the concatenated blocks match resampling the whole file at once.
+
+    Args:
+        path (str): the audio file.
+        target_rate (int): sample rate of the yielded blocks.
+        block_s (float): seconds of audio per block.
+        start_s (float): where to start reading, in seconds.
+        end_s (float, optional): where to stop reading, in seconds. Defaults to the end of the file.
+
+    Yields:
+        np.ndarray: float32 mono samples at target_rate.
+    """
+    with soundfile.SoundFile(str(path)) as f:
+        rate = f.samplerate
+        # block and context sizes are multiples of this, so every block resamples to a whole number of samples
+        unit = rate // gcd(rate, target_rate)
+        block = max(1, int(block_s * rate) // unit) * unit
+        context = ceil(RESAMPLE_CONTEXT_SECONDS * rate / unit) * unit
+        context_out = context * target_rate // rate
+        total = f.frames if end_s is None else min(f.frames, int(end_s * rate))
+        pos = int(start_s * rate)
+        while pos < total:
+            read_start = max(0, pos - context)
+            read_end = min(total, pos + block + context)
+            f.seek(read_start)
+            data = f.read(read_end - read_start, dtype="float32", always_2d=True).mean(axis=1)
+            if rate != target_rate:
+                data = resample(torch.from_numpy(data), rate, target_rate).numpy()
+            left = context_out if read_start < pos else 0
+            keep = ceil(min(block, total - pos) * target_rate / rate)
+            yield np.ascontiguousarray(data[left:left + keep], dtype=np.float32)
+            pos += block
+
+
+@dataclass
+class AudioWindow:
+    """Where a window that is sent to the ASR model sits in the original recording."""
+    index: int
+    offset: float
+    # the part of the window whose words we keep, the rest is covered by the neighbouring windows
+    keep_start: float
+    keep_end: float
+
+
+def iter_windows(blocks, rate=16000, chunk_s=25.0, stride_s=3.0, index=0, windows=None):
+    """Cuts a stream of audio blocks into overlapping fixed size windows.
+
+    Every window overlaps its neighbours by `stride_s` on each side, the same way the HF
+    pipeline chunks a full file. Only the middle of each window is kept when stitching,
+    see `AudioWindow`.
+
+    Args:
+        blocks (Iterable[np.ndarray]): the audio, ex: from `iter_audio_blocks`.
+        rate (int): sample rate of the blocks.
+        chunk_s (float): window length in seconds.
+        stride_s (float): overlap on each side in seconds.
+        index (int): passed through to `AudioWindow.index`, ex: which file this is.
+        windows (deque, optional): the `AudioWindow` of every yielded window is appended here.
+
+    Yields:
+        dict: {"raw": np.ndarray, "sampling_rate": rate} inputs for the HF pipeline.
+    """
+    chunk = int(chunk_s * rate)
+    hop = chunk - 2 * int(stride_s * rate)
+    buffer = np.zeros(0, dtype=np.float32)
+    start = 0
+    pending = None
+
+    def emit(arr, start, is_last):
+        offset = start / rate
+        if windows is not None:
+            windows.append(AudioWindow(
+                index=index,
+                offset=offset,
+                keep_start=offset + (stride_s if start > 0 else 0.0),
+                keep_end=float("inf") if is_last else offset + chunk_s - stride_s,
+            ))
+        return {"raw": arr, "sampling_rate": rate}
+
+    for data in blocks:
+        buffer = np.concatenate([buffer, data])
+        while len(buffer) >= chunk:
+            # hold one window back so we know if it was the last one
+            if pending is not None:
+                yield emit(*pending, is_last=False)
+            pending = (buffer[:chunk].copy(), start)
+            buffer = buffer[hop:]
+            start += hop
+    # whatever is left over has not been covered by the last full window yet
+    if pending is None or len(buffer) > chunk - hop:
+        if pending is not None:
+            yield emit(*pending, is_last=False)
+        pending = (buffer.copy(), start)
+    if pending is not None and len(pending[0]):
+        yield emit(*pending, is_last=True)
+
+
+def iter_regions(blocks, regions, rate=16000):
+    """Cuts regions out of a stream of audio blocks, in one pass over the stream.
+
+    Args:
+        blocks (Iterable[np.ndarray]): the audio, ex: from `iter_audio_blocks`.
+        regions (Iterable[Tuple[float, float]]): (start, end) in seconds, in order, ex: from `vad.detect_speech`.
+        rate (int): sample rate of the blocks.
+
+    Yields:
+        np.ndarray: the samples of every region, in order, cut short where the audio ends.
+    """
+    regions = iter(regions)
+    region = next(regions, None)
+    buffer = np.zeros(0, dtype=np.float32)
+    # where buffer[0] is in the stream, in samples
+    buffer_start = 0
+    for data in blocks:
+        buffer = np.concatenate([buffer, data])
+        while region is not None and buffer_start + len(buffer) >= int(region[1] * rate):
+            yield buffer[max(0, int(region[0] * rate) - buffer_start):int(region[1] * rate) - buffer_start].copy()
+            region = next(regions, None)
+        # only keep what the regions still to come need
+        drop = len(buffer) if region is None else min(len(buffer), max(0, int(region[0] * rate) - buffer_start))
+        buffer = buffer[drop:]
+        buffer_start += drop
+    while region is not None:
+        yield buffer[max(0, int(region[0] * rate) - buffer_start):max(0, int(region[1] * rate) - buffer_start)].copy()
+        region = next(regions, None)
+
+
+def count_windows(samples, rate=16000, chunk_s=25.0, stride_s=3.0) -> int:
+    """
+    Returns:
+        int: how many windows `iter_windows` cuts that many samples into, the HF pipeline cuts a full file about the same way.
+    """
+    chunk = int(chunk_s * rate)
+    hop = chunk - 2 * int(stride_s * rate)
+    if samples <= 0:
+        return 0
+    if samples < chunk:
+        return 1
+    full = (samples - chunk) // hop + 1
+    return full + (1 if samples - full * hop > chunk - hop else 0)
+
+
+def load_pcm(path, target_rate=16000) -> torch.Tensor:
+    """Loads a whole file as mono samples at target_rate.
+    Files soundfile cant read (ex: videos) are decoded by ffmpeg straight to 16 kHz mono, without a temp file.
+
+    Returns:
+        torch.Tensor: float32 mono samples.
+    """
+    if can_stream(path):
+        return torch.from_numpy(np.concatenate([np.zeros(0, dtype=np.float32), *iter_audio_blocks(path, target_rate)]))
+    data = torch.from_numpy(decode_to_pcm(str(path)))
+    if target_rate != PCM_SAMPLE_RATE:
+        data = resample(data, PCM_SAMPLE_RATE, target_rate)
+    return data
+
+
+class StreamingAudioFile:
+    """Drop in for batchalign's `ASRAudioFile` that reads the audio from disk as it is needed.
+
+    `chunk` and `all` behave like `ASRAudioFile`, and `windows` feeds the ASR pipeline
+    without ever loading the whole file. Files soundfile cant read are streamed through ffmpeg.
+    """
+
+    def __init__(self, file, rate=16000):
+        self.file = file
+        self.rate = rate
+        self.use_ffmpeg = not can_stream(file)
+        if self.use_ffmpeg:
+            self.duration = float(ffmpeg.probe(str(file))["format"]["duration"])
+        else:
+            info = soundfile.info(str(file))
+            self.duration = info.frames / info.samplerate
+
+    def blocks(self):
+        """
+        Yields:
+            np.ndarray: float32 mono samples at self.rate, a block at a time.
+        """
+        if not self.use_ffmpeg:
+            yield from iter_audio_blocks(self.file, self.rate)
+            return
+        for data in iter_pcm_blocks(str(self.file)):
+            if self.rate != PCM_SAMPLE_RATE:
+                data = resample(torch.from_numpy(data), PCM_SAMPLE_RATE, self.rate).numpy()
+            yield data
+
+    def __len__(self):
+        return int(round(self.duration * self.rate))
+
+    @property
+    def tensor(self):
+        return self.all()
+
+    def chunk(self, begin_ms, end_ms):
+        if self.use_ffmpeg:
+            # ffmpeg seeks to the chunk, only the chunk is decoded
+            blocks = iter_pcm_blocks(str(self.file), start_s=begin_ms / 1000, duration_s=max(0.0, end_ms - begin_ms) / 1000)
+            if self.rate != PCM_SAMPLE_RATE:
+                blocks = (resample(torch.from_numpy(data), PCM_SAMPLE_RATE, self.rate).numpy() for data in blocks)
+        else:
+            blocks = iter_audio_blocks(self.file, self.rate, start_s=begin_ms / 1000, end_s=end_ms / 1000)
+        return torch.from_numpy(np.concatenate([np.zeros(0, dtype=np.float32), *blocks]))
+
+    def all(self):
+        # only for callers that really need the whole thing in memory
+        return torch.from_numpy(np.concatenate([np.zeros(0, dtype=np.float32), *self.blocks()]))
+
+    def windows(self, chunk_s=25.0, stride_s=3.0, index=0, windows=None):
+        """See `iter_windows`."""
+        return iter_windows(self.blocks(), self.rate, chunk_s, stride_s, index, windows)
+
+    def regions(self, regions):
+        """See `iter_regions`, the file is read once for all the regions."""
+        return iter_regions(self.blocks(), regions, self.rate)
+
+
+def stitch_window_words(outputs, windows):
+    """Puts the words of every window back on the timeline of the original recording.
+
+    Args:
+        outputs (Iterable[dict]): HF pipeline outputs, in the same order as `windows`.
+        windows (deque[AudioWindow]): the windows the outputs belong to.
+
+    Returns:
+        Dict[int, List[dict]]: word chunks with absolute timestamps, by `AudioWindow.index`.
+    """
+    words = {}
+    for output in outputs:
+        window = windows.popleft()
+        kept = words.setdefault(window.index, [])
+        for word in output["chunks"]:
+            start, end = word["timestamp"]
+            start = start + window.offset if start is not None else None
+            end = end + window.offset if end is not None else None
+            # words in the overlap belong to the window where they are furthest from the edge
+            if start is not None and not (window.keep_start <= start < window.keep_end):
+                continue
+            kept.append({**word, "timestamp": (start, end)})
+    return words
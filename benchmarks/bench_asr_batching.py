@@ -0,0 +1,57 @@
+"""Throughput of ArbatraryASRModel in chunks per second at different batch sizes.
+
+Example:
+    python benchmarks/bench_asr_batching.py --model openai/whisper-tiny.en --batch-sizes 1 4 auto
+"""
+import argparse
+
+from common import DEFAULT_SAMPLE, Timer, write_results
+
+from ArbitraryASRModel import ArbatraryASRModel
+from asr_backends import CHUNK_LENGTH_S, STRIDE_LENGTH_S
+from audio_io import count_windows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="openai/whisper-tiny.en")
+    parser.add_argument("--file", default=str(DEFAULT_SAMPLE))
+    parser.add_argument("--batch-sizes", nargs="+", default=["1", "auto"], help="ints or 'auto'")
+    parser.add_argument("--files-per-batch", type=int, default=1, help="pack this many copies of the file into one call")
+    parser.add_argument("--repeat", type=int, default=2)
+    parser.add_argument("--out", default=None, help="also write the json results to this file")
+    args = parser.parse_args()
+
+    results = []
+    for batch_size in args.batch_sizes:
+        model = ArbatraryASRModel(args.model, batch_size=batch_size if batch_size == "auto" else int(batch_size))
+        audio = model.load(args.file).all()
+        duration = len(audio) / model.sample_rate
+        chunks = count_windows(len(audio), model.sample_rate, CHUNK_LENGTH_S, STRIDE_LENGTH_S) * args.files_per_batch
+        # warm up so that the first forward pass does not count
+        model(audio[:model.sample_rate * CHUNK_LENGTH_S])
+        timings = []
+        for _ in range(args.repeat):
+            with Timer() as t:
+                model.transcribe_many([audio] * args.files_per_batch)
+            timings.append(t.elapsed)
+        best = min(timings)
+        results.append({
+            "model": args.model,
+            "file": args.file,
+            "batch_size": model.batch_size,
+            "requested_batch_size": batch_size,
+            "files_per_batch": args.files_per_batch,
+            "audio_seconds": duration * args.files_per_batch,
+            "chunks": chunks,
+            "best_seconds": best,
+            "chunks_per_second": chunks / best,
+        })
+    baseline = results[0]["chunks_per_second"]
+    for r in results:
+        r["speedup_vs_first"] = r["chunks_per_second"] / baseline
+    write_results(results, args.out)
+
+
+if __name__ == "__main__":
+    main()
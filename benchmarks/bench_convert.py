@@ -0,0 +1,75 @@
+"""Time to get a video into 16 kHz mono samples: old mp3 path vs 16 kHz PCM wav vs piping ffmpeg output.
+
+Example:
+    python benchmarks/bench_convert.py --file sample/law.mov
+"""
+import argparse
+import os
+import shutil
+import tempfile
+
+from common import DEFAULT_SAMPLE, Timer, write_results
+
+import torch
+from torchaudio import load
+from torchaudio import transforms as T
+
+from audio_io import load_pcm
+from ffmpeg_utils import convert_file_to_type, decode_to_pcm
+
+TARGET_RATE = 16000
+
+
+def old_load(f):
+    """What ArbatraryASRModel.load did with the converted mp3."""
+    audio_arr, rate = load(f)
+    if rate != TARGET_RATE:
+        audio_arr = T.Resample(rate, TARGET_RATE)(audio_arr)
+    return torch.mean(audio_arr.transpose(0, 1), dim=1)
+
+
+def run_mp3(src):
+    return old_load(convert_file_to_type(src, ".mp3"))
+
+
+def run_wav(src):
+    return load_pcm(convert_file_to_type(src, ".wav"), TARGET_RATE)
+
+
+def run_pipe(src):
+    return torch.from_numpy(decode_to_pcm(src))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--file", default=str(DEFAULT_SAMPLE))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--out", default=None, help="also write the json results to this file")
+    args = parser.parse_args()
+
+    results = []
+    for name, fn in [("mp3", run_mp3), ("pcm_wav", run_wav), ("pcm_pipe", run_pipe)]:
+        timings = []
+        for _ in range(args.repeat):
+            # fresh copy every time, so the conversions are not served from the cached output file
+            with tempfile.TemporaryDirectory() as tmp:
+                src = shutil.copy(args.file, os.path.join(tmp, os.path.basename(args.file)))
+                with Timer() as t:
+                    samples = fn(src)
+                timings.append(t.elapsed)
+                disk = sum(os.path.getsize(os.path.join(tmp, f)) for f in os.listdir(tmp)) - os.path.getsize(src)
+        results.append({
+            "path": name,
+            "file": args.file,
+            "best_seconds": min(timings),
+            "mean_seconds": sum(timings) / len(timings),
+            "samples": len(samples),
+            "extra_bytes_on_disk": disk,
+        })
+    for r in results:
+        r["speedup_vs_mp3"] = results[0]["best_seconds"] / r["best_seconds"]
+    write_results(results, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Time to get the model dropdown list: one query after the other (the old way) vs all at once, against a local stub of the HF API.
+
+The stub answers /api/models after --latency seconds with made up models, so no
+network or token is needed. Also timed: the background refresh that keeps the list
+on disk, and how fast it gives up with the server gone (offline). That the lists
+are right is checked in tests/test_hf_models.py.
+
+Example:
+    python benchmarks/bench_model_list.py --queries 5 --latency 0.5
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from common import Timer, write_results
+
+from hf_models import fetch_model_list, rank_models, refresh_model_list, search_models
+
+
+def make_handler(latency):
+    class StubHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path != "/api/models":
+                self.send_error(404)
+                return
+            params = {k: v[0] for k, v in parse_qs(url.query).items()}
+            author = params.get("author", "someone")
+            models = [{"id": f"{author}/whisper-{i}", "pipeline_tag": "automatic-speech-recognition", "downloads": 1000 - i}
+                      for i in range(int(params.get("limit", 10)))]
+            # not a speech model, should be filtered out
+            models.append({"id": f"{author}/bert", "pipeline_tag": "fill-mask", "downloads": 10**6})
+            threading.Event().wait(latency)
+            body = json.dumps(models).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+    return StubHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=3, help="queries in the stand-in models.json")
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds the stub server takes per request")
+    parser.add_argument("--out", default=None, help="also write the json results to this file")
+    args = parser.parse_args()
+
+    queries = [{"author": f"author{i}", "limit": 5, "filter": "automatic-speech-recognition"} for i in range(args.queries)]
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(args.latency))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoint = f"http://127.0.0.1:{server.server_port}"
+
+    with Timer() as sequential:
+        expected = rank_models([search_models(q, endpoint=endpoint) for q in queries])
+    with Timer() as concurrent:
+        models = fetch_model_list(queries, endpoint=endpoint)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "model_list.json")
+        with Timer() as background:
+            refresh_model_list(queries, endpoint=endpoint, path=path).join()
+
+        server.shutdown()
+        server.server_close()
+        with Timer() as offline:
+            refresh_model_list(queries, endpoint=endpoint, path=path).join()
+
+    write_results({
+        "queries": args.queries,
+        "latency": args.latency,
+        "models": len(models),
+        "same_ranking": models == expected,
+        "sequential_seconds": sequential.elapsed,
+        "concurrent_seconds": concurrent.elapsed,
+        "speedup": sequential.elapsed / concurrent.elapsed,
+        "background_refresh_seconds": background.elapsed,
+        "offline_seconds": offline.elapsed,
+    }, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Makespan of a batch pipelined across files (pipeline_batch.py) against one file after the other.
+
+Both modes run the same files with the same loaded engines, in this process: first
+one untimed file so every model is loaded, then the batch with `transcribe_files`
+(the loop the CLI worker runs today) and with `transcribe_files(pipelined=True)`.
+Recorded: the makespan of each, the speedup, and whether the transcripts of the two
+modes are the same.
+
+Before that, and without any model, the same is timed on stand-in stages that sleep
+for a set time per file, next to what `expected_makespan` says it should take
+(--fake-only stops after these). That the scheduling is right is checked in
+tests/test_pipeline_dag.py.
+
+Example:
+    python benchmarks/bench_pipelining.py --model openai/whisper-base.en --files 6
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from common import DEFAULT_SAMPLE, Timer, read_cha_words, write_results
+
+from pipeline_batch import STAGE_WORKERS, StagePipeline, expected_makespan
+
+# seconds per file of the stand-in stages, roughly in the proportions of a real run
+FAKE_STAGE_S = {"asr": 0.12, "speaker": 0.06, "disfluency": 0.01, "retrace": 0.01, "utr": 0.08, "fa": 0.05}
+
+
+def time_fake_stages(files=8, stage_s=FAKE_STAGE_S):
+    def fake_transcribe(input_file, stage_runner=None):
+        for stage, seconds in stage_s.items():
+            work = lambda seconds=seconds: time.sleep(seconds)
+            stage_runner(stage, work) if stage_runner else work()
+        return {"input_file": input_file}
+
+    jobs = [{"input_file": f"file{i}"} for i in range(files)]
+    with Timer() as sequential:
+        for job in jobs:
+            fake_transcribe(**job)
+    with Timer() as pipelined, StagePipeline() as pipeline:
+        failed = sum(error is not None for _, _, error in pipeline.map(fake_transcribe, jobs))
+
+    per_worker = {}
+    for stage, seconds in stage_s.items():
+        per_worker[STAGE_WORKERS[stage]] = per_worker.get(STAGE_WORKERS[stage], 0.0) + seconds
+    expected_sequential, expected_pipelined = expected_makespan(list(per_worker.values()), files)
+    return {
+        "files": files,
+        "failed": failed,
+        "sequential_seconds": sequential.elapsed,
+        "pipelined_seconds": pipelined.elapsed,
+        "expected_sequential_seconds": expected_sequential,
+        "expected_pipelined_seconds": expected_pipelined,
+        "speedup": sequential.elapsed / pipelined.elapsed,
+        "stages": pipeline.utilization(pipelined.elapsed),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="openai/whisper-base.en")
+    parser.add_argument("--media", nargs="+", default=[str(DEFAULT_SAMPLE)], help="copied round robin up to --files")
+    parser.add_argument("--files", type=int, default=6)
+    parser.add_argument("--speakers", type=int, default=2)
+    parser.add_argument("--queue-size", type=int, default=2)
+    parser.add_argument("--fake-only", action="store_true", help="only time the stand-in stages, no model needed")
+    parser.add_argument("--out", default=None, help="also write the json results to this file")
+    args = parser.parse_args()
+
+    results = {"fake_stages": time_fake_stages()}
+    if args.fake_only:
+        write_results(results, args.out)
+        return
+
+    from transcribe_proc import transcribe_file, transcribe_files
+
+    with tempfile.TemporaryDirectory(prefix="transcriber-bench-") as tmp:
+        media = []
+        for i in range(args.files):
+            source = args.media[i % len(args.media)]
+            media.append(os.path.join(tmp, f"file{i}{os.path.splitext(source)[1]}"))
+            shutil.copy(source, media[-1])
+        job = {"model_name": args.model, "num_speakers": args.speakers, "use_cache": False, "open_output": False}
+        # loads every engine, so neither mode pays for it
+        transcribe_file(media[0], **job, output_dir=os.path.join(tmp, "warm"))
+
+        runs = {}
+        for mode, pipelined in (("sequential", False), ("pipelined", True)):
+            jobs = [{**job, "input_file": path, "output_dir": os.path.join(tmp, mode)} for path in media]
+            start = time.perf_counter()
+            outputs = transcribe_files(jobs, pipelined=pipelined, queue_size=args.queue_size)
+            runs[mode] = {"seconds": time.perf_counter() - start,
+                          "succeeded": sum(bool(r.get("success")) for r in outputs),
+                          "words": [read_cha_words(r["output_file"]) if r.get("output_file") else None for r in outputs]}
+        same = [a == b for a, b in zip(runs["sequential"].pop("words"), runs["pipelined"].pop("words"))]
+    results.update(model=args.model, files=args.files, cpus=os.cpu_count(), queue_size=args.queue_size, runs=runs,
+                   speedup=runs["sequential"]["seconds"] / runs["pipelined"]["seconds"], same_transcripts=all(same))
+    write_results(results, args.out)
+
+
+if __name__ == "__main__":
+    main()
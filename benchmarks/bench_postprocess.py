@@ -0,0 +1,128 @@
+"""Speed of turning whisper word chunks into monologues, and a check that the output did not change.
+
+Runs the old `pop(0)` sweep that used to be in `ArbatraryASRModel.postprocess` and
+`asr_postprocess.words_to_turns` on the same synthetic word lists, fails if their
+outputs differ, and reports the time of both. Needs no model or audio.
+Only single speaker transcripts are compared, diarized ones are assigned to
+speakers differently now (see bench_speakers.py), tests/test_postprocess.py
+checks those and the edge cases.
+
+Example:
+    python benchmarks/bench_postprocess.py --words 50000
+"""
+import argparse
+import random
+import re
+
+import numpy as np
+
+from common import Timer, write_results
+
+from asr_postprocess import words_to_turns
+
+WORDS = ["hello", "world", "the", "a", "cat", "dog", "yeah", "okay", "so", "um", "「quoted」", "…", "", " "]
+PUNCT = ["", "", "", ",", ".", "?", "!", "...", "¿", "\"", "- "]
+
+
+def reference_postprocess(words, data_len, sample_rate, segments=None):
+    """The sweep as it was before asr_postprocess, kept verbatim to compare against."""
+    groups = []
+    if segments is not None:
+        secs = np.array(range(len(segments))) * 0.5 + 0.1 / 2.0
+        cur_start = 0
+        cur_spk = segments[0]
+        for indx, i in zip(secs, segments):
+            if i != cur_spk:
+                groups.append({"type": "segment", "start": cur_start/10, "end": indx/10, "payload": int(cur_spk)})
+                cur_start = indx
+                cur_spk = i
+    else:
+        groups.append({"type": "segment", "start": 0, "end": data_len/sample_rate, "payload": 0})
+
+    for word in words:
+        groups.append({"type": "text", "start": word["timestamp"][0], "end": word["timestamp"][1], "payload": word["text"]})
+
+    groups = list(sorted(groups, key=lambda x:x["start"]))
+
+    turns = []
+    current_speaker = 0
+    current_turn = []
+
+    current_segment = groups.pop(0)
+    while len(groups) > 0:
+        element = groups.pop(0)
+
+        if element["type"] == "text":
+            pl = element["payload"].strip()
+            pl = pl.replace("「", "")
+            pl = pl.replace("」", "")
+            before = re.findall(r"^\W+", pl)
+            after = re.findall(r"\W+$", pl)
+            texts = []
+            if len(before) > 0:
+                texts.append({"type": "punct", "ts": element["start"], "end_ts": element["end"] if element["end"] else element["start"]+1, "value": before[0]})
+                pl = pl.strip(before[0])
+            if len(after) > 0:
+                pl = pl.strip(after[0])
+            texts.append({"type": "text", "ts": element["start"], "end_ts": element["end"] if element["end"] else element["start"]+1, "value": pl.strip()})
+            if len(after) > 0:
+                texts.append({"type": "punct", "ts": element["start"], "end_ts": element["end"] if element["end"] else element["start"]+1, "value": after[0]})
+
+            for text in texts:
+                if text["ts"] != text["end_ts"] and text["value"].strip() != "…" and text["value"].strip() != "":
+                    current_turn.append(text)
+        elif element["type"] == "segment" and current_speaker != element["payload"]:
+            turns.append({"elements": current_turn, "speaker": current_speaker[0] if type(current_speaker) == tuple else current_speaker})
+            current_speaker = element["payload"],
+            current_turn = []
+
+    turns.append({"elements": current_turn, "speaker": current_speaker[0] if type(current_speaker) == tuple else current_speaker})
+    return ({"monologues": turns})
+
+
+def synthetic_words(n, rng):
+    """Word chunks like the pipeline returns: mostly in order, some ties, some without an end time or duration."""
+    words = []
+    t = 0.0
+    for _ in range(n):
+        t = round(t + rng.choice([0.0, 0.1, 0.2, 0.3, 0.5]), 2)
+        end = rng.choice([round(t + rng.uniform(0.05, 0.6), 2)] * 8 + [t, None])
+        text = rng.choice([" ", ""]) + rng.choice(PUNCT) + rng.choice(WORDS) + rng.choice(PUNCT)
+        words.append({"text": text, "timestamp": (t, end)})
+    return words
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--words", type=int, default=50000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None, help="also write the json results to this file")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    sample_rate = 16000
+    words = synthetic_words(args.words, rng)
+    duration = words[-1]["timestamp"][0] + 1
+    results = []
+    # speaker attribution was changed on purpose, see bench_speakers.py for the diarized case
+    for name, segments in [("single_speaker", None)]:
+        with Timer() as old:
+            expected = reference_postprocess(words, int(duration * sample_rate), sample_rate, segments)
+        with Timer() as new:
+            actual = words_to_turns(words, int(duration * sample_rate) / sample_rate, segments)
+        if actual != expected:
+            raise SystemExit(f"{name}: words_to_turns output differs from the old postprocess")
+        results.append({
+            "case": name,
+            "words": len(words),
+            "turns": len(actual["monologues"]),
+            "old_seconds": old.elapsed,
+            "new_seconds": new.elapsed,
+            "speedup": old.elapsed / new.elapsed,
+            "identical": True,
+        })
+    write_results(results, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Real-time factor, memory and WER of ArbatraryASRModel in each precision mode, against fp32.
+
+Every precision runs in its own process so that the memory numbers do not include
+the other models. The media files in the corpus directory are transcribed and
+compared to the `<name>.*.cha` transcripts next to them, and to the fp32 output.
+
+Example:
+    python benchmarks/bench_precision.py --model openai/whisper-medium.en --precisions fp32 bf16 int8
+"""
+import argparse
+import multiprocessing
+from pathlib import Path
+
+import psutil
+
+from common import SAMPLE_DIR, Timer, find_references, monologue_words, read_cha_words, word_error_rate, write_results
+
+
+def run_precision(model_name, precision, backend, media, queue):
+    """Child process: loads the model in one precision and transcribes every file."""
+    from ArbitraryASRModel import ArbatraryASRModel
+
+    proc = psutil.Process()
+    rss_before = proc.memory_info().rss
+    with Timer() as load:
+        model = ArbatraryASRModel(model_name, precision=precision, backend=backend)
+    row = {
+        "precision": model.precision,
+        "requested_precision": precision,
+        "backend": backend,
+        "device": str(model.device),
+        "load_seconds": load.elapsed,
+        "model_rss_mb": (proc.memory_info().rss - rss_before) / 2**20,
+        "files": [],
+    }
+    for f in media:
+        audio = model.load(str(f)).all()
+        duration = len(audio) / model.sample_rate
+        # warm up so that the first forward pass does not count
+        model(audio[:model.sample_rate])
+        with Timer() as t:
+            words = monologue_words(model(audio))
+        row["files"].append({
+            "file": str(f),
+            "audio_seconds": duration,
+            "seconds": t.elapsed,
+            "rtf": t.elapsed / duration,
+            "wer": {ref.name: word_error_rate(read_cha_words(ref), words) for ref in find_references(f)},
+            "words": words,
+        })
+    row["peak_rss_mb"] = proc.memory_info().rss / 2**20
+    queue.put(row)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="openai/whisper-base.en")
+    parser.add_argument("--corpus", default=str(SAMPLE_DIR))
+    parser.add_argument("--precisions", nargs="+", default=["fp32", "bf16", "int8"])
+    parser.add_argument("--backend", default="hf", help="see asr_backends.BACKENDS, ex: hf or onnx")
+    parser.add_argument("--out", default=None, help="also write the json results to this file")
+    args = parser.parse_args()
+
+    media = [p for p in sorted(Path(args.corpus).iterdir()) if p.is_file() and p.suffix.lower() != ".cha" and find_references(p)]
+    precisions = ["fp32"] + [p for p in args.precisions if p != "fp32"]
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    for precision in precisions:
+        queue = ctx.Queue()
+        proc = ctx.Process(target=run_precision, args=(args.model, precision, args.backend, media, queue))
+        proc.start()
+        results.append(queue.get())
+        proc.join()
+
+    baseline = results[0]
+    for row in results:
+        for f, base in zip(row["files"], baseline["files"]):
+            f["wer_vs_fp32"] = word_error_rate(base["words"], f["words"])
+            f["speedup_vs_fp32"] = base["seconds"] / f["seconds"]
+        row["rtf"] = sum(f["seconds"] for f in row["files"]) / max(1e-9, sum(f["audio_seconds"] for f in row["files"]))
+    for row in results:
+        for f in row["files"]:
+            del f["words"]
+    write_results(results, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Scaling of sharded ASR (one long recording split over several processes) at 1, 2, 4 and 8 workers.
+
+A long recording is made by repeating the sample media up to --minutes, then its
+ASR runs once unsharded (one model, the whole file) and once sharded per worker
+count. Recorded per run: wall time, speedup over 1 worker, and how much the words
+differ from the unsharded run (WER), which is what the shard overlaps cost.
+
+The shard cutting and stitching is tested without any model in tests/test_sharding.py.
+
+Example:
+    python benchmarks/bench_sharding.py --model openai/whisper-base.en --minutes 60 --workers 1 2 4 8
+"""
+import argparse
+import os
+import tempfile
+
+import numpy as np
+
+from common import DEFAULT_SAMPLE, Timer, word_error_rate, write_results
+
+from sharding import ShardPool, transcribe_sharded
+
+
+def make_long_audio(media, minutes, path, rate=16000):
+    import soundfile
+    from audio_io import load_pcm
+
+    audio = load_pcm(str(media), rate).numpy()
+    repeats = max(1, int(np.ceil(minutes * 60 * rate / len(audio))))
+    soundfile.write(path, np.tile(audio, repeats)[:int(minutes * 60 * rate)], rate)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="openai/whisper-base.en")
+    parser.add_argument("--media", default=str(DEFAULT_SAMPLE), help="repeated up to --minutes")
+    parser.add_argument("--minutes", type=float, default=60)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--out", default=None, help="also write the json results to this file")
+    args = parser.parse_args()
+
+    from ArbitraryASRModel import ArbatraryASRModel
+
+    results = {}
+    model_kwargs = {"model": args.model, "batch_size": args.batch_size}
+    with tempfile.TemporaryDirectory(prefix="transcriber-bench-") as tmp:
+        path = os.path.join(tmp, "long.wav")
+        make_long_audio(args.media, args.minutes, path)
+        model = ArbatraryASRModel(**model_kwargs, streaming=True)
+        with Timer() as t:
+            reference = [w["text"].strip().lower() for w in model.transcribe_words([model.load(path)])[0]]
+        results["unsharded_seconds"] = t.elapsed
+        del model
+        runs = []
+        for workers in args.workers:
+            # shards no longer than the recording split over the workers, so 1 worker is sharded the same way
+            pool = ShardPool(model_kwargs, workers)
+            try:
+                # with starting the pool, like the first file of a batch
+                with Timer() as t:
+                    words = transcribe_sharded(path, pool)
+            finally:
+                pool.close()
+            words = [w["text"].strip().lower() for w in words]
+            runs.append({"workers": workers, "seconds": t.elapsed, "wer_vs_unsharded": word_error_rate(reference, words)})
+        for run in runs:
+            run["speedup"] = runs[0]["seconds"] / run["seconds"]
+    results.update(minutes=args.minutes, model=args.model, cpus=os.cpu_count(), runs=runs)
+    write_results(results, args.out)
+
+
+if __name__ == "__main__":
+    main()
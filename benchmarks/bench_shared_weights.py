@@ -0,0 +1,69 @@
+"""Memory of N parallel workers that each load their own models vs N workers forked off one process that loaded them once.
+
+The same batch runs through transcribe_cli both ways, and for every worker process the
+peak RSS (which counts shared pages in full, in every process) and PSS (which splits
+them between the processes sharing them) are recorded. The sum of the PSS is what
+the workers really take together. Also checks that both ways write the same words.
+
+Example:
+    python benchmarks/bench_shared_weights.py --workers 4 --model openai/whisper-base.en
+"""
+import argparse
+import os
+import tempfile
+from pathlib import Path
+
+from common import SAMPLE_DIR, Timer, find_references, read_cha_words, write_results
+
+from transcribe_cli import build_report, prepare_input, run
+
+
+def run_mode(media, workers, model, shared, output_dir):
+    jobs = [{"input_file": str(f), "model_name": model, "use_cache": False, "open_output": False, "output_dir": output_dir} for f in media]
+    with Timer() as t:
+        rows, memory = run(jobs, workers, shared_weights=shared)
+    report = build_report(rows, t.elapsed, memory)
+    return {
+        "shared_weights": shared,
+        "wall_seconds": t.elapsed,
+        "throughput": report["throughput"],
+        "failed": report["failed"],
+        "total_rss_mb": report["total_rss_mb"],
+        "total_pss_mb": report["total_pss_mb"],
+        "workers": memory,
+        "words": {Path(r["input_file"]).name: read_cha_words(r["output_file"]) for r in rows if r["success"]},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=str(SAMPLE_DIR))
+    parser.add_argument("--model", default="openai/whisper-base.en")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--out", default=None, help="also write the json results to this file")
+    args = parser.parse_args()
+
+    media = [p for p in sorted(Path(args.corpus).iterdir()) if p.is_file() and p.suffix.lower() != ".cha" and find_references(p)]
+    results = []
+    with tempfile.TemporaryDirectory(prefix="transcriber-bench-") as tmp:
+        # convert once up front, so both runs read the same wav files
+        media = [prepare_input(str(f)) for f in media]
+        for shared in (False, True):
+            output_dir = os.path.join(tmp, "shared" if shared else "separate")
+            results.append(run_mode(media, args.workers, args.model, shared, output_dir))
+    separate, shared = results
+    same_words = separate["words"] == shared["words"]
+    for row in results:
+        del row["words"]
+    write_results({
+        "model": args.model,
+        "workers": args.workers,
+        "files": len(media),
+        "same_words": same_words,
+        "pss_saved_mb": separate["total_pss_mb"] - shared["total_pss_mb"] if separate["total_pss_mb"] and shared["total_pss_mb"] else None,
+        "runs": results,
+    }, args.out)
+
+
+if __name__ == "__main__":
+    main()
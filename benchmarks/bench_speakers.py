@@ -0,0 +1,101 @@
+"""Speed and accuracy of assigning words to speakers, on a synthetic long multi speaker recording.
+
+Builds diarization frames for a recording with many short turns, and words that
+each have a known speaker (the turn they overlap the most), some of them
+straddling a turn boundary. Then compares the old sweep that used to be in
+`ArbatraryASRModel.postprocess` with `asr_postprocess.words_to_turns`.
+
+Example:
+    python benchmarks/bench_speakers.py --hours 2 --speakers 10
+"""
+import argparse
+import random
+
+import numpy as np
+
+from common import Timer, write_results
+from bench_postprocess import reference_postprocess
+
+from asr_postprocess import FRAME_OFFSET, FRAME_SECONDS, speaker_runs, words_to_turns
+
+
+def synthetic_recording(hours, speakers, rng):
+    """
+    Returns:
+        Tuple[List[int], List[dict], Dict[str, int], float]: diarization frames, word chunks, true speaker by word, duration.
+    """
+    n_frames = int(hours * 3600 / FRAME_SECONDS)
+    frames = []
+    while len(frames) < n_frames:
+        frames.extend([rng.randrange(speakers)] * rng.randrange(20, 400))
+    frames = frames[:n_frames]
+    duration = n_frames * FRAME_SECONDS + FRAME_OFFSET
+    starts, ends, labels = speaker_runs(frames, duration)
+
+    words, truth = [], {}
+    for start, end, speaker in zip(starts, ends, labels):
+        t = start + rng.uniform(0.0, 0.2)
+        while t < end:
+            length = rng.uniform(0.15, 0.6)
+            # every few turns the last word runs over into the next turn
+            if t + length > end and rng.random() < 0.5:
+                break
+            text = f"w{len(words)}"
+            words.append({"text": f" {text}", "timestamp": (round(t, 3), round(t + length, 3))})
+            truth[text] = int(speaker) if end - t >= length / 2 else None
+            t += length + rng.uniform(0.0, 0.3)
+    # words that run over belong to the next turn
+    runs = list(zip(starts, ends, labels))
+    for word in words:
+        text = word["text"].strip()
+        if truth[text] is None:
+            start, end = word["timestamp"]
+            truth[text] = int(max(runs, key=lambda r: min(end, r[1]) - max(start, r[0]))[2])
+    return frames, words, truth, duration
+
+
+def accuracy(result, truth):
+    right = total = 0
+    for turn in result["monologues"]:
+        for element in turn["elements"]:
+            if element["type"] == "text":
+                total += 1
+                right += truth[element["value"]] == turn["speaker"]
+    return right / max(1, total)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hours", type=float, default=2.0)
+    parser.add_argument("--speakers", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None, help="also write the json results to this file")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    frames, words, truth, duration = synthetic_recording(args.hours, args.speakers, rng)
+    sample_rate = 16000
+
+    with Timer() as old:
+        expected = reference_postprocess(words, int(duration * sample_rate), sample_rate, frames)
+    with Timer() as runs:
+        speaker_runs(frames, duration)
+    with Timer() as new:
+        actual = words_to_turns(words, duration, frames)
+    write_results({
+        "hours": args.hours,
+        "speakers": args.speakers,
+        "frames": len(frames),
+        "words": len(words),
+        "turns": int(np.count_nonzero(np.diff(frames))) + 1,
+        "old_seconds": old.elapsed,
+        "new_seconds": new.elapsed,
+        "new_run_length_seconds": runs.elapsed,
+        "speedup": old.elapsed / new.elapsed,
+        "old_accuracy": accuracy(expected, truth),
+        "new_accuracy": accuracy(actual, truth),
+    }, args.out)
+
+
+if __name__ == "__main__":
+    main()
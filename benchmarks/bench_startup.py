@@ -0,0 +1,128 @@
+"""Startup time of the GUI and the transcribe worker, from `python -X importtime`.
+
+Every module is imported in a fresh interpreter, a few times, and the report has:
+    - the wall time of the whole `python -c "import <module>"`
+    - the cumulative import time of the module and its heaviest imports
+    - which of the heavy dependencies (torch, batchalign, ...) got imported at all
+With --gui the time until the main window is drawn is measured too (needs a display).
+
+The results are tagged with the commit they ran on, so runs can be compared over time.
+
+Examples:
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --modules main transcribe_proc --gui --out benchmarks/results/startup.json
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+
+from common import REPO_DIR, Timer, git_version, write_results
+
+# modules that should never be imported just to open the window or start a worker
+HEAVY_MODULES = ["torch", "torchaudio", "transformers", "batchalign", "nemo", "stanza", "numpy", "PIL", "requests",
+                 "huggingface_hub", "psutil", "soundfile", "ffmpeg", "pycountry"]
+
+# draws the main window once and exits
+GUI_SNIPPET = """
+import time
+start = time.perf_counter()
+import tkinter as tk
+import main
+root = tk.Tk()
+app = main.MainGUI(root=root)
+root.update()
+print(time.perf_counter() - start)
+root.destroy()
+"""
+
+
+def parse_importtime(stderr):
+    """
+    Returns:
+        List[Tuple[str, int, int, int]]: (module, depth, self us, cumulative us) of every import, in the order they finished.
+    """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        # top level imports are indented by one space, every level below by two more
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+    return rows
+
+
+def measure_import(module, top=10):
+    """Imports the module in a fresh interpreter.
+
+    Returns:
+        dict: wall seconds, the module's cumulative import time, its `top` heaviest imports and the heavy modules it loaded.
+    """
+    with Timer() as t:
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                              cwd=REPO_DIR, capture_output=True, text=True)
+    rows = parse_importtime(proc.stderr)
+    loaded = {name for name, _, _, _ in rows}
+    # the module itself is the last top level import to finish
+    own = next((r for r in reversed(rows) if r[0] == module and r[1] == 0), None)
+    heaviest = sorted((r for r in rows if r[1] == 1 or (r[1] == 0 and r[0] != module)), key=lambda r: -r[3])[:top]
+    return {
+        "wall_seconds": t.elapsed,
+        "import_seconds": own[3] / 1e6 if own else None,
+        "heaviest": [{"module": name, "cumulative_ms": cumulative / 1000} for name, _, _, cumulative in heaviest],
+        "heavy_loaded": [m for m in HEAVY_MODULES if m in loaded],
+        "error": proc.stderr.strip().splitlines()[-1] if proc.returncode else None,
+    }
+
+
+def measure_gui():
+    """
+    Returns:
+        float | None: seconds until the main window is drawn, None if it could not be opened.
+    """
+    proc = subprocess.run([sys.executable, "-c", GUI_SNIPPET], cwd=REPO_DIR, capture_output=True, text=True)
+    try:
+        return float(proc.stdout.strip().splitlines()[-1])
+    except (IndexError, ValueError):
+        print(f"Could not open the window: {proc.stderr.strip()}", file=sys.stderr)
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modules", nargs="+", default=["main", "transcribe_proc", "transcribe_cli"])
+    parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters per module, the median is reported")
+    parser.add_argument("--top", type=int, default=10, help="how many of the heaviest imports to list")
+    parser.add_argument("--gui", action="store_true", help="also time drawing the main window")
+    parser.add_argument("--budget", type=float, default=None, help="exit with an error if any median import takes longer, in seconds")
+    parser.add_argument("--out", default=None, help="also write the json results to this file")
+    args = parser.parse_args()
+
+    # a stale .pyc should not count as startup time
+    subprocess.run([sys.executable, "-m", "compileall", "-q", str(REPO_DIR)], cwd=REPO_DIR, capture_output=True)
+    results = {"version": git_version(), "python": sys.version.split()[0], "modules": {}}
+    over_budget = []
+    for module in args.modules:
+        runs = [measure_import(module, args.top) for _ in range(args.repeat)]
+        row = {
+            "wall_seconds": statistics.median(r["wall_seconds"] for r in runs),
+            "import_seconds": statistics.median(r["import_seconds"] or 0 for r in runs),
+            "heaviest": runs[-1]["heaviest"],
+            "heavy_loaded": runs[-1]["heavy_loaded"],
+            "error": runs[-1]["error"],
+        }
+        results["modules"][module] = row
+        if args.budget is not None and row["import_seconds"] > args.budget:
+            over_budget.append(module)
+    if args.gui:
+        times = [t for t in (measure_gui() for _ in range(args.repeat)) if t is not None]
+        results["gui_seconds"] = statistics.median(times) if times else None
+    write_results(results, args.out)
+    if over_budget:
+        print(f"Over the {args.budget}s budget: {', '.join(over_budget)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
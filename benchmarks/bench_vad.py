@@ -0,0 +1,49 @@
+"""Speedup and WER of the voice activity detection prepass, against the reference transcripts in sample/.
+
+Every media file in the corpus directory is transcribed with and without VAD, and
+compared to the `<name>.*.cha` transcripts next to it.
+
+Example:
+    python benchmarks/bench_vad.py --model openai/whisper-base.en --corpus sample
+"""
+import argparse
+from pathlib import Path
+
+from common import SAMPLE_DIR, Timer, find_references, monologue_words, read_cha_words, word_error_rate, write_results
+
+from ArbitraryASRModel import ArbatraryASRModel
+from vad import detect_speech
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="openai/whisper-base.en")
+    parser.add_argument("--corpus", default=str(SAMPLE_DIR))
+    parser.add_argument("--out", default=None, help="also write the json results to this file")
+    args = parser.parse_args()
+
+    media = [p for p in sorted(Path(args.corpus).iterdir()) if p.is_file() and p.suffix.lower() != ".cha" and find_references(p)]
+    models = {vad: ArbatraryASRModel(args.model, vad=vad) for vad in (False, True)}
+    results = []
+    for f in media:
+        audio = models[False].load(str(f)).all()
+        duration = len(audio) / models[False].sample_rate
+        with Timer() as t:
+            regions = detect_speech([audio.numpy()], models[False].sample_rate)
+        speech = sum(end - start for start, end in regions)
+        row = {"file": str(f), "audio_seconds": duration, "speech_seconds": speech, "vad_seconds": t.elapsed}
+        for vad, model in models.items():
+            # warm up so that loading does not count
+            model(audio[:model.sample_rate])
+            with Timer() as t:
+                words = monologue_words(model(audio))
+            key = "vad" if vad else "no_vad"
+            row[f"{key}_seconds"] = t.elapsed
+            row[f"{key}_wer"] = {ref.name: word_error_rate(read_cha_words(ref), words) for ref in find_references(f)}
+        row["speedup"] = row["no_vad_seconds"] / row["vad_seconds"]
+        results.append(row)
+    write_results(results, args.out)
+
+
+if __name__ == "__main__":
+    main()
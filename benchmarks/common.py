@@ -0,0 +1,199 @@
+"""Shared helpers for the benchmark scripts in this directory.
+
+The scripts are meant to be run from anywhere, ex:
+    python benchmarks/bench_asr_batching.py --model openai/whisper-tiny.en
+"""
+import json
+import os
+import re
+import sys
+import time
+from pathlib import Path
+
+REPO_DIR = Path(__file__).parent.parent.expanduser().resolve()
+SAMPLE_DIR = REPO_DIR / "sample"
+DEFAULT_SAMPLE = SAMPLE_DIR / "law.mov"
+
+# let the benchmarks import the transcriber modules
+if str(REPO_DIR) not in sys.path:
+    sys.path.insert(0, str(REPO_DIR))
+
+
+class Timer:
+    """Context manager that records the wall time of its block in `.elapsed` seconds."""
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+
+
+def write_results(results, out_file=None):
+    """Prints the results as json, and also writes them to `out_file` if given."""
+    text = json.dumps(results, indent=2)
+    print(text)
+    if out_file:
+        os.makedirs(os.path.dirname(os.path.abspath(out_file)), exist_ok=True)
+        with open(out_file, "w", encoding="utf-8") as f:
+            f.write(text)
+
+
+# media bullets (\x15start_end\x15), markup in brackets, and punctuation tokens are not words
+CHA_BULLET = re.compile(r"\x15[^\x15]*\x15")
+CHA_MARKUP = re.compile(r"\[[^\]]*\]|&[-+~=]?\S+|[<>]|\(\.+\)")
+CHA_PUNCT = re.compile(r"^[.?!,;:+/\"]+$")
+
+
+def read_cha_utterances(path):
+    """
+    Returns:
+        List[Tuple[str, List[str], Tuple[int, int] | None]]: (speaker, words, (start_ms, end_ms)) of every utterance.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        lines = f.read().replace("\r\n", "\n").split("\n")
+    utterances = []
+    for line in lines:
+        if line.startswith("*"):
+            speaker, _, text = line[1:].partition(":")
+            utterances.append([speaker.strip(), text])
+        elif line.startswith("\t") and utterances:
+            # continuation of the previous tier
+            utterances[-1][1] += " " + line.strip()
+    results = []
+    for speaker, text in utterances:
+        bullet = re.search(r"\x15(\d+)_(\d+)\x15", text)
+        text = CHA_MARKUP.sub(" ", CHA_BULLET.sub(" ", text))
+        words = [w.lower() for w in text.split() if not CHA_PUNCT.match(w)]
+        results.append((speaker, words, (int(bullet.group(1)), int(bullet.group(2))) if bullet else None))
+    return results
+
+
+def read_cha_words(path):
+    """
+    Returns:
+        List[str]: the lower cased words of the transcript, in order.
+    """
+    return [w for _, words, _ in read_cha_utterances(path) for w in words]
+
+
+def word_error_rate(reference, hypothesis) -> float:
+    """Word level edit distance divided by the number of reference words."""
+    prev = list(range(len(hypothesis) + 1))
+    for i, ref_word in enumerate(reference, start=1):
+        cur = [i] + [0] * len(hypothesis)
+        for j, hyp_word in enumerate(hypothesis, start=1):
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ref_word != hyp_word))
+        prev = cur
+    return prev[-1] / max(1, len(reference))
+
+
+def find_references(media_file):
+    """
+    Returns:
+        List[Path]: the reference .cha transcripts that sit next to the media file, ex: law.mov -> law.*.cha
+    """
+    media_file = Path(media_file)
+    return sorted(p for p in media_file.parent.glob(f"{media_file.stem}.*.cha"))
+
+
+def monologue_words(monologues):
+    """
+    Returns:
+        List[str]: the lower cased words of an ArbatraryASRModel result, in order.
+    """
+    return [
+        element["value"].lower()
+        for turn in monologues["monologues"]
+        for element in turn["elements"]
+        if element["type"] == "text" and element["value"]
+    ]
+
+
+def peak_rss_bytes() -> int:
+    """
+    Returns:
+        int: the most memory this process has had resident so far.
+    """
+    try:
+        import resource
+    except ImportError:
+        # windows
+        import psutil
+        return psutil.Process().memory_info().peak_wset
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on mac, kilobytes everywhere else
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def audio_duration(path) -> float:
+    """
+    Returns:
+        float: length of the media file in seconds.
+    """
+    try:
+        import soundfile
+        return soundfile.info(str(path)).duration
+    except Exception:
+        import ffmpeg
+        return float(ffmpeg.probe(str(path))["format"]["duration"])
+
+
+def git_version() -> str:
+    """
+    Returns:
+        str: the commit the benchmarks ran on, with a '+dirty' suffix if there are local changes.
+    """
+    import subprocess
+    try:
+        commit = subprocess.check_output(["git", "-C", str(REPO_DIR), "rev-parse", "HEAD"], text=True).strip()
+        dirty = subprocess.check_output(["git", "-C", str(REPO_DIR), "status", "--porcelain", "--untracked-files=no"], text=True).strip()
+        return commit + ("+dirty" if dirty else "")
+    except Exception:
+        return "unknown"
+
+
+def diarization_error(reference, hypothesis, step_ms=10) -> float:
+    """Frame level diarization error rate: missed speech, false alarm and speaker confusion over the reference speech.
+
+    Hypothesis speakers are mapped to reference speakers greedily by the most overlap,
+    so the speaker names do not have to match.
+
+    Args:
+        reference, hypothesis (List[Tuple[str, List[str], Tuple[int, int] | None]]): from `read_cha_utterances`.
+        step_ms (int): frame length.
+
+    Returns:
+        float | None: the error rate, or None if the reference has no timed utterances.
+    """
+    import numpy as np
+
+    def labels(utterances, speakers, n):
+        frames = np.full(n, -1)
+        for speaker, _, bullet in utterances:
+            if bullet:
+                frames[bullet[0] // step_ms:bullet[1] // step_ms] = speakers.setdefault(speaker, len(speakers))
+        return frames
+
+    ends = [b[1] for _, _, b in reference + hypothesis if b]
+    if not any(b for _, _, b in reference):
+        return None
+    n = max(ends) // step_ms + 1
+    ref_speakers, hyp_speakers = {}, {}
+    ref, hyp = labels(reference, ref_speakers, n), labels(hypothesis, hyp_speakers, n)
+    both = (ref >= 0) & (hyp >= 0)
+    overlap = np.zeros((max(1, len(hyp_speakers)), max(1, len(ref_speakers))), dtype=int)
+    np.add.at(overlap, (hyp[both], ref[both]), 1)
+    mapping = np.full(len(overlap), -2)
+    for flat in np.argsort(overlap, axis=None)[::-1]:
+        h, r = np.unravel_index(flat, overlap.shape)
+        if overlap[h, r] == 0:
+            break
+        if mapping[h] == -2 and r not in mapping:
+            mapping[h] = r
+    mapped = np.where(hyp >= 0, mapping[np.maximum(hyp, 0)], -1)
+    speech = ref >= 0
+    missed = speech & (hyp < 0)
+    false_alarm = ~speech & (hyp >= 0)
+    confusion = both & (mapped != ref)
+    return float((missed.sum() + false_alarm.sum() + confusion.sum()) / max(1, speech.sum()))
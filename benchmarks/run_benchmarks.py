@@ -0,0 +1,223 @@
+"""End to end speed and accuracy of transcribe_file over a corpus, for a matrix of models and pipeline configurations.
+
+For every (model, configuration, media file) the whole pipeline runs in a fresh
+process (so model loading and memory are measured the same way every time, and
+the result cache is off). Recorded per run:
+    - wall time of every stage and in total, and the real-time factor
+    - peak resident memory of the process
+    - WER and diarization error against every `<name>.*.cha` reference next to the media
+
+Results are written as json, tagged with the commit they ran on, so that runs on
+different commits can be compared with --compare.
+
+Examples:
+    python benchmarks/run_benchmarks.py --models openai/whisper-base.en openai/whisper-small.en --configs full asr_only
+    python benchmarks/run_benchmarks.py --matrix my_matrix.json --out benchmarks/results/after.json
+    python benchmarks/run_benchmarks.py --compare benchmarks/results/before.json benchmarks/results/after.json
+
+A matrix file is {"models": [...], "configs": {"name": {transcribe_file kwargs}}}.
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import tempfile
+from pathlib import Path
+
+from common import (REPO_DIR, SAMPLE_DIR, Timer, audio_duration, diarization_error, find_references, git_version,
+                    peak_rss_bytes, read_cha_utterances, word_error_rate, write_results)
+
+RESULTS_DIR = REPO_DIR / "benchmarks" / "results"
+
+# name -> transcribe_file kwargs, see transcribe_proc.STAGES
+CONFIGS = {
+    "full": {"stages": ["asr", "speaker", "disfluency", "retrace", "utr", "fa"]},
+    "asr_only": {"stages": ["asr"]},
+    "asr_speaker": {"stages": ["asr", "speaker"]},
+    "no_alignment": {"stages": ["asr", "speaker", "disfluency", "retrace"]},
+    "custom_vad": {"stages": ["asr", "speaker", "disfluency", "retrace", "utr", "fa"], "asr_engine": "custom", "vad": True},
+    # diarization next to the other stages, see pipeline_dag.py
+    "full_parallel": {"stages": ["asr", "speaker", "disfluency", "retrace", "utr", "fa"], "parallel_stages": True},
+}
+
+
+def run_job(job, repeat, queue):
+    """Child process: transcribes one file `repeat` times, the first run includes loading the models."""
+    os.chdir(REPO_DIR)
+    from transcribe_proc import transcribe_file
+
+    runs = []
+    try:
+        for _ in range(repeat):
+            with Timer() as t:
+                result = transcribe_file(**job, use_cache=False, open_output=False)
+            runs.append({"result": result, "seconds": t.elapsed})
+        queue.put({"runs": runs, "peak_rss_bytes": peak_rss_bytes()})
+    except Exception as e:
+        queue.put({"runs": runs, "peak_rss_bytes": peak_rss_bytes(), "error": repr(e)})
+
+
+def score(output_file, references):
+    """
+    Returns:
+        dict: WER and diarization error of the output against every reference, by reference name.
+    """
+    hypothesis = read_cha_utterances(output_file)
+    words = [w for _, utterance, _ in hypothesis for w in utterance]
+    scores = {}
+    for ref in references:
+        reference = read_cha_utterances(ref)
+        scores[ref.name] = {
+            "wer": word_error_rate([w for _, utterance, _ in reference for w in utterance], words),
+            "der": diarization_error(reference, hypothesis),
+        }
+    return scores
+
+
+def prepare_media(media, workdir):
+    """Copies the media into the work dir, converted to 16 kHz wav like the GUI does, so the corpus is never written to."""
+    from ffmpeg_utils import convert_file_to_type
+
+    local = Path(workdir) / media.name
+    shutil.copy2(media, local)
+    if media.suffix.lower() in (".wav", ".mp3", ".flac"):
+        return local
+    converted = convert_file_to_type(str(local), ".wav")
+    if converted is None:
+        raise RuntimeError(f"Could not convert {media} to .wav")
+    return Path(converted)
+
+
+def run_matrix(models, configs, corpus, repeat=1, num_speakers=2, lang="eng", keep_outputs=False):
+    media = [p for p in sorted(Path(corpus).iterdir()) if p.is_file() and p.suffix.lower() != ".cha" and find_references(p)]
+    ctx = multiprocessing.get_context("spawn")
+    workdir = tempfile.mkdtemp(prefix="transcriber-bench-")
+    rows = []
+    try:
+        local_media = {f: prepare_media(f, workdir) for f in media}
+        for model in models:
+            for config_name, config in configs.items():
+                for f in media:
+                    job = {"input_file": str(local_media[f]), "model_name": model, "num_speakers": num_speakers, "lang": lang, **config}
+                    duration = audio_duration(local_media[f])
+                    print(f"Running {model} / {config_name} / {f.name}", flush=True)
+                    queue = ctx.Queue()
+                    proc = ctx.Process(target=run_job, args=(job, repeat, queue))
+                    proc.start()
+                    out = queue.get()
+                    proc.join()
+                    for i, run in enumerate(out["runs"]):
+                        result = run["result"]
+                        rows.append({
+                            "model": model,
+                            "config": config_name,
+                            "file": f.name,
+                            "repeat": i,
+                            "cold": i == 0,
+                            "audio_seconds": duration,
+                            "seconds": run["seconds"],
+                            "rtf": run["seconds"] / duration,
+                            "stages": {step.get("stage", step["step"]): {"seconds": step["seconds"], "status": step["status"]} for step in result["steps"]},
+                            # cpu time and memory of each stage, see profiling.py
+                            "stage_metrics": result.get("metrics", {}).get("stages", []),
+                            # only with parallel_stages
+                            "critical_path": result.get("critical_path"),
+                            "success": result["success"],
+                            "peak_rss_bytes": out["peak_rss_bytes"],
+                            "scores": score(result["output_file"], find_references(f)),
+                        })
+                        if not keep_outputs and os.path.isfile(result["output_file"]):
+                            os.remove(result["output_file"])
+                    if out.get("error"):
+                        rows.append({"model": model, "config": config_name, "file": f.name, "error": out["error"]})
+    finally:
+        if keep_outputs:
+            print(f"Outputs were kept in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return rows
+
+
+def mean_score(row, key):
+    values = [s[key] for s in row.get("scores", {}).values() if s[key] is not None]
+    return sum(values) / len(values) if values else None
+
+
+def compare(before_file, after_file):
+    """
+    Returns:
+        List[dict]: the change in time, memory and accuracy of every run that is in both result files.
+    """
+    def load(path):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data, {(r["model"], r["config"], r["file"], r.get("repeat", 0)): r for r in data["runs"] if "error" not in r}
+
+    before_data, before = load(before_file)
+    after_data, after = load(after_file)
+    rows = []
+    for key in sorted(before.keys() & after.keys()):
+        b, a = before[key], after[key]
+        row = {
+            "model": key[0], "config": key[1], "file": key[2], "repeat": key[3],
+            "before": before_data.get("version"), "after": after_data.get("version"),
+            "speedup": b["seconds"] / a["seconds"],
+            "rtf": [b["rtf"], a["rtf"]],
+            "peak_rss_mb": [b["peak_rss_bytes"] / 2**20, a["peak_rss_bytes"] / 2**20],
+            "wer": [mean_score(b, "wer"), mean_score(a, "wer")],
+            "der": [mean_score(b, "der"), mean_score(a, "der")],
+            "stage_speedup": {
+                stage: b["stages"][stage]["seconds"] / a["stages"][stage]["seconds"]
+                for stage in b["stages"].keys() & a["stages"].keys()
+                if a["stages"][stage]["seconds"] > 0
+            },
+        }
+        rows.append(row)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=str(SAMPLE_DIR))
+    parser.add_argument("--models", nargs="+", default=["openai/whisper-base.en"])
+    parser.add_argument("--configs", nargs="+", default=["full"], help=f"some of: {', '.join(CONFIGS)}")
+    parser.add_argument("--matrix", default=None, help="json file with the models and configs, overrides --models and --configs")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per file in the same process, only the first one loads the models")
+    parser.add_argument("--num-speakers", type=int, default=2)
+    parser.add_argument("--lang", default="eng")
+    parser.add_argument("--keep-outputs", action="store_true", help="keep the .cha outputs for inspection")
+    parser.add_argument("--out", default=None, help=f"where to write the results, defaults to a new file in {RESULTS_DIR}")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), default=None, help="compare two result files instead of running")
+    args = parser.parse_args()
+
+    if args.compare:
+        write_results(compare(*args.compare), args.out)
+        return
+
+    if args.matrix:
+        with open(args.matrix, "r", encoding="utf-8") as f:
+            matrix = json.load(f)
+        models, configs = matrix["models"], matrix["configs"]
+    else:
+        models, configs = args.models, {name: CONFIGS[name] for name in args.configs}
+
+    version = git_version()
+    started = datetime.datetime.now()
+    runs = run_matrix(models, configs, args.corpus, args.repeat, args.num_speakers, args.lang, args.keep_outputs)
+    out = args.out or str(RESULTS_DIR / f"{started:%Y%m%d-%H%M%S}-{version[:8]}.json")
+    write_results({
+        "version": version,
+        "started": started.isoformat(),
+        "machine": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+        "corpus": str(args.corpus),
+        "models": models,
+        "configs": configs,
+        "runs": runs,
+    }, out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Checkpoints of a file's progress through the pipeline, so an interrupted transcription can resume.
+
+After every successful stage the document is saved next to the input file as
+`<input>.ckpt` (or in the output directory, when there is one, so a read-only input
+directory still works), together with which pipeline it belongs to and how many of its
+stages are done. Resuming picks up at the first stage that did not finish and
+keeps writing to the same output .cha file. Once every stage has succeeded the
+document is dropped from the checkpoint and only a small "done" marker is kept,
+so resuming a batch skips the files that already finished.
+"""
+import os
+import pickle
+
+from result_cache import write_pickle
+
+CHECKPOINT_SUFFIX = ".ckpt"
+CHECKPOINT_VERSION = 1
+
+
+def checkpoint_path(input_file, output_dir=None) -> str:
+    """
+    Args:
+        output_dir (str, optional): where the outputs go, the checkpoint goes there too, named after the input.
+    """
+    if output_dir:
+        return os.path.join(output_dir, f"{os.path.basename(input_file)}{CHECKPOINT_SUFFIX}")
+    return f"{input_file}{CHECKPOINT_SUFFIX}"
+
+
+def _input_signature(input_file):
+    # a changed input file invalidates the checkpoint
+    stat = os.stat(input_file)
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+def load_checkpoint(input_file, steps, output_dir=None):
+    """
+    Args:
+        input_file (str): the file being transcribed.
+        steps (list): description of the pipeline steps, the checkpoint is ignored if they changed.
+        output_dir (str, optional): see `checkpoint_path`.
+
+    Returns:
+        dict | None: {"output_file", "completed", "done", "doc"} of a matching checkpoint, or None.
+    """
+    path = checkpoint_path(input_file, output_dir)
+    if not os.path.isfile(path):
+        return None
+    try:
+        with open(path, "rb") as f:
+            checkpoint = pickle.load(f)
+    except Exception as e:
+        print(f"Ignoring unreadable checkpoint {path}: {e}", flush=True)
+        return None
+    if checkpoint.get("version") != CHECKPOINT_VERSION or checkpoint.get("steps") != steps or checkpoint.get("input") != _input_signature(input_file):
+        print(f"Ignoring checkpoint {path}, it was made with different settings or for a different version of the file.", flush=True)
+        return None
+    if checkpoint.get("done") and not os.path.isfile(checkpoint.get("output_file", "")):
+        # the output was removed, so there is nothing to resume from
+        return None
+    return checkpoint
+
+
+def save_checkpoint(input_file, steps, output_file, completed, doc, output_dir=None):
+    """Saves the document after the first `completed` steps finished successfully.
+    Once all steps are completed only a small "done" marker is kept.
+    """
+    done = completed >= len(steps)
+    write_pickle({
+        "version": CHECKPOINT_VERSION,
+        "input": _input_signature(input_file),
+        "steps": steps,
+        "output_file": output_file,
+        "completed": completed,
+        "done": done,
+        "doc": None if done else doc,
+    }, checkpoint_path(input_file, output_dir))
@@ -0,0 +1,134 @@
+"""ffmpeg helpers for getting media into a shape the AI models can read.
+
+Whisper and the alignment models all want 16 kHz mono audio, so instead of
+transcoding videos to a lossy .mp3 (which then has to be decoded and resampled
+again) we have ffmpeg write 16 kHz mono 16 bit PCM directly.
+"""
+import os
+import sys
+import threading
+from collections import deque
+
+import ffmpeg
+import numpy as np
+import soundfile
+
+PCM_SAMPLE_RATE = 16000
+# raw 16 kHz mono PCM on stdout, for piping straight into the models
+PCM_PIPE_ARGS = dict(format='s16le', acodec='pcm_s16le', ac=1, ar='16k')
+# the same samples in a .wav container, for the pipeline stages that need a file on disk
+PCM_WAV_ARGS = dict(acodec='pcm_s16le', ac=1, ar='16k')
+PCM_BYTES_PER_SAMPLE = 2
+# lines of ffmpeg's error output kept for the exception when it fails half way through a stream
+STDERR_TAIL_LINES = 20
+
+
+def get_audio_file_types():
+    """Supported audio file types that dont need to be converted
+
+    Returns:
+        list of file extentions
+    """
+    # if its not usable by the soundfile package then it will cause an error to be thrown
+    return [t.lower() for t in soundfile.available_formats().keys()]
+
+
+def convert_file_to_type(inp_file: str, totype: str):
+    """Converts given file to the file type using ffmpeg.
+    Converting to '.wav' writes 16 kHz mono PCM, which the models read without resampling.
+
+    Args:
+        inp_file (str): the input file path
+        totype (str): the output file type extention
+
+    Returns:
+        str: the output file path
+    """
+    name, ext = os.path.splitext(inp_file)
+    out_name = f"{name}{'' if str(totype).startswith('.') else '.'}{totype}"
+    if os.path.exists(out_name):
+        # assume it has already converted the file
+        print(f"Using cached version of {inp_file}!")
+        return out_name
+    print(f"Converting {inp_file} to {totype} type so that it can be transcribed!")
+    output_args = PCM_WAV_ARGS if out_name.lower().endswith('.wav') else {}
+    try:
+        out, err = (ffmpeg
+            .input(inp_file)
+            # vn: dont waste time decoding the video stream
+            .output(out_name, vn=None, **output_args)
+            .run(capture_stdout=True, capture_stderr=True)
+        )
+    except ffmpeg.Error as e:
+        print(e.stderr, file=sys.stderr)
+        print(f"Failed to convert '{inp_file}' to '{totype}'! Please attempt to convert it to '{totype}' manually and retrying!")
+        return None
+    print(f"Convertion completed! Output file can be found at '{out_name}'")
+    return out_name
+
+
+def decode_to_pcm(inp_file: str) -> np.ndarray:
+    """Decodes any media file ffmpeg understands straight to 16 kHz mono samples, without a temp file.
+
+    Args:
+        inp_file (str): the input file path
+
+    Returns:
+        np.ndarray: float32 samples in [-1, 1) at PCM_SAMPLE_RATE.
+    """
+    out, err = (ffmpeg
+        .input(inp_file)
+        .output('pipe:', vn=None, **PCM_PIPE_ARGS)
+        .run(capture_stdout=True, capture_stderr=True)
+    )
+    return np.frombuffer(out, dtype=np.int16).astype(np.float32) / 32768.0
+
+
+def iter_pcm_blocks(inp_file: str, block_s: float = 60.0, start_s: float = 0.0, duration_s: float = None):
+    """Like `decode_to_pcm`, but yields the samples a block at a time so the whole file is never in memory.
+
+    Args:
+        inp_file (str): the input file path
+        block_s (float): seconds of audio per block
+        start_s (float): where to start decoding, ffmpeg seeks there without decoding what comes before
+        duration_s (float, optional): how many seconds to decode, defaults to the rest of the file
+
+    Yields:
+        np.ndarray: float32 samples in [-1, 1) at PCM_SAMPLE_RATE.
+
+    Raises:
+        ffmpeg.Error: when ffmpeg fails, with the end of its error output, instead of the stream just ending early.
+    """
+    input_args = {'ss': start_s} if start_s else {}
+    output_args = {'t': duration_s} if duration_s is not None else {}
+    proc = (ffmpeg
+        .input(inp_file, **input_args)
+        .output('pipe:', vn=None, **PCM_PIPE_ARGS, **output_args)
+        .global_args('-loglevel', 'error')
+        .run_async(pipe_stdout=True, pipe_stderr=True)
+    )
+    # read as it comes, a file with many broken frames would otherwise fill the pipe and stall ffmpeg
+    stderr_tail = deque(maxlen=STDERR_TAIL_LINES)
+    drain = threading.Thread(target=stderr_tail.extend, args=(proc.stderr,), name="ffmpeg-stderr", daemon=True)
+    drain.start()
+    block_bytes = int(block_s * PCM_SAMPLE_RATE) * PCM_BYTES_PER_SAMPLE
+    try:
+        while True:
+            data = proc.stdout.read(block_bytes)
+            if not data:
+                break
+            # keep whole samples only, a short read could end half way through one
+            if len(data) % PCM_BYTES_PER_SAMPLE:
+                data += proc.stdout.read(PCM_BYTES_PER_SAMPLE - len(data) % PCM_BYTES_PER_SAMPLE)
+            yield np.frombuffer(data, dtype=np.int16).astype(np.float32) / 32768.0
+    finally:
+        # when the caller stops early ffmpeg is cut off on purpose, so only a stream that ran out is checked
+        proc.stdout.close()
+        proc.wait()
+        drain.join()
+        proc.stderr.close()
+    if proc.returncode != 0:
+        stderr = b"".join(stderr_tail)
+        error = ffmpeg.Error('ffmpeg', None, stderr)
+        error.args = (f"ffmpeg exited with {proc.returncode} while decoding {inp_file}: {stderr.decode(errors='replace').strip()}",)
+        raise error
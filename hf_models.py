@@ -0,0 +1,310 @@
+"""The list of models for the model dropdown, from the huggingface API.
+
+The queries in models.json are sent at the same time, from a background thread, and
+the ranked result is kept on disk for MODEL_LIST_TTL_S. The GUI shows the kept list
+right away and only refreshes it in the background once it is stale, so the window
+never waits on the network and still has a list when offline.
+
+Set the HF_ENDPOINT environment variable to use a mirror (or a local stub server).
+
+It also keeps an index of the whisper models that are already in the local
+huggingface cache, so checking a model (`is_model_available`) only goes to the
+network for models that were never downloaded, and works on machines without one.
+Downloaded models are also loaded from their snapshot directory, see `load_pretrained`.
+"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from user_config import CONFIG_DIR
+
+HF_ENDPOINT = os.environ.get("HF_ENDPOINT", "https://huggingface.co").rstrip("/")
+MODEL_LIST_CACHE_FILENAME = CONFIG_DIR / "model_list.json"
+MODEL_LIST_TTL_S = 24 * 60 * 60
+REQUEST_TIMEOUT_S = 10
+# the whisper models found in the local huggingface cache, see `local_models`
+LOCAL_INDEX_FILENAME = CONFIG_DIR / "local_models.json"
+# config.json fields kept in the local index
+INDEX_CONFIG_KEYS = ("architectures", "d_model", "encoder_layers", "decoder_layers", "num_mel_bins", "vocab_size")
+# what the token file holds until the user puts their token in, see main.get_hf_token
+PLACEHOLDER_TOKEN = "hf_YOUR_TOKEN_HERE"
+
+
+def read_hf_token(path):
+    """
+    Returns:
+        str | None: the token in the file, None if there is no real token, the public models can be listed without one.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            token = f.readline().strip()
+    except OSError:
+        return None
+    return token if token and token != PLACEHOLDER_TOKEN else None
+
+
+def search_params(query) -> dict:
+    """
+    Args:
+        query (dict): one query of models.json, ex: {"author": "openai", "filter": "automatic-speech-recognition"}.
+
+    Returns:
+        dict: the GET parameters of the /api/models request.
+    """
+    return {
+        **{k: query[k] for k in query if not k.lower().strip().startswith('expand')},
+        "sort": query.get('sort', "downloads"),
+        "limit": query.get('limit', "10"),
+        "config": "True",
+        "full": "False",
+    }
+
+
+def search_models(query, token=None, endpoint=None, timeout=REQUEST_TIMEOUT_S):
+    """
+    Raises:
+        requests.RequestException: when the request fails, or the API returns an error.
+
+    Returns:
+        List[dict]: the models that match the query.
+    """
+    import requests
+
+    response = requests.get(
+        f"{endpoint or HF_ENDPOINT}/api/models",
+        params=search_params(query),
+        headers={"Authorization": f"Bearer {token}"} if token else {},
+        timeout=timeout,
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+def rank_models(results) -> list:
+    """
+    Args:
+        results (List[List[dict]]): the models of every query.
+
+    Returns:
+        List[str]: the ids of the speech recognition models, most downloaded first, without duplicates.
+    """
+    models = {}
+    for result in results:
+        for r in result:
+            if r.get('pipeline_tag') == 'automatic-speech-recognition':
+                models[r['id']] = r
+    return sorted(models, key=lambda k: models[k].get('downloads', models[k].get('likes', 0)), reverse=True)
+
+
+def fetch_model_list(queries, token=None, endpoint=None, max_workers=8):
+    """Sends all the queries at the same time.
+
+    Returns:
+        List[str] | None: the ranked model ids, None if every query failed (ex: offline).
+    """
+    def search(query):
+        try:
+            return search_models(query, token, endpoint)
+        except Exception as e:
+            print(f"Model search {query} failed: {e}", flush=True)
+            return None
+
+    if not queries:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(queries))) as pool:
+        results = list(pool.map(search, queries))
+    if all(r is None for r in results):
+        return None
+    return rank_models(r for r in results if r is not None)
+
+
+def load_model_list(queries, path=MODEL_LIST_CACHE_FILENAME, ttl=MODEL_LIST_TTL_S):
+    """
+    Returns:
+        Tuple[List[str], bool]: the kept model list of these queries (empty if there is none),
+            and if it is younger than the ttl.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return [], False
+    # a different models.json needs a new search
+    if data.get("queries") != queries:
+        return [], False
+    return data.get("models", []), time.time() - data.get("fetched", 0) < ttl
+
+
+def save_model_list(queries, models, path=MODEL_LIST_CACHE_FILENAME):
+    path = Path(path)
+    path.parent.mkdir(exist_ok=True, parents=True)
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"queries": queries, "fetched": time.time(), "models": models}, f, indent=2)
+    os.replace(tmp, path)
+
+
+def refresh_model_list(queries, token=None, callback=None, endpoint=None, path=MODEL_LIST_CACHE_FILENAME):
+    """Searches again in a background thread and keeps the result. Nothing is changed when offline.
+
+    Args:
+        callback (Callable[[List[str]], None], optional): called with the new list, from the background
+            thread, so a GUI has to hand it over to its own thread.
+
+    Returns:
+        threading.Thread: the started thread.
+    """
+    def run():
+        models = fetch_model_list(queries, token, endpoint)
+        if models is None:
+            return
+        try:
+            save_model_list(queries, models, path)
+        except OSError as e:
+            print(f"Could not keep the model list in {path}: {e}", flush=True)
+        if callback is not None:
+            callback(models)
+
+    thread = threading.Thread(target=run, name="model-list-refresh", daemon=True)
+    thread.start()
+    return thread
+
+
+def hub_cache_dir() -> Path:
+    """
+    Returns:
+        Path: the huggingface hub cache, found the same way huggingface_hub does, without importing it.
+    """
+    for var in ("HF_HUB_CACHE", "HUGGINGFACE_HUB_CACHE"):
+        if os.environ.get(var):
+            return Path(os.environ[var]).expanduser()
+    hf_home = os.environ.get("HF_HOME") or os.path.join(os.environ.get("XDG_CACHE_HOME", "~/.cache"), "huggingface")
+    return Path(hf_home, "hub").expanduser()
+
+
+def cache_signature(cache_dir) -> dict:
+    """
+    Returns:
+        dict: the last modified time of every model's snapshots and refs, it changes whenever a model
+            (revision) is downloaded, updated or deleted.
+    """
+    try:
+        repos = [d for d in Path(cache_dir).iterdir() if d.name.startswith("models--") and (d / "snapshots").is_dir()]
+    except OSError:
+        return {}
+    refs = lambda d: [f.stat().st_mtime for f in (d / "refs").rglob("*")] if (d / "refs").is_dir() else []
+    return {d.name: max([(d / "snapshots").stat().st_mtime, *refs(d)]) for d in repos}
+
+
+def scan_local_models(cache_dir) -> dict:
+    """Scans the huggingface cache for whisper models.
+
+    Returns:
+        dict: model id -> {"revision", "path" (of the snapshot), "size_bytes", "model_type", "config"}.
+    """
+    from huggingface_hub import scan_cache_dir
+
+    models = {}
+    for repo in scan_cache_dir(cache_dir).repos:
+        if repo.repo_type != "model" or not repo.revisions:
+            continue
+        revision = max(repo.revisions, key=lambda r: r.last_modified)
+        try:
+            with open(revision.snapshot_path / "config.json", "r", encoding="utf-8") as f:
+                config = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if config.get("model_type") != "whisper":
+            continue
+        models[repo.repo_id] = {
+            "revision": revision.commit_hash,
+            "path": str(revision.snapshot_path),
+            "size_bytes": repo.size_on_disk,
+            "model_type": config["model_type"],
+            "config": {k: config[k] for k in INDEX_CONFIG_KEYS if k in config},
+        }
+    return models
+
+
+def local_models(cache_dir=None, path=LOCAL_INDEX_FILENAME) -> dict:
+    """The whisper models in the local huggingface cache. The cache is only scanned again
+    when something was downloaded or deleted since the last time.
+
+    Returns:
+        dict: model id -> what `scan_local_models` found about it, empty if the cache cant be read.
+    """
+    cache_dir = Path(cache_dir or hub_cache_dir())
+    signature = cache_signature(cache_dir)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+        if index.get("cache_dir") == str(cache_dir) and index.get("signature") == signature:
+            return index["models"]
+    except (OSError, ValueError, KeyError):
+        pass
+    if not signature:
+        return {}
+    try:
+        models = scan_local_models(cache_dir)
+    except Exception as e:
+        print(f"Could not scan the huggingface cache {cache_dir}: {e}", flush=True)
+        return {}
+    try:
+        Path(path).parent.mkdir(exist_ok=True, parents=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"cache_dir": str(cache_dir), "signature": signature, "models": models}, f, indent=2)
+    except OSError as e:
+        print(f"Could not keep the local model index in {path}: {e}", flush=True)
+    return models
+
+
+def local_model_path(model) -> str:
+    """
+    Returns:
+        str | None: the snapshot directory of a model in the local huggingface cache, None if it was never downloaded.
+    """
+    path = local_models().get(str(model), {}).get("path")
+    return path if path and os.path.isdir(path) else None
+
+
+def load_pretrained(loader, model, **kwargs):
+    """Loads from the local snapshot of a downloaded model, so it works offline, and by model id otherwise.
+
+    Args:
+        loader (Callable): ex: `WhisperTokenizer.from_pretrained`.
+        model (str): huggingface model id (or local path).
+
+    Returns:
+        whatever the loader returns.
+    """
+    path = local_model_path(model)
+    if path is not None:
+        try:
+            return loader(path, **kwargs)
+        except OSError as e:
+            # ex: a file the snapshot does not have yet, that only the hub can give us
+            print(f"Could not load {model} from {path}, trying huggingface: {e}", flush=True)
+    return loader(model, **kwargs)
+
+
+def is_model_available(model, token=None) -> bool:
+    """Checks a model without the network when it is a local directory or already downloaded.
+
+    Returns:
+        bool: if the model can be loaded, asks huggingface (repo_exists) only for models that are not local.
+    """
+    if not model:
+        return False
+    if os.path.isfile(os.path.join(str(model), "config.json")) or model in local_models():
+        return True
+    if os.environ.get("HF_HUB_OFFLINE", "").lower() in ("1", "true", "yes", "on"):
+        return False
+    try:
+        from huggingface_hub.hf_api import repo_exists
+        return repo_exists(model, token=token)
+    except Exception as e:
+        print(f"Could not check {model} on huggingface: {e}", flush=True)
+        return False
@@ -1,27 +1,27 @@
 import os
-from time import sleep, time
 import tkinter as tk
-from tkinter import BOTH, CENTER, E, LEFT, RIGHT, SOLID, TOP, W, X, IntVar, Label, StringVar, Tk, Toplevel, filedialog, Frame, messagebox, font, Button
+from tkinter import BOTH, CENTER, E, LEFT, RIGHT, SOLID, TOP, W, X, Checkbutton, IntVar, Label, StringVar, Tk, Toplevel, filedialog, Frame, messagebox, font, Button
 from tkinter.ttk import Combobox, Spinbox
 from tkinter.font import BOLD, ITALIC, NORMAL
 # from tkinter.scrolledtext import ScrolledText
 from types import FunctionType
 from typing import List
 import traceback
-import ffmpeg
-import pycountry
-import requests
 import sys
 import subprocess
 import json
-from huggingface_hub.hf_api import repo_exists as is_valid_model_id
-from PIL import Image, ImageTk
-import psutil
-from torch.cuda import is_available as is_cuda_available, mem_get_info as get_cuda_mem_info
+import queue
+import threading
 from pathlib import Path
 import shutil
-import soundfile
 from functools import lru_cache
+from hf_models import is_model_available, load_model_list, local_models, read_hf_token, refresh_model_list, search_models
+import progress
+from profiles import ASR_KWARGS, apply_profile, load_profiles, profile_kwargs
+from user_config import CONFIG_DIR
+# pycountry, requests, huggingface_hub, PIL, ffmpeg_utils (ffmpeg, soundfile, numpy) and
+# scheduler (psutil) are imported where they are used, so the window opens without
+# waiting on them, see benchmarks/bench_startup.py
 
 # CONSTANTS/config
 class COLOR_THEME:
@@ -54,17 +54,18 @@ MODELS_CFG_DEFAULT = Path(THIS_DIR, CONFIG_FILES_DIRECTORY_REL, MODELS_FN).expan
 CACHE_DEFAULT = Path(THIS_DIR, CONFIG_FILES_DIRECTORY_REL, CACHE_FN).expanduser().resolve()
 
 # per user config file location
-PER_USER_ROOT = Path.home()
-PER_USER_CONFIG_FILES_DIRECTORY_REL = f".{CONFIG_FILES_DIRECTORY_REL}"
-MODELS_CFG_FILENAME = Path(PER_USER_ROOT, PER_USER_CONFIG_FILES_DIRECTORY_REL, MODELS_FN).expanduser().resolve()
-CACHE_FILENAME = Path(PER_USER_ROOT, PER_USER_CONFIG_FILES_DIRECTORY_REL, CACHE_FN).expanduser().resolve()
+MODELS_CFG_FILENAME = CONFIG_DIR / MODELS_FN
+CACHE_FILENAME = CONFIG_DIR / CACHE_FN
 
 
 # functional config values
 HF_TOKEN_FILENAME = Path(THIS_DIR, ".hftoken").expanduser().resolve()
 MASCOT_FILENAME = Path(CONFIG_FILES_DIRECTORY_REL, "mascot.png").expanduser().resolve()
-TRANSCRIBE_SUBPROC_FILENAME = Path(THIS_DIR, "transcribe_proc.py").expanduser().resolve()
 FFMPEG_EXE_DIR = Path(TOOLS_DIR).expanduser().resolve()
+# precisions the ASR model can run in, see asr_backends.PRECISIONS
+PRECISIONS = ["fp32", "bf16", "fp16", "int8"]
+# how often the window picks up the progress the workers sent, the workers never wait on it
+PROGRESS_POLL_MS = 200
 
 # locate ffmpeg path
 FFMPEG_PATH = shutil.which('ffmpeg') or (shutil.which('ffmpeg', path=FFMPEG_EXE_DIR) if sys.platform.startswith("win") else None)
@@ -103,6 +104,13 @@ class MainGUI:
         
         self.load_cache()
         
+        # persistent transcribe processes, started when a model is selected or on the first transcribe request
+        self.scheduler = None
+        self.model_status_polling = False
+        # the transcription progress is shown from a timer, see pump_scheduler
+        self.transcribe_polling = False
+        self.transcribe_mascots = []
+        
         self.root = root
         self.root.title("Transcriber")
         self.root.geometry(self.get_initial_geometry())
@@ -149,6 +157,12 @@ class MainGUI:
         self.button_find_more_models.pack(side=RIGHT, anchor=E, padx=10)
         self.frame_model_selection_block.pack(fill=X, expand=True)
         self.frame_model_selection_line.pack(fill=X, expand=True)
+        # the selected model is loaded in a worker in the background, so the first file does not wait for it
+        self.label_model_status = Label(self.frame_model_selection_block, text="", font=TOOLTIP_FONT, bg=COLOR_THEME.MAIN_WINDOW)
+        self.label_model_status.pack(fill=X, expand=True, anchor=CENTER)
+        self.dropdown_model_selector.bind("<<ComboboxSelected>>", self.warm_selected_model)
+        self.dropdown_model_selector.bind("<Return>", self.warm_selected_model)
+        self.root.after(1000, self.warm_selected_model)
         
         model_help_text = """Models can be set from any valid huggingface model.
 Reccomended to use one of the following:
@@ -182,10 +196,58 @@ See the README.md file for more info!"""
         ToolTip(self.dropdown_model_selector, text=model_help_text)
         ToolTip(self.label_select_model, text=model_help_text)
         
+        # precision the model runs in, lower precisions are faster on computers without a GPU
+        self.frame_precision = Frame(self.root, bg=COLOR_THEME.MAIN_WINDOW)
+        self.frame_precision.pack()
+        self.label_precision = Label(self.frame_precision, text="Precision:", font=LABEL_FONT, bg=COLOR_THEME.MAIN_WINDOW)
+        self.label_precision.pack(side=LEFT, padx=5)
+        self.precision_value = StringVar(value=self.cache.get('precision', PRECISIONS[0]))
+        self.dropdown_precision = Combobox(self.frame_precision, values=PRECISIONS, textvariable=self.precision_value, state="readonly", width=8)
+        self.dropdown_precision.pack(side=LEFT, padx=5)
+        self.dropdown_precision.bind("<<ComboboxSelected>>", self.warm_selected_model)
+        precision_help_text = """How precise the numbers inside the AI model are.
+    fp32 - full precision, the slowest but the reference quality.
+    bf16 - half the memory, faster on newer CPUs (falls back to fp32 on CPUs that dont support it).
+    fp16 - half the memory, only for computers with a GPU (falls back to fp32 otherwise).
+    int8 - about a third of the memory and the fastest without a GPU, always runs on the CPU.
+Lower precisions can make a few more mistakes, see benchmarks/bench_precision.py to compare them on your own recordings."""
+        ToolTip(self.dropdown_precision, text=precision_help_text)
+        ToolTip(self.label_precision, text=precision_help_text)
+        
+        # which stages run and with what settings, see cfg/profiles.json
+        self.profiles = load_profiles()
+        self.label_profile = Label(self.frame_precision, text="Profile:", font=LABEL_FONT, bg=COLOR_THEME.MAIN_WINDOW)
+        self.label_profile.pack(side=LEFT, padx=5)
+        profile = self.cache.get('profile', 'standard')
+        self.profile_value = StringVar(value=profile if profile in self.profiles else next(iter(self.profiles), ""))
+        self.dropdown_profile = Combobox(self.frame_precision, values=list(self.profiles), textvariable=self.profile_value, state="readonly", width=22)
+        self.dropdown_profile.pack(side=LEFT, padx=5)
+        self.dropdown_profile.bind("<<ComboboxSelected>>", self.warm_selected_model)
+        self.button_estimate = Button(self.frame_precision, text="Estimate time", command=self.show_estimates, font=BUTTON_FONT, bg=COLOR_THEME.BUTTON)
+        self.button_estimate.pack(side=LEFT, padx=5)
+        profile_help_text = "Which steps run, and on what.\n" + "\n".join(f"    {name} - {p.get('description', '')}" for name, p in self.profiles.items()) + \
+            "\nAdd your own in ~/.cfg/profiles.json, see profiles.py."
+        ToolTip(self.dropdown_profile, text=profile_help_text)
+        ToolTip(self.label_profile, text=profile_help_text)
+        ToolTip(self.button_estimate, text="How long the files in the list would take with every profile,\nfrom how fast the earlier transcriptions on this computer were.")
+        
         # start activity button
         self.button_start_transcribe = Button(self.root, text="Start Transcribe", command=self.start_transcribe, font=BUTTON_FONT, bg=COLOR_THEME.BUTTON)
         self.button_start_transcribe.pack(pady=5)
-        ToolTip(self.button_start_transcribe, text="Click here to start transcribing the files in the list!\nNote: If the transcription seems off, try running it again! Its possible the AI gets different results each time.")
+        
+        self.frame_run_options = Frame(self.root, bg=COLOR_THEME.MAIN_WINDOW)
+        self.frame_run_options.pack()
+        # re-use results of files that were already transcribed with the same settings
+        self.use_cache_value = IntVar(value=int(self.cache.get('useResultCache', True)))
+        self.checkbox_use_cache = Checkbutton(self.frame_run_options, text="Re-use previous results", variable=self.use_cache_value, font=BUTTON_FONT, bg=COLOR_THEME.MAIN_WINDOW, activebackground=COLOR_THEME.MAIN_WINDOW)
+        self.checkbox_use_cache.pack(side=LEFT, padx=5)
+        ToolTip(self.checkbox_use_cache, text="When checked, files that were already transcribed with the same model and settings are loaded\nfrom the cache instead of being transcribed again, and copies of the same file are only transcribed once.\nUncheck this to re-run the AI from scratch.")
+        # pick up where an interrupted batch left off
+        self.resume_value = IntVar(value=int(self.cache.get('resumeUnfinished', False)))
+        self.checkbox_resume = Checkbutton(self.frame_run_options, text="Resume unfinished files", variable=self.resume_value, font=BUTTON_FONT, bg=COLOR_THEME.MAIN_WINDOW, activebackground=COLOR_THEME.MAIN_WINDOW)
+        self.checkbox_resume.pack(side=LEFT, padx=5)
+        ToolTip(self.checkbox_resume, text="When checked, files whose transcription was interrupted continue from the last step that finished,\nand files that already finished completely are skipped.\nUse this to continue a batch after a crash or after closing the app.")
+        ToolTip(self.button_start_transcribe, text="Click here to start transcribing the files in the list!\nNote: If the transcription seems off, try running it again with 'Re-use previous results' unchecked! Its possible the AI gets different results each time.")
         
         # self.dbgbutn = Button(self.root, text="dbgbutton", command=lambda: self.show_mascot("IM TRANSCRIIIIBINNNG!!\nTRANSCRIPTION STARTED, DONT CLICK THE START TRANSCRIBE BUTTON AGAIN UNLESS YOU WANT MULTIPLE TRANSCRIPTIONS RUNNING FOR THE SELECTED THINGIES AT THE SAME TIME!"))
         # self.dbgbutn.pack()
@@ -223,6 +285,11 @@ See the README.md file for more info!"""
         # try:
         #     self.update_cache()
         # except:
+        #     pass
+        try:
+            if self.scheduler:
+                self.scheduler.close()
+        except:
             pass
     
     def get_initial_geometry(self) -> str:
@@ -251,7 +318,8 @@ See the README.md file for more info!"""
             : @todo: pipe?
         """
         self.update_cache()
-        if not is_valid_model_id(self.dropdown_model_selector.get()):
+        # downloaded models are checked without the network, see hf_models.local_models
+        if not is_model_available(self.dropdown_model_selector.get(), read_hf_token(HF_TOKEN_FILENAME)):
             if not spawn_popup_activity("Error!", f"An issue occured when we attempted to get the\n\n{self.dropdown_model_selector.get()}\n\nmodel. Please verify your huggingface token allows for read permissions of the given model.\n\nYes to continue with default model, no to abort!"):
                 return
         
@@ -266,68 +334,129 @@ See the README.md file for more info!"""
                 spawn_popup_activity('WARNING!','Transcript process DID NOT START.\nPlease fix the errors and try again.')
                 return
         
+        from ffmpeg_utils import convert_file_to_type, get_audio_file_types
+        scheduler = self.get_scheduler()
         for item in SelectedFileConfigElement.MANAGER:
             # needs conversion?
             if not (item.get_file().split('.')[-1] in get_audio_file_types()):
                 # looks like it probably needs conversion
-                ntype = ".mp3"
+                # 16 kHz mono PCM is what the models want, so nothing has to be decoded or resampled again later
+                ntype = ".wav"
                 converted = convert_file_to_type(item.get_file(), ntype)
                 if converted is None:
                     with open(f"{item.get_file()}.cha", 'a', encoding='utf-8') as f:
-                        f.write(f"\nFatal error during transcribe:\nFailed to convert the source file {item.get_file()} to {ntype}! Manually try to convert the file to .mp3 and run that through the transcriber!\n")
+                        f.write(f"\nFatal error during transcribe:\nFailed to convert the source file {item.get_file()} to {ntype}! Manually try to convert the file to {ntype} and run that through the transcriber!\n")
                     continue
                 else:
                     item.filepath = converted
-            # priority_levels = [
-            #     psutil.NORMAL_PRIORITY_CLASS, # normal,
-            #     psutil.ABOVE_NORMAL_PRIORITY_CLASS, # above normal
-            #     psutil.ABOVE_NORMAL_PRIORITY_CLASS, # above normal
-            #     psutil.HIGH_PRIORITY_CLASS, # high priority
-            # ]
-            # priority_points = 0
-            # curr_state = psutil.virtual_memory()
-            # if (curr_state.total/(2**30) > 16):
-            #     # 16gb+ ram
-            #     priority_points += 1
-            # if (is_cuda_available()):
-            #     # has cuda
-            #     priority_points += 1
-            #     if (get_cuda_mem_info()[1]/(2**30) > 10):
-            #         # has big cuda
-            #         priority_points += 1
-            proc = subprocess.Popen(
-                args=[
-                    sys.executable,
-                    TRANSCRIBE_SUBPROC_FILENAME,
-                    json.dumps({
-                        'input_file': item.get_file(), 
-                        'num_speakers': item.get_speakers(), 
-                        'lang': item.get_lang(), 
-                        'model_name':selected_model
-                        },
-                        skipkeys=True, 
-                        separators=(',', ':'))
-                    ],
-                    cwd=os.getcwd(),
-                    start_new_session=True
-                )
-            # psutil.Process(proc.pid).nice(priority_levels[priority_points])
-            self.root.title("Transcriber - PLEASE DONT KILL ME - I AM WORKING! I PROMISE!")
-            while proc.poll() == None:
-                try:
-                    self.root.update_idletasks()
-                    sleep(0.1)
-                    #proc.wait(timeout=1)
-                except:
-                    pass
+            # runs as soon as the scheduler has room for it
+            scheduler.add(tag=item, **apply_profile({
+                "input_file": item.get_file(),
+                "num_speakers": item.get_speakers(),
+                "lang": item.get_lang(),
+                "model_name": selected_model,
+                "precision": self.precision_value.get() or PRECISIONS[0],
+                "use_cache": bool(self.use_cache_value.get()),
+                "resume": bool(self.resume_value.get()),
+            }, self.profile_value.get(), self.profiles))
+        self.root.title("Transcriber - PLEASE DONT KILL ME - I AM WORKING! I PROMISE!")
+        self.transcribe_mascots.append(mascot)
+        if not self.transcribe_polling:
+            self.transcribe_polling = True
+            self.pump_scheduler()
+    
+    def pump_scheduler(self):
+        """Picks up what the workers sent (progress, finished files) and starts the queued files, then
+        runs again after PROGRESS_POLL_MS until the batch is done. Never waits, so the window stays responsive."""
+        scheduler = self.get_scheduler()
         try:
-            mascot.destroy()
+            for item, msg in scheduler.pump(timeout=0):
+                item.set_bg(COLOR_THEME.COMPLETED if not msg.get("error") and (msg.get("result") or {}).get("success") else COLOR_THEME.FAILED)
+            for tag, job, job_id in scheduler.running.values():
+                tag.set_bg(COLOR_THEME.IN_PROGRESS)
+            for item, state in scheduler.progress.items():
+                item.set_progress(progress.describe(state))
+            overall = scheduler.overall_progress()
+            speed = f" - {overall['speed']:.1f}x real time" if overall["speed"] else ""
+            eta = f" - {progress.format_duration(overall['eta'])} left" if overall["eta"] is not None else ""
+            self.root.title(f"Transcriber - {overall['done']}/{overall['total']} files done{speed}{eta} - PLEASE DONT KILL ME - I AM WORKING!")
         except:
-            pass
+            # ex: a row that was removed while its file was transcribing
+            traceback.print_exc()
+        if scheduler.busy():
+            self.root.after(PROGRESS_POLL_MS, self.pump_scheduler)
+            return
+        self.transcribe_polling = False
+        for mascot in self.transcribe_mascots:
+            try:
+                mascot.destroy()
+            except:
+                pass
+        self.transcribe_mascots = []
         self.root.title("Transcriber")
         # spawn_popup_activity("Transcriber", "Completed transcribing the files!")
         print("Completed transcribing the latest batch!")
     
+    def warm_selected_model(self, event=None):
+        """Starts loading the selected model in a worker, the first transcribe job is then handed to that worker."""
+        model = self.dropdown_selection_value.get()
+        if not model:
+            return
+        langs = [item.get_lang() for item in SelectedFileConfigElement.MANAGER if item.get_lang()]
+        self.get_scheduler().warm(model, precision=self.precision_value.get() or PRECISIONS[0], lang=langs[0] if langs else "eng", **self.profile_asr_kwargs())
+        if not self.model_status_polling:
+            self.show_model_status()
+    
+    def profile_asr_kwargs(self) -> dict:
+        """
+        Returns:
+            dict: the ASR engine settings of the selected profile, so the model that is warmed up is the one the jobs use.
+        """
+        if not self.profile_value.get():
+            return {}
+        kwargs = profile_kwargs(self.profile_value.get(), self.profiles)
+        return {k: v for k, v in kwargs.items() if k in ASR_KWARGS}
+    
+    def show_estimates(self):
+        """Shows how long the files in the list would take with every profile."""
+        from profiles import estimate_profiles
+        from profiling import audio_duration
+        if len(SelectedFileConfigElement.MANAGER) == 0:
+            raise Exception("Please select the files to estimate first!")
+        jobs, durations = [], []
+        for item in SelectedFileConfigElement.MANAGER:
+            seconds = audio_duration(item.get_file())
+            if seconds is not None:
+                jobs.append({"model_name": self.dropdown_selection_value.get(), "num_speakers": item.get_speakers(), "lang": item.get_lang(),
+                             "precision": self.precision_value.get() or PRECISIONS[0]})
+                durations.append(seconds)
+        lines = [f"{len(jobs)} files, {sum(durations) / 60:.1f} min of audio, one file after the other:", ""]
+        for name, estimate in estimate_profiles(jobs, durations, self.profiles).items():
+            guess = f" (guessed: {', '.join(estimate['guess'])})" if estimate["guess"] else ""
+            lines.append(f"{'> ' if name == self.profile_value.get() else ''}{name}: {progress.format_duration(estimate['seconds'])}{guess}")
+        lines += ["", "Guessed steps have not run on this computer yet, the estimates get better with every transcription."]
+        messagebox.showinfo("Estimated time", "\n".join(lines))
+    
+    def show_model_status(self):
+        """Shows how far the selected model is with loading, until it is done."""
+        scheduler = self.get_scheduler()
+        status = scheduler.poll_warm().get(scheduler.model_key({"model_name": self.dropdown_selection_value.get(), "precision": self.precision_value.get() or PRECISIONS[0], **self.profile_asr_kwargs()}))
+        text = {None: "", "loading": "Loading the model in the background...", "ready": "Model loaded and ready."}
+        self.label_model_status.config(text=text.get(status, f"Could not load the model: {status}"))
+        self.model_status_polling = status == "loading"
+        if self.model_status_polling:
+            self.root.after(500, self.show_model_status)
+    
+    def get_scheduler(self) -> "TranscribeScheduler":
+        """
+        Returns:
+            TranscribeScheduler: the scheduler that runs the transcribe jobs, its workers are kept between batches.
+        """
+        if self.scheduler is None:
+            from scheduler import TranscribeScheduler
+            self.scheduler = TranscribeScheduler()
+        return self.scheduler
+    
     def show_error(self, *args):
         """Display the error to the user as a popup window"""
         err = traceback.format_exception(*args)
@@ -336,23 +465,43 @@ See the README.md file for more info!"""
     
     def get_model_list(self) -> List[str]:
         """
-        Gets an updated list of models
+        Gets the list of models from the last search, it is searched again in the background when
+        it is out of date, see hf_models.py. Never waits on the network.
         Returns:
             List[str]: List of available model names
         """
-        models = {}
         models_to_search = []
         if os.path.isfile(MODELS_CFG_FILENAME):
             with open(MODELS_CFG_FILENAME, 'r', encoding='utf-8') as f:
                 models_to_search = json.load(f)
-        for q in models_to_search:
-            results = get_hf_search_query(**q)
-            for r in results:
-                if r.get('pipeline_tag') == 'automatic-speech-recognition':
-                    models[r['id']] = r
-        models = sorted(models, key = lambda k: models[k].get('downloads', models[k].get('likes', 0)), reverse=True)
+        models, fresh = load_model_list(models_to_search)
+        # tk widgets can only be touched from this thread, so the results are handed over in a queue
+        self.model_list_updates = queue.Queue()
+        # models that are already downloaded work offline too, the cache is scanned in the background
+        # since that imports huggingface_hub
+        scan = threading.Thread(target=lambda: self.model_list_updates.put(list(local_models())), name="local-models", daemon=True)
+        scan.start()
+        self.model_list_threads = [scan]
+        if not fresh:
+            self.model_list_threads.append(refresh_model_list(models_to_search, read_hf_token(HF_TOKEN_FILENAME), callback=self.model_list_updates.put))
+        self.root.after(250, self.poll_model_list)
         return models
     
+    def poll_model_list(self):
+        """Adds the models from the finished background scan and search to the dropdown."""
+        # checked first, whatever a finished thread found is in the queue by now
+        searching = any(thread.is_alive() for thread in self.model_list_threads)
+        while True:
+            try:
+                models = self.model_list_updates.get_nowait()
+            except queue.Empty:
+                break
+            current = list(self.dropdown_model_selector['values'])
+            self.dropdown_model_selector['values'] = current + [m for m in models if m not in current]
+        # a search that ended without a result was offline, the kept list stays
+        if searching:
+            self.root.after(250, self.poll_model_list)
+    
     def load_cache(self):
         """Loads and imports data from the cache file to save time."""
         if os.path.isfile(CACHE_FILENAME):
@@ -368,6 +517,10 @@ See the README.md file for more info!"""
         cache = self.cache or {}
         if self.dropdown_model_selector['values']:
             cache["modelCache"] = cache.get('modelCache',[]) + [str(x) for x in self.dropdown_model_selector['values'] if str(x) not in cache.get('modelCache', [])]
+        cache["useResultCache"] = bool(self.use_cache_value.get())
+        cache["resumeUnfinished"] = bool(self.resume_value.get())
+        cache["precision"] = self.precision_value.get() or PRECISIONS[0]
+        cache["profile"] = self.profile_value.get() or None
         if self.dropdown_selection_value.get():
             cache["selectedModel"] = self.dropdown_selection_value.get() or self.cache.get("selectedModel", None)
         cache["fileCache"] = [
@@ -409,6 +562,7 @@ See the README.md file for more info!"""
         # Get screen dimensions
         screen_width = self.root.winfo_screenwidth()
         screen_height = self.root.winfo_screenheight()
+        from PIL import Image, ImageTk
         img = None
         # Load and scale the image
         if os.path.isfile(MASCOT_FILENAME):
@@ -467,6 +621,8 @@ class SelectedFileConfigElement:
         self.file_label = Label(self.label_frame, text=filename, width=35, font=(MONO_FONT, 10, BOLD), anchor="w", justify=LEFT, )
         self.path_label.grid(row=0, column=0)
         self.file_label.grid(row=1, column=0)
+        # stage, chunks, speed and ETA while the file transcribes, only shown once there is something to show
+        self.progress_label = Label(self.label_frame, text="", font=TOOLTIP_FONT, anchor="w", justify=LEFT, wraplength=320)
         ToolTip(self.label_frame, f"File path to be transcribed:\n\t{self.filepath}")
         # @todo: make quick context menu?
         # self.context_menu = Menu(self.parent, tearoff=0)
@@ -500,6 +656,14 @@ class SelectedFileConfigElement:
         self.label_frame.configure(bg=color)
         self.file_label.configure(bg=color)
         self.path_label.configure(bg=color)
+        self.progress_label.configure(bg=color)
+    
+    def set_progress(self, text):
+        self.progress_label.configure(text=text)
+        if text:
+            self.progress_label.grid(row=2, column=0, sticky="w")
+        else:
+            self.progress_label.grid_remove()
     
     def set_clipboard_to_filepath(self, event):
         try:
@@ -622,30 +786,22 @@ def get_hf_token():
     return hf_token
 
 def get_hf_search_query(**kwargs):
-    """Get hf search query
+    """Get hf search query, see hf_models.search_models
     Expects kwargs to pass to the GET request.
     Ex:
     search="whisper",author="openai"
     etc.
     Returns:
-        _type_: _description_
+        List[dict]: the matching models, empty if the token was refused.
     """
-    hf_token = get_hf_token()
-    response = requests.get(
-        "https://huggingface.co/api/models",
-        params={
-            **{k:kwargs[k] for k in kwargs if not k.lower().strip().startswith('expand')},
-            "sort": kwargs.get('sort', "downloads"),
-            "limit": kwargs.get('limit', "10"),
-            "config": "True",
-            "full": "False",
-        },
-        headers={
-            "Authorization":f"Bearer {hf_token}"
-        })
-    if response.status_code == 401:
+    import requests
+    try:
+        return search_models(kwargs, get_hf_token())
+    except requests.HTTPError as e:
+        if e.response is None or e.response.status_code != 401:
+            raise
         spawn_popup_activity("Error!", f"Invalid huggingface token!\nTo use the search feature, you must have a file named\n\t'{HF_TOKEN_FILENAME}'\nthat contains your huggingface token!\nSee here for details:\n\nhttps://huggingface.co/docs/hub/en/security-tokens")
-    return response.json()
+        return []
 
 def search_for_hf_model(query):
     """Searches huggingface to validate a model name
@@ -700,6 +856,7 @@ def get_available_langs() -> List[str]:
 def validate_language(inp):
     if not inp:
         return inp
+    import pycountry
     try:
         l = pycountry.languages.lookup(inp)
         return l.alpha_3
@@ -710,15 +867,6 @@ def validate_language(inp):
 def get_any_file_type() -> List[str]:
     return ["*", ".*", "*.*"]
 
-def get_audio_file_types() -> List[str]:
-    """Supported audio file types that dont need to be converted
-
-    Returns:
-        list of file extentions
-    """
-    # if its not usable by the soundfile package then it will cause an error to be thrown
-    return [t.lower() for t in soundfile.available_formats().keys()]
-
 @lru_cache(maxsize=1)
 def get_ffmpeg_supported_formats():
     try:
@@ -763,36 +911,6 @@ def get_video_file_types() -> List[str]:
         "evo", "divx", "m4a"
     ]
 
-def convert_file_to_type(inp_file: str, totype: str):
-    """Converts given file to the file type using ffmpeg.
-
-    Args:
-        inp_file (str): the input file path
-        totype (str): the output file type extention
-
-    Returns:
-        str: the output file path
-    """
-    name, ext = os.path.splitext(inp_file)
-    out_name = f"{name}{'' if str(totype).startswith('.') else '.'}{totype}"
-    if os.path.exists(out_name):
-        # assume it has already converted the file
-        print(f"Using cached version of {inp_file}!")
-        return out_name
-    print(f"Converting {inp_file} to {totype} type so that it can be transcribed!")
-    try:
-        out, err = (ffmpeg
-            .input(inp_file)
-            .output(out_name)#, format='s16le', acodec='pcm_s16le', ac=1, ar='16k')
-            .run(capture_stdout=True, capture_stderr=True)
-        )
-    except ffmpeg.Error as e:
-        print(e.stderr, file=sys.stderr)
-        print(f"Failed to convert '{inp_file}' to '{totype}'! Please attempt to convert it to '{totype}' manually and retrying!")
-        return None
-    print(f"Convertion completed! Output file can be found at '{out_name}'")
-    return out_name
-
 def validate_requirements():
     has_errors = False
     # validate for ffmpeg
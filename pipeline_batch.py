@@ -0,0 +1,182 @@
+"""Runs a batch of files through the pipeline with every stage working on a different file.
+
+One after the other, file B can only start its ASR once file A is done with forced
+alignment, and all that time the whisper model sits idle in memory. Here every stage
+has a worker thread of its own and a small queue in front of it: a file goes through
+its stages in order like it always did (transcribe_file does not change), but each
+stage runs on that stage's worker. So while file A is being aligned, file B is in
+diarization and file C is in ASR, and the batch takes about as long as its slowest
+stage instead of the sum of all of them.
+
+The queues are bounded, so a slow stage holds the files before it back instead of
+having every document of the batch piling up in memory. The engines stay the cached
+ones of transcribe_proc, and every engine is only ever called from its own stage's
+worker. The models release the GIL while they compute, so threads are enough.
+"""
+import threading
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from queue import Queue
+
+# stage -> the worker that runs it, the text stages are cheap and share one
+STAGE_WORKERS = {
+    "asr": "asr",
+    "speaker": "speaker",
+    "disfluency": "text",
+    "retrace": "text",
+    "morphosyntax": "text",
+    "utr": "utr",
+    "fa": "fa",
+}
+# files that can wait in front of a worker
+QUEUE_SIZE = 2
+
+
+class StagePipeline:
+    """A worker thread per stage with a bounded queue in front of it.
+
+    Use it as a context manager, the workers stop when it exits.
+    """
+
+    def __init__(self, queue_size=QUEUE_SIZE, stage_workers=None):
+        """
+        Args:
+            queue_size (int): how many files can wait in front of each worker, a file that does not fit waits where it is.
+            stage_workers (Dict[str, str], optional): stage -> worker name, defaults to STAGE_WORKERS.
+                Stages that are not in it run right where they are asked for.
+        """
+        self.stage_workers = dict(STAGE_WORKERS if stage_workers is None else stage_workers)
+        self.workers = list(dict.fromkeys(self.stage_workers.values()))
+        self.queue_size = max(1, int(queue_size))
+        self.queues = {worker: Queue(maxsize=self.queue_size) for worker in self.workers}
+        # what every worker is running right now, and how long it has been busy in total
+        self.running = {worker: None for worker in self.workers}
+        self.busy_seconds = {worker: 0.0 for worker in self.workers}
+        self.done = {worker: 0 for worker in self.workers}
+        self._threads = [threading.Thread(target=self._work, args=(worker,), name=f"stage-{worker}", daemon=True)
+                         for worker in self.workers]
+        for thread in self._threads:
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Lets the workers finish what is queued, then stops them."""
+        for worker in self.workers:
+            self.queues[worker].put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def _work(self, worker):
+        queue = self.queues[worker]
+        while True:
+            item = queue.get()
+            if item is None:
+                return
+            fn, tag, future = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            self.running[worker] = tag
+            start = time.perf_counter()
+            try:
+                future.set_result(fn())
+            except BaseException as e:
+                future.set_exception(e)
+            self.busy_seconds[worker] += time.perf_counter() - start
+            self.done[worker] += 1
+            self.running[worker] = None
+
+    def run(self, stage, fn, tag=None):
+        """Runs fn on the worker of the stage, after the files queued before it, and waits for it.
+        This is the `stage_runner` of `transcribe_proc.transcribe_file`.
+
+        Args:
+            stage (str): see STAGE_WORKERS.
+            fn (Callable[[], Any]): the stage's work for one file.
+            tag (str, optional): what the file is called in `describe`.
+
+        Returns:
+            whatever fn returns, and raises whatever it raises.
+        """
+        worker = self.stage_workers.get(stage)
+        if worker is None:
+            return fn()
+        future = Future()
+        # blocks while the queue is full
+        self.queues[worker].put((fn, tag, future))
+        return future.result()
+
+    def describe(self) -> str:
+        """
+        Returns:
+            str: what every worker is doing, ex: "asr: b.wav +1 waiting | speaker: a.wav | text: idle".
+        """
+        parts = []
+        for worker in self.workers:
+            running = self.running[worker]
+            waiting = self.queues[worker].qsize()
+            parts.append(f"{worker}: {running or 'idle'}" + (f" +{waiting} waiting" if waiting else ""))
+        return " | ".join(parts)
+
+    def map(self, transcribe, jobs, tick_s=None, on_tick=None):
+        """Transcribes every job, with as many files going at once as can be in the workers and their queues.
+
+        Args:
+            transcribe (Callable): ex: `transcribe_proc.transcribe_file`, gets a job's kwargs and `stage_runner`.
+            jobs (List[dict]): the kwargs of every file.
+            tick_s (float, optional): call on_tick this often while waiting.
+            on_tick (Callable[[StagePipeline], None], optional): ex: to print `describe`.
+
+        Yields:
+            Tuple[int, Any, str | None]: the index of a job, its result and the traceback if it raised, as the files finish.
+        """
+        def run(job):
+            return transcribe(**job, stage_runner=lambda stage, fn, tag=job.get("input_file"): self.run(stage, fn, tag))
+
+        # one in every worker and a full queue in front of each, more would only wait
+        in_flight = len(self.workers) + self.queue_size
+        with ThreadPoolExecutor(max_workers=in_flight, thread_name_prefix="file") as pool:
+            futures = {pool.submit(run, job): i for i, job in enumerate(jobs)}
+            pending = set(futures)
+            last_tick = time.monotonic()
+            while pending:
+                done, pending = wait(pending, timeout=tick_s, return_when=FIRST_COMPLETED)
+                for future in sorted(done, key=futures.get):
+                    error = future.exception()
+                    if error is not None:
+                        yield futures[future], None, "".join(traceback.format_exception(type(error), error, error.__traceback__))
+                    else:
+                        yield futures[future], future.result(), None
+                if on_tick is not None and tick_s and time.monotonic() - last_tick >= tick_s:
+                    last_tick = time.monotonic()
+                    on_tick(self)
+
+    def utilization(self, wall_seconds) -> dict:
+        """
+        Returns:
+            Dict[str, dict]: for every worker, how many times it ran, the seconds it was busy and which part of wall_seconds that is.
+        """
+        return {worker: {"runs": self.done[worker], "busy_seconds": self.busy_seconds[worker],
+                         "busy": self.busy_seconds[worker] / wall_seconds if wall_seconds else None}
+                for worker in self.workers}
+
+
+def expected_makespan(stage_seconds, files) -> tuple:
+    """What the batch should take if every file spends the same time in every stage.
+
+    Args:
+        stage_seconds (List[float]): seconds per file of every worker, in order.
+        files (int): how many files.
+
+    Returns:
+        Tuple[float, float]: seconds one after the other, and seconds pipelined (the first file goes through
+            every stage, the others come out behind it one slowest stage apart).
+    """
+    if not files or not stage_seconds:
+        return 0.0, 0.0
+    return files * sum(stage_seconds), sum(stage_seconds) + (files - 1) * max(stage_seconds)
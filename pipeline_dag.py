@@ -0,0 +1,167 @@
+"""Runs the stages of a file's pipeline as a dependency graph instead of one after the other.
+
+Most stages need the document the stage before them made, but speaker diarization
+only needs the ASR output: it reads the audio and puts a speaker on every utterance,
+and none of the later stages (disfluency, retrace, utr, fa, ...) look at the speakers.
+So diarization runs in a thread next to the rest of the chain, on its own copy of
+the document, and its speakers are copied into the chain's result at the end. When
+the utterances no longer line up (a stage split or merged some), the branch stage
+runs again on the final document instead, like the sequential pipeline would.
+
+The models release the GIL while they compute, so threads are enough, and the
+engines stay the ones cached in the worker. `critical_path` tells how long the file
+would take with enough cores: the longest chain of stages that had to wait on
+each other.
+"""
+import copy
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# stage -> the only stages it needs, everything else needs the stage before it
+BRANCH_STAGES = {
+    "speaker": ("asr",),
+}
+
+
+def build_graph(stages) -> dict:
+    """
+    Args:
+        stages (List[str]): the stages that run, in the order of transcribe_proc.STAGES.
+
+    Returns:
+        Dict[str, Tuple[str, ...]]: every stage and the stages it needs, in an order where the needed ones come first.
+            A branch stage whose stages are not all on stays in the chain.
+    """
+    graph = {}
+    previous = None
+    for stage in stages:
+        deps = BRANCH_STAGES.get(stage)
+        if deps is not None and all(d in graph for d in deps):
+            graph[stage] = tuple(deps)
+            continue
+        graph[stage] = (previous,) if previous else ()
+        previous = stage
+    return graph
+
+
+def branches(graph) -> list:
+    """
+    Returns:
+        List[str]: the stages that run next to the chain and get merged into its result.
+    """
+    return [stage for stage in graph if stage in BRANCH_STAGES and graph[stage] == BRANCH_STAGES[stage]]
+
+
+def chain_end(graph):
+    """
+    Returns:
+        str | None: the last stage of the chain, its document is the result.
+    """
+    side = branches(graph)
+    return next((stage for stage in reversed(graph) if stage not in side), None)
+
+
+def merge_speakers(doc, speaker_doc):
+    """Copies the speaker of every utterance from the diarized copy into the document.
+
+    Returns:
+        Document | None: the document, None if the utterances of the two do not line up.
+    """
+    if len(doc.content) != len(speaker_doc.content):
+        return None
+    for line, speaker_line in zip(doc.content, speaker_doc.content):
+        if hasattr(line, "tier") != hasattr(speaker_line, "tier"):
+            return None
+    for line, speaker_line in zip(doc.content, speaker_doc.content):
+        if hasattr(line, "tier"):
+            line.tier = speaker_line.tier
+    if hasattr(speaker_doc, "tiers"):
+        doc.tiers = speaker_doc.tiers
+    return doc
+
+
+# stage -> how its result is put into the chain's document
+MERGES = {
+    "speaker": merge_speakers,
+}
+
+
+def run_graph(graph, run_stage, doc, max_workers=None):
+    """Runs every stage as soon as the stages it needs are done.
+
+    Args:
+        graph (dict): from `build_graph`.
+        run_stage (Callable[[str, Document], Document]): runs one stage, should not raise, a failed
+            stage returns the document it was given.
+        doc (Document): what the first stages start from.
+        max_workers (int, optional): most stages to run at once, defaults to as many as can.
+
+    Returns:
+        Tuple[Document, dict, List[str]]: the final document, the (start, end) perf_counter time of
+            every stage, and the branch stages that could not be merged and ran again at the end.
+    """
+    outputs, timings = {}, {}
+    side = set(branches(graph))
+    lock = threading.Lock()
+
+    def run(stage, doc):
+        start = time.perf_counter()
+        out = run_stage(stage, doc)
+        with lock:
+            timings[stage] = (start, time.perf_counter())
+        return out
+
+    def input_of(stage):
+        if not graph[stage]:
+            return doc
+        source = outputs[graph[stage][0]]
+        # the chain keeps changing its document in place, the branches get a copy
+        return copy.deepcopy(source) if stage in side else source
+
+    todo = list(graph)
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers or len(graph), thread_name_prefix="stage") as pool:
+        while todo or running:
+            ready = [s for s in todo if all(d in outputs for d in graph[s])]
+            # copied before anything starts changing the documents again
+            inputs = [input_of(stage) for stage in ready]
+            for stage, stage_doc in zip(ready, inputs):
+                todo.remove(stage)
+                running[pool.submit(run, stage, stage_doc)] = stage
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                outputs[running.pop(future)] = future.result()
+
+    end = chain_end(graph)
+    final = outputs[end] if end is not None else doc
+    rerun = []
+    for stage in branches(graph):
+        merged = MERGES.get(stage, lambda doc, other: None)(final, outputs[stage])
+        if merged is None:
+            # same as running it in sequence, just later
+            final = run(stage, final)
+            rerun.append(stage)
+        else:
+            final = merged
+    return final, timings, rerun
+
+
+def critical_path(graph, timings, rerun=()):
+    """
+    Args:
+        rerun (List[str]): branch stages that ran again after the chain, see `run_graph`.
+
+    Returns:
+        Tuple[float, List[str]]: the seconds of the longest chain of stages that had to wait on each other, and the chain.
+    """
+    end = chain_end(graph)
+    best = {}
+    for stage in [s for s in graph if s not in rerun] + list(rerun):
+        if stage not in timings:
+            continue
+        seconds = timings[stage][1] - timings[stage][0]
+        deps = (end,) if stage in rerun else graph[stage]
+        before = max((best[d] for d in deps if d in best), default=(0.0, []), key=lambda b: b[0])
+        best[stage] = (before[0] + seconds, before[1] + [stage])
+    return max(best.values(), default=(0.0, []), key=lambda b: b[0])
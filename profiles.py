@@ -0,0 +1,169 @@
+"""Pipeline profiles: named sets of stages and their settings, picked in the GUI or with --profile.
+
+The profiles are in cfg/profiles.json, and in ~/.cfg/profiles.json for your own
+(a profile there with the same name wins):
+    {
+        "name": {
+            "description": str,
+            "stages": {stage: {"device": "auto" | "cpu" | "cuda", "threads": int, "batch_size": int}},
+            "options": {any other transcribe_file kwargs, ex: "asr_engine": "custom"}
+        }
+    }
+Only the listed stages run, in the order of transcribe_proc.STAGES. `profile_kwargs`
+turns a profile into transcribe_file kwargs, so a job stays plain json for the workers,
+and whatever the job sets itself wins over the profile.
+
+device and batch_size only go with the asr stage, the other stages are batchalign's
+engines, which pick their own device and have no batch size. threads is the number
+of torch threads while the stage runs.
+
+`estimate` tells how long files would take with a profile, from the real-time factors
+of earlier runs of the same stage configuration, see profiling.record_rtfs.
+"""
+import json
+import statistics
+from pathlib import Path
+
+from profiling import load_rtf_history, rtf_key
+from user_config import CONFIG_DIR
+
+THIS_DIR = Path(__file__).parent.expanduser().resolve()
+PROFILES_DEFAULT = Path(THIS_DIR, "cfg", "profiles.json")
+PROFILES_FILENAME = CONFIG_DIR / "profiles.json"
+# what a stage of a profile can set, and which stages can set it
+STAGE_SETTINGS = {
+    "device": ("asr",),
+    "batch_size": ("asr",),
+    "threads": None,
+}
+# the transcribe_file kwargs that decide which ASR engine is loaded, see transcribe_proc.warm_up
+ASR_KWARGS = ("asr_engine", "asr_batch_size", "asr_streaming", "vad", "asr_backend", "asr_shards", "asr_device")
+# rough real-time factors for stage configurations that never ran here, better than nothing
+DEFAULT_RTF = {"asr": 0.3, "speaker": 0.1, "disfluency": 0.01, "retrace": 0.01, "morphosyntax": 0.05, "utr": 0.2, "fa": 0.15}
+
+
+def load_profiles(paths=(PROFILES_DEFAULT, PROFILES_FILENAME)) -> dict:
+    """
+    Returns:
+        Dict[str, dict]: every profile by name, the later files win.
+    """
+    profiles = {}
+    for path in paths:
+        if Path(path).is_file():
+            with open(path, "r", encoding="utf-8") as f:
+                profiles.update(json.load(f))
+    return profiles
+
+
+def profile_kwargs(name, profiles=None) -> dict:
+    """
+    Args:
+        name (str): the profile.
+        profiles (dict, optional): defaults to `load_profiles`.
+
+    Raises:
+        ValueError: for an unknown profile, or a stage or setting that is not allowed.
+
+    Returns:
+        dict: the transcribe_file kwargs of the profile.
+    """
+    from transcribe_proc import STAGES
+
+    profiles = load_profiles() if profiles is None else profiles
+    if name not in profiles:
+        raise ValueError(f"Unknown profile {name}, expected one of {', '.join(profiles)}")
+    stages = profiles[name].get("stages", {})
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if unknown:
+        raise ValueError(f"Unknown stage(s) {', '.join(unknown)} in the {name} profile, expected some of {', '.join(STAGES)}")
+    for stage, settings in stages.items():
+        for key, value in (settings or {}).items():
+            if key not in STAGE_SETTINGS:
+                raise ValueError(f"Unknown setting {key} of the {stage} stage in the {name} profile, expected some of {', '.join(STAGE_SETTINGS)}")
+            allowed = STAGE_SETTINGS[key]
+            # "auto" is what the other stages do anyway
+            if allowed is not None and stage not in allowed and value not in (None, "auto"):
+                raise ValueError(f"The {stage} stage of the {name} profile cant set {key}, only {', '.join(allowed)} can")
+
+    asr = stages.get("asr") or {}
+    kwargs = {**profiles[name].get("options", {}), "stages": [stage for stage in STAGES if stage in stages]}
+    if asr.get("batch_size"):
+        kwargs["asr_batch_size"] = asr["batch_size"]
+    if asr.get("device") not in (None, "auto"):
+        kwargs["asr_device"] = asr["device"]
+    threads = {stage: settings["threads"] for stage, settings in stages.items() if (settings or {}).get("threads")}
+    if threads:
+        kwargs["stage_threads"] = threads
+    return kwargs
+
+
+def apply_profile(job, name, profiles=None) -> dict:
+    """
+    Returns:
+        dict: the job's transcribe_file kwargs on top of the profile's.
+    """
+    return {**profile_kwargs(name, profiles), **job} if name else dict(job)
+
+
+def job_steps(job) -> list:
+    """
+    Returns:
+        List[Tuple[str, tuple]]: the (stage, step description) of every step the job would run, without loading anything.
+    """
+    from transcribe_proc import describe_steps, get_pipeline, normalize_lang
+
+    pipeline = get_pipeline(job.get("model_name"), int(job.get("num_speakers", 2) or 2), normalize_lang(job.get("lang", "eng")),
+                            job.get("asr_engine", "batchalign"), job.get("asr_batch_size"), job.get("asr_streaming", False),
+                            job.get("vad", False), job.get("precision", "fp32"), job.get("asr_backend", "hf"), job.get("stages"),
+                            job.get("asr_shards", 1), job.get("asr_device"))
+    return list(zip([stage for stage, _ in pipeline], describe_steps([spec for _, spec in pipeline])))
+
+
+def estimate(job, audio_seconds, history=None) -> dict:
+    """How long a file would take, one stage after the other.
+
+    Every stage uses the median of the recorded real-time factors of the same configuration,
+    or else of the same stage in any configuration, or else DEFAULT_RTF.
+
+    Args:
+        job (dict): transcribe_file kwargs, ex: from `apply_profile`.
+        audio_seconds (float): length of the file.
+        history (dict, optional): defaults to `profiling.load_rtf_history`.
+
+    Returns:
+        dict: "seconds" in total, and the "stage", "rtf", "seconds" and "source" ("recorded", "other settings" or "guess") of every stage.
+    """
+    history = load_rtf_history() if history is None else history
+    threads = job.get("stage_threads") or {}
+    stages = []
+    for stage, step in job_steps(job):
+        rtfs, source = history.get(rtf_key(stage, step, threads.get(stage))), "recorded"
+        if not rtfs:
+            rtfs, source = [rtf for key, values in history.items() if json.loads(key)[0] == stage for rtf in values], "other settings"
+        rtf = statistics.median(rtfs) if rtfs else DEFAULT_RTF.get(stage, 0.1)
+        stages.append({"stage": stage, "rtf": rtf, "seconds": rtf * (audio_seconds or 0), "source": source if rtfs else "guess"})
+    return {"seconds": sum(s["seconds"] for s in stages), "stages": stages}
+
+
+def estimate_profiles(jobs, durations, profiles=None, history=None) -> dict:
+    """Estimates a batch with every profile, to pick the one that is done in time.
+
+    Args:
+        jobs (List[dict]): transcribe_file kwargs without a profile, the profile's settings go under them.
+        durations (List[float]): the audio seconds of every job.
+
+    Returns:
+        Dict[str, dict]: by profile, its "description", the "seconds" of the whole batch one file after the other,
+            and the stages whose estimate is a "guess".
+    """
+    profiles = load_profiles() if profiles is None else profiles
+    history = load_rtf_history() if history is None else history
+    results = {}
+    for name, profile in profiles.items():
+        files = [estimate(apply_profile(job, name, profiles), seconds, history) for job, seconds in zip(jobs, durations)]
+        results[name] = {
+            "description": profile.get("description", ""),
+            "seconds": sum(f["seconds"] for f in files),
+            "guess": sorted({s["stage"] for f in files for s in f["stages"] if s["source"] == "guess"}),
+        }
+    return results
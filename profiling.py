@@ -0,0 +1,264 @@
+"""Per stage resource usage of the transcribe pipeline.
+
+`transcribe_file` wraps every pipeline stage in `StageProfiler.stage`, which records
+wall time, CPU time (of all threads, the models run multi threaded), peak resident
+memory, peak CUDA memory when a GPU is in use, and the real-time factor against the
+length of the audio. One stage can also be run under cProfile, the resulting .prof
+file opens in snakeviz, `python -m pstats`, or any tool that reads pstats files.
+
+CPU time, memory and the CUDA peak are only known for the whole process. When stages
+run at the same time (pipeline_dag.py, pipeline_batch.py) their numbers include each
+other, so every stage lists the stages it overlapped in "shared_with" and its real-time
+factor is not kept for the estimates.
+
+The real-time factor of every stage that ran is also kept in RTF_HISTORY_FILENAME,
+by stage and configuration, so profiles.py can tell how long a batch would take.
+"""
+import cProfile
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from user_config import CONFIG_DIR
+
+MB = 2**20
+# how often the memory of a running stage is sampled, in seconds
+RSS_SAMPLE_INTERVAL_S = 0.05
+# recent real-time factors of every stage configuration
+RTF_HISTORY_FILENAME = CONFIG_DIR / "stage_rtf.json"
+# how many runs of every configuration are kept
+RTF_HISTORY_RUNS = 20
+
+
+def audio_duration(path):
+    """
+    Returns:
+        float | None: length of the media file in seconds, None if it cant be read.
+    """
+    try:
+        import soundfile
+        return soundfile.info(str(path)).duration
+    except Exception:
+        pass
+    try:
+        import ffmpeg
+        return float(ffmpeg.probe(str(path))["format"]["duration"])
+    except Exception:
+        return None
+
+
+def _cuda():
+    """
+    Returns:
+        module | None: torch.cuda if torch is already loaded and a GPU is available.
+    """
+    torch = sys.modules.get("torch")
+    try:
+        return torch.cuda if torch is not None and torch.cuda.is_available() else None
+    except Exception:
+        return None
+
+
+# the stages running in this process, by id, and the names of the stages that ran next to each of them
+_running = {}
+_running_lock = threading.Lock()
+
+
+def running_stages() -> list:
+    """
+    Returns:
+        List[str]: the stages (of any file) that are being measured in this process right now.
+    """
+    with _running_lock:
+        return [name for name, _ in _running.values()]
+
+
+class _PeakRSS(threading.Thread):
+    """Samples the resident memory of the process in the background and keeps the highest value."""
+
+    def __init__(self, proc):
+        super().__init__(daemon=True)
+        self.proc = proc
+        self.peak = proc.memory_info().rss
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(RSS_SAMPLE_INTERVAL_S):
+            self.peak = max(self.peak, self.proc.memory_info().rss)
+
+    def stop(self):
+        self._done.set()
+        self.join()
+        self.peak = max(self.peak, self.proc.memory_info().rss)
+        return self.peak
+
+
+class StageProfiler:
+    def __init__(self, audio_seconds=None, profile_stage=None, profile_file=None):
+        """
+        Args:
+            audio_seconds (float, optional): length of the audio, for the real-time factor.
+            profile_stage (str, optional): name of the stage to run under cProfile.
+            profile_file (str, optional): where to write the cProfile stats of that stage.
+        """
+        self.audio_seconds = audio_seconds
+        self.profile_stage = profile_stage
+        self.profile_file = profile_file
+        self.stages = []
+        # wall and cpu time of the whole pipeline when its stages ran at the same time, see pipeline_dag.py
+        self.wall_seconds = None
+        self.cpu_seconds = None
+        import psutil
+        self.proc = psutil.Process()
+
+    @contextmanager
+    def stage(self, name):
+        """Measures everything that runs inside the with block as one stage.
+
+        Yields:
+            dict: the metrics of the stage, filled in once the block exits.
+        """
+        metrics = {"stage": name}
+        token = object()
+        with _running_lock:
+            shared_with = set()
+            for other, others_shared in _running.values():
+                shared_with.add(other)
+                others_shared.add(name)
+            _running[token] = (name, shared_with)
+            alone = len(_running) == 1
+        cuda = _cuda()
+        # the peak is for the whole process, resetting it would lose the peak of the stages that are running
+        if cuda is not None and alone:
+            cuda.reset_peak_memory_stats()
+        sampler = _PeakRSS(self.proc)
+        sampler.start()
+        profiler = cProfile.Profile() if name == self.profile_stage and self.profile_file else None
+        cpu_start = self.process_cpu_seconds()
+        wall_start = time.perf_counter()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield metrics
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(self.profile_file)
+                metrics["profile_file"] = self.profile_file
+            metrics["wall_seconds"] = time.perf_counter() - wall_start
+            metrics["cpu_seconds"] = self.process_cpu_seconds() - cpu_start
+            metrics["peak_rss_mb"] = sampler.stop() / MB
+            # torch could have been imported by the stage itself
+            cuda = cuda or _cuda()
+            metrics["cuda_peak_mb"] = cuda.max_memory_allocated() / MB if cuda is not None else None
+            metrics["audio_seconds"] = self.audio_seconds
+            metrics["rtf"] = metrics["wall_seconds"] / self.audio_seconds if self.audio_seconds else None
+            with _running_lock:
+                del _running[token]
+            # cpu, memory and cuda above include these stages too
+            metrics["shared_with"] = sorted(shared_with)
+            self.stages.append(metrics)
+
+    def summary(self, metrics) -> str:
+        """
+        Returns:
+            str: one line summary of a stage, for the @DEBUG block.
+        """
+        parts = [
+            f"wall {metrics['wall_seconds']:.2f}s",
+            f"cpu {metrics['cpu_seconds']:.2f}s",
+            f"peak rss {metrics['peak_rss_mb']:.0f}MB",
+        ]
+        if metrics.get("cuda_peak_mb") is not None:
+            parts.append(f"cuda peak {metrics['cuda_peak_mb']:.0f}MB")
+        if metrics.get("rtf") is not None:
+            parts.append(f"rtf {metrics['rtf']:.3f}")
+        if metrics.get("shared_with"):
+            parts.append(f"cpu and memory shared with {', '.join(metrics['shared_with'])}")
+        return ", ".join(parts)
+
+    def total(self) -> dict:
+        """
+        Returns:
+            dict: the metrics of all the stages together.
+        """
+        wall = self.wall_seconds if self.wall_seconds is not None else sum(m["wall_seconds"] for m in self.stages)
+        cpu = self.cpu_seconds if self.cpu_seconds is not None else sum(m["cpu_seconds"] for m in self.stages)
+        cuda = [m["cuda_peak_mb"] for m in self.stages if m.get("cuda_peak_mb") is not None]
+        return {
+            "wall_seconds": wall,
+            "cpu_seconds": cpu,
+            "peak_rss_mb": max([m["peak_rss_mb"] for m in self.stages], default=None),
+            "cuda_peak_mb": max(cuda) if cuda else None,
+            "audio_seconds": self.audio_seconds,
+            "rtf": wall / self.audio_seconds if self.audio_seconds else None,
+            # the stage metrics count some of the same cpu and memory more than once
+            "shared": any(m.get("shared_with") for m in self.stages),
+        }
+
+    def process_cpu_seconds(self) -> float:
+        """
+        Returns:
+            float: user + system time of the whole process so far.
+        """
+        return sum(self.proc.cpu_times()[:2])
+
+    def write_json(self, path, **extra):
+        """Writes every stage's metrics, the totals and any extra fields to a json file."""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({**extra, "total": self.total(), "stages": self.stages}, f, indent=2)
+
+
+def rtf_key(stage, step, threads=None) -> str:
+    """
+    Args:
+        stage (str): ex: "asr".
+        step (tuple): the step's description, see `transcribe_proc.describe_steps`, it has the model, batch size, device...
+        threads (int, optional): the torch threads the stage ran with.
+
+    Returns:
+        str: what the real-time factors of a stage configuration are kept under.
+    """
+    return json.dumps([stage, step, threads], default=str)
+
+
+def load_rtf_history(path=RTF_HISTORY_FILENAME) -> dict:
+    """
+    Returns:
+        Dict[str, List[float]]: the recent real-time factors by `rtf_key`, empty if there are none yet.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def record_rtfs(rtfs, path=RTF_HISTORY_FILENAME):
+    """Adds the real-time factors of a run to the history, keeping the last RTF_HISTORY_RUNS of every key.
+
+    Args:
+        rtfs (Dict[str, float]): by `rtf_key`.
+    """
+    if not rtfs:
+        return
+    history = load_rtf_history(path)
+    for key, rtf in rtfs.items():
+        history[key] = (history.get(key, []) + [rtf])[-RTF_HISTORY_RUNS:]
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # through a temp file, the workers of a batch can finish at the same time
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(history, f, indent=1)
+        os.replace(tmp, path)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
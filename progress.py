@@ -0,0 +1,127 @@
+"""Progress events of the transcription that is running in this process.
+
+The pipeline reports what it is doing with `report`, and whoever runs it decides
+where that goes with `set_sink`: a worker sends the events to the GUI or the CLI
+over its connection, see transcribe_worker.py. Without a sink they go nowhere.
+
+Events are dicts with an "event" key:
+    {"event": "start", "audio_seconds": float | None, "steps": int}
+    {"event": "stage_start", "stage": str, "step": int, "steps": int}
+    {"event": "chunks", "stage": str, "done": int, "total": int | None}
+    {"event": "stage_end", "stage": str, "step": int, "status": str, "seconds": float}
+    {"event": "error", "stage": str, "error": str}
+
+`estimate` turns the events of a file into its progress, speed and ETA.
+"""
+import threading
+import time
+
+_sink = None
+_lock = threading.Lock()
+# the stage that is running in this thread, so that deeper code (ex: the ASR model) can report chunks
+# without knowing it. Per thread, the stages of pipeline_dag and pipeline_batch run side by side
+_local = threading.local()
+
+
+def set_sink(sink):
+    """
+    Args:
+        sink (Callable[[dict], None] | None): gets every event, None to drop them.
+    """
+    global _sink
+    _sink = sink
+
+
+def report(event, **fields):
+    """Sends an event to the sink, never raises, progress is not worth failing a transcription over."""
+    if event == "stage_start":
+        _local.stage = fields.get("stage")
+    fields.setdefault("stage", getattr(_local, "stage", None))
+    sink = _sink
+    if sink is None:
+        return
+    try:
+        with _lock:
+            sink({"event": event, **fields})
+    except Exception:
+        pass
+
+
+def new_state() -> dict:
+    """
+    Returns:
+        dict: what is known about a file's progress, updated by `update`.
+    """
+    return {"started": time.monotonic(), "audio_seconds": None, "steps": None, "step": 0, "done_steps": 0,
+            "stage": None, "chunks": None, "errors": [], "finished": False}
+
+
+def update(state, msg):
+    """Applies an event to the state of a file."""
+    event = msg.get("event")
+    if event == "start":
+        state.update(audio_seconds=msg.get("audio_seconds"), steps=msg.get("steps"))
+    elif event == "stage_start":
+        state.update(stage=msg.get("stage"), step=msg.get("step", 0), steps=msg.get("steps", state["steps"]), chunks=None)
+    elif event == "chunks":
+        state["chunks"] = (msg.get("done", 0), msg.get("total"))
+    elif event == "stage_end":
+        # counted, the stages of a pipeline_dag can finish in any order
+        state.update(done_steps=state["done_steps"] + 1, chunks=None)
+    elif event == "error":
+        state["errors"].append(f"{msg.get('stage')}: {msg.get('error')}")
+
+
+def estimate(state, now=None) -> dict:
+    """Every stage counts the same, the one that is running counts by its chunks when it reports them.
+
+    Returns:
+        dict: fraction done (0-1), speed (seconds of audio per second, times real time), and eta (seconds), None when unknown.
+    """
+    now = time.monotonic() if now is None else now
+    elapsed = now - state["started"]
+    fraction = None
+    if state["finished"]:
+        fraction = 1.0
+    elif state["steps"]:
+        within = 0.0
+        if state["chunks"] and state["chunks"][1]:
+            done, total = state["chunks"]
+            within = min(1.0, done / total)
+        fraction = min(1.0, (state["done_steps"] + within) / state["steps"])
+    speed = state["audio_seconds"] * fraction / elapsed if fraction and state["audio_seconds"] and elapsed > 0 else None
+    eta = elapsed * (1 - fraction) / fraction if fraction else None
+    return {"fraction": fraction, "speed": speed, "eta": eta}
+
+
+def describe(state, now=None) -> str:
+    """
+    Returns:
+        str: one line for the GUI or the console, ex: "asr 3/6 - 12/40 chunks - 2.1x real time - 3m 10s left".
+    """
+    if state["finished"]:
+        return "done" if not state["errors"] else f"finished with errors: {state['errors'][-1]}"
+    parts = []
+    if state["stage"]:
+        parts.append(f"{state['stage']} {state['step']}/{state['steps']}")
+    if state["chunks"]:
+        done, total = state["chunks"]
+        parts.append(f"{done}/{total} chunks" if total else f"{done} chunks")
+    est = estimate(state, now)
+    if est["speed"]:
+        parts.append(f"{est['speed']:.1f}x real time")
+    if est["eta"] is not None:
+        parts.append(f"{format_duration(est['eta'])} left")
+    return " - ".join(parts) or "starting..."
+
+
+def format_duration(seconds) -> str:
+    """
+    Returns:
+        str: ex: "1h 02m", "3m 10s" or "42s".
+    """
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}h {minutes:02d}m"
+    return f"{minutes}m {seconds:02d}s" if minutes else f"{seconds}s"
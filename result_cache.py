@@ -0,0 +1,126 @@
+"""Content addressed cache of pipeline results.
+
+Every pipeline stage's output document is stored under a key made from a hash of
+the audio content plus the configuration of that stage and every stage before it
+(model, language, number of speakers, ...). Re-running a file, or a copy of the
+same file, with the same settings then loads the longest finished prefix of the
+pipeline instead of recomputing it.
+
+The cache is a directory of pickle files. Reading an entry bumps its modified
+time, and the least recently used entries are removed once the directory grows
+past its size limit.
+"""
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+from pathlib import Path
+
+from user_config import CONFIG_DIR
+
+GB = 2**30
+
+CACHE_DIR = CONFIG_DIR / "transcribe_cache"
+DEFAULT_MAX_BYTES = 5 * GB
+HASH_BLOCK_BYTES = 2**20
+
+_file_hashes = {}
+
+
+def hash_file(path) -> str:
+    """
+    Returns:
+        str: sha256 of the file content. Remembered per (path, size, mtime) so a batch only reads each file once.
+    """
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if memo_key not in _file_hashes:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(HASH_BLOCK_BYTES), b""):
+                digest.update(block)
+        _file_hashes[memo_key] = digest.hexdigest()
+    return _file_hashes[memo_key]
+
+
+def write_pickle(value, path):
+    """Pickles the value to path, through a temp file so that readers never see half of it."""
+    path = Path(path)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def make_key(*parts) -> str:
+    """
+    Args:
+        *parts: anything json serializable (non serializable values are converted with str).
+
+    Returns:
+        str: a stable hash of the parts.
+    """
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, directory=CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        Args:
+            directory (str | Path): where the cache entries are stored.
+            max_bytes (int): the least recently used entries are evicted past this size.
+        """
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+
+    def _path(self, key) -> Path:
+        return self.directory / f"{key}.pkl"
+
+    def get(self, key):
+        """
+        Returns:
+            the cached object, or None if there is no (readable) entry for the key.
+        """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+            # mark as recently used
+            os.utime(path)
+            return value
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Ignoring unreadable cache entry {path}: {e}", flush=True)
+            return None
+
+    def put(self, key, value):
+        """Stores the object under the key, then evicts old entries if the cache got too big."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        write_pickle(value, self._path(key))
+        self.evict()
+
+    def evict(self):
+        """Removes the least recently used entries until the cache fits in max_bytes."""
+        entries = []
+        for path in self.directory.glob("*.pkl"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -0,0 +1,599 @@
+"""Runs several transcriptions at the same time.
+
+The number of parallel jobs is picked from how much RAM (and VRAM when CUDA is
+available) the machine has free, and from a rough per model memory estimate.
+Jobs that do not fit yet are queued and started as soon as a running job frees
+up its resources.
+"""
+import os
+import shutil
+import subprocess
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from math import ceil
+
+import psutil
+
+import progress
+from result_cache import hash_file, make_key
+from transcribe_worker import TranscribeWorker, WorkerDiedError
+
+GB = 2**30
+
+# Rough memory needed to run each whisper size, see the VRAM table in the model tooltip of main.py.
+# Order matters, the first matching key wins (ex: 'large-v3-turbo' should be a turbo model).
+MODEL_MEMORY_GB = {
+    "turbo": 6,
+    "large": 10,
+    "medium": 5,
+    "small": 2,
+    "base": 1,
+    "tiny": 1,
+}
+# the table above is for fp32 weights, int8 only shrinks the linear layers
+PRECISION_MEMORY_SCALE = {
+    "fp32": 1.0,
+    "bf16": 0.5,
+    "fp16": 0.5,
+    "int8": 0.35,
+}
+# used when we cant tell what size the model is
+DEFAULT_MODEL_MEMORY_GB = MODEL_MEMORY_GB["medium"]
+# the rest of the pipeline (diarization, UTR, forced alignment) that lives next to the ASR model
+PIPELINE_MEMORY_GB = 3
+# leave some room for the OS and the GUI
+RESERVED_RAM_GB = 2
+# what each worker that shares its weights with the others still needs on its own (audio, activations, python)
+SHARED_WORKER_MEMORY_GB = 1.5
+# most jobs handed to a worker at once, the ones behind the first wait in the worker
+# and have their ASR batched with it, see transcribe_proc.prefetch
+BATCH_JOBS = 4
+# the duplicate_key of a job whose file is still being hashed
+HASHING = "hashing"
+# seconds an nvidia-smi answer is used again, it is asked from the GUI thread for every worker started
+# and can take seconds. Workers that are still loading are taken off of it anyway, see `can_admit`
+NVIDIA_SMI_TTL_S = 3.0
+# (time.monotonic() of the last nvidia-smi answer, its free bytes)
+_nvidia_smi_free = (float("-inf"), None)
+
+
+def estimate_model_memory(model_name: str, precision: str = "fp32") -> int:
+    """
+    Args:
+        model_name (str): huggingface model id.
+        precision (str): the precision the model runs in, see `PRECISION_MEMORY_SCALE`.
+
+    Returns:
+        int: estimated bytes the ASR model needs.
+    """
+    name = str(model_name or "").lower()
+    scale = PRECISION_MEMORY_SCALE.get(str(precision or "fp32").lower(), 1.0)
+    for size, gb in MODEL_MEMORY_GB.items():
+        if size in name:
+            return int(gb * scale * GB)
+    return int(DEFAULT_MODEL_MEMORY_GB * scale * GB)
+
+
+def estimate_job_memory(model_name: str, precision: str = "fp32") -> int:
+    """
+    Returns:
+        int: estimated bytes of RAM a single worker running the whole pipeline needs.
+    """
+    return estimate_model_memory(model_name, precision) + int(PIPELINE_MEMORY_GB * GB)
+
+
+def get_available_memory():
+    """
+    Returns:
+        Tuple[int, int | None]: free RAM bytes, and free VRAM bytes (None when CUDA is not available).
+    """
+    ram = psutil.virtual_memory().available
+    vram = None
+    if "torch" not in sys.modules:
+        # importing torch takes seconds, too long for the GUI thread, ask the driver instead
+        return ram, nvidia_smi_free_memory()
+    try:
+        from torch.cuda import is_available as is_cuda_available, mem_get_info as get_cuda_mem_info
+        if is_cuda_available():
+            vram = get_cuda_mem_info()[0]
+    except Exception:
+        pass
+    return ram, vram
+
+
+def nvidia_smi_free_memory(max_age=NVIDIA_SMI_TTL_S):
+    """
+    Args:
+        max_age (float): seconds an earlier answer is returned again instead of running nvidia-smi.
+
+    Returns:
+        int | None: free bytes of the first GPU according to nvidia-smi, None without an NVIDIA GPU.
+    """
+    global _nvidia_smi_free
+    checked, free = _nvidia_smi_free
+    if time.monotonic() - checked < max_age:
+        return free
+    free = None
+    exe = shutil.which("nvidia-smi")
+    if exe is not None:
+        try:
+            out = subprocess.run([exe, "--query-gpu=memory.free", "--format=csv,noheader,nounits"],
+                                 capture_output=True, text=True, timeout=5).stdout
+            free = int(out.split()[0]) * 2**20
+        except (OSError, subprocess.SubprocessError, IndexError, ValueError):
+            pass
+    _nvidia_smi_free = (time.monotonic(), free)
+    return free
+
+
+def choose_concurrency(model_name: str, max_workers: int = None, precision: str = "fp32", shared: bool = False) -> int:
+    """Picks how many transcriptions can run at once for the given model.
+
+    Args:
+        model_name (str): huggingface model id.
+        max_workers (int, optional): upper limit set by the user.
+        precision (str): the precision the model runs in, see `PRECISION_MEMORY_SCALE`.
+        shared (bool): if the workers share one copy of the weights, see `TranscribeWorker.fork_pool`.
+
+    Returns:
+        int: number of parallel jobs, at least 1.
+    """
+    ram, vram = get_available_memory()
+    free = ram - RESERVED_RAM_GB * GB
+    limits = [
+        # only the first worker pays for the weights
+        1 + (free - estimate_job_memory(model_name, precision)) // int(SHARED_WORKER_MEMORY_GB * GB) if shared else free // estimate_job_memory(model_name, precision),
+        # every worker keeps a couple of cores busy on its own
+        (os.cpu_count() or 1) // 2,
+    ]
+    # shared workers run on the CPU
+    if vram is not None and not shared:
+        limits.append(vram // estimate_model_memory(model_name, precision))
+    if max_workers:
+        limits.append(max_workers)
+    return int(max(1, min(limits)))
+
+
+def process_memory(pid) -> dict:
+    """
+    Returns:
+        dict: rss_mb, and pss_mb (the shared pages split between the processes that share them) and
+            uss_mb (pages only this process has) where the OS can tell, None otherwise.
+    """
+    proc = psutil.Process(pid)
+    try:
+        info = proc.memory_full_info()
+    except (psutil.AccessDenied, psutil.ZombieProcess):
+        info = proc.memory_info()
+    return {
+        "rss_mb": info.rss / 2**20,
+        "pss_mb": getattr(info, "pss", None) and info.pss / 2**20,
+        "uss_mb": getattr(info, "uss", None) and info.uss / 2**20,
+    }
+
+
+class TranscribeScheduler:
+    def __init__(self, max_workers: int = None, shared_weights: bool = False):
+        """Queue of transcribe jobs that are handed out to a pool of persistent workers.
+
+        Args:
+            max_workers (int, optional): never run more than this many jobs at once.
+            shared_weights (bool): start the workers as one `TranscribeWorker.fork_pool`, so they share
+                one copy of the model weights. POSIX only, the models run on the CPU.
+        """
+        if shared_weights and not hasattr(os, "fork"):
+            print("Sharing the model weights between workers needs os.fork, each worker loads its own", flush=True)
+            shared_weights = False
+        self.shared_weights = shared_weights
+        self.max_workers = max_workers
+        self.queue = deque()
+        self.workers = []
+        # worker -> (tag, job, job_id) that it is currently running
+        self.running = {}
+        # worker -> deque of (tag, job, job_id) it was sent along with the running one, they start after it
+        self.assigned = {}
+        # workers that have not finished their first job yet, their memory is not in use yet
+        self.loading = set()
+        # jobs that could not be handed to a worker, reported on the next pump
+        self._failed = []
+        self.limit = None
+        # worker -> (model key, id) of the model it is loading ahead of time, see `warm`
+        self.warming = {}
+        # worker -> model key it has loaded, jobs for that model go to it first. A worker only keeps
+        # one ASR model, loading another one replaces it, see `transcribe_proc.get_engine`
+        self.warmed = {}
+        # model key -> "loading", "ready" or the error, for the GUI
+        self.warm_status = {}
+        # tag -> progress of its job, from the worker's progress events, see progress.py
+        self.progress = {}
+        # input file -> future of its content hash, see `duplicate_key`
+        self._hashes = {}
+        self._hasher = None
+
+    def add(self, tag=None, **job):
+        """Queues a job.
+
+        Args:
+            tag (Any, optional): returned along with the result, ex: the GUI row for the file.
+            **job: the kwargs for `transcribe_proc.transcribe_file`
+        """
+        if not self.busy():
+            # new batch, pick the concurrency again for whatever is free now
+            self.limit = None
+            self.progress = {}
+            # the files could have changed since
+            self._hashes = {}
+        self.queue.append((tag, job))
+        # starts hashing the file in the background
+        self.duplicate_key(job)
+
+    @staticmethod
+    def model_key(job):
+        """
+        Returns:
+            tuple: what a worker needs to have loaded to run the job without loading its ASR model again.
+        """
+        return (job.get("model_name"), job.get("precision", "fp32"), job.get("asr_engine", "batchalign"), job.get("asr_backend", "hf"), job.get("asr_device"))
+
+    def warm(self, model_name, precision="fp32", **engine):
+        """Has an idle worker (starting one if there is room) load the ASR model before the jobs for it are added.
+        The first job for the model is then handed to that worker.
+
+        Args:
+            model_name (str): huggingface model id.
+            precision (str): see `PRECISION_MEMORY_SCALE`.
+            **engine: the other kwargs for `transcribe_proc.warm_up`, ex: lang, asr_engine.
+
+        Returns:
+            str | None: the warm up status of the model, None if there was no room for it.
+        """
+        job = {"model_name": model_name, "precision": precision, **engine}
+        key = self.model_key(job)
+        if key in self.warm_status and not self.warm_status[key].startswith("failed"):
+            return self.warm_status[key]
+        # rather a worker with nothing loaded, then a new one, and only then replace the model of an idle one
+        idle = sorted((w for w in self.workers if w not in self.running and w not in self.warming), key=lambda w: w in self.warmed)
+        limit = self.limit or choose_concurrency(model_name, self.max_workers, precision)
+        if idle and idle[0] not in self.warmed:
+            worker = idle[0]
+        elif len(self.workers) < limit and (not self.workers or self.can_admit(model_name, precision)):
+            worker = self._new_worker(limit)
+        elif idle:
+            worker = idle[0]
+        else:
+            return None
+        self._unload(worker, key)
+        try:
+            self.warming[worker] = (key, worker.warm(**job))
+        except WorkerDiedError as e:
+            self._drop(worker)
+            self.warm_status[key] = f"failed: {e}"
+            return self.warm_status[key]
+        self.warm_status[key] = "loading"
+        return self.warm_status[key]
+
+    def _unload(self, worker, key):
+        """Forgets the model a worker had once it is given one with another key, which replaces it."""
+        old = self.warmed.get(worker)
+        if old is None or old == key:
+            return
+        del self.warmed[worker]
+        if old not in self.warmed.values() and self.warm_status.get(old) == "ready":
+            del self.warm_status[old]
+
+    def _warmed(self, worker, msg):
+        key, warm_id = self.warming.get(worker, (None, None))
+        if msg.get("id") != warm_id:
+            return
+        del self.warming[worker]
+        self.loading.discard(worker)
+        running = self.running.get(worker)
+        if msg.get("error"):
+            self.warm_status[key] = f"failed: {msg['error'].strip().splitlines()[-1]}"
+        elif running is not None and self.model_key(running[1]) != key:
+            # a job for another model was sent after the warm up, its model replaces this one
+            if key not in self.warmed.values():
+                self.warm_status.pop(key, None)
+        else:
+            self.warm_status[key] = "ready"
+            self.warmed[worker] = key
+
+    def poll_warm(self):
+        """Collects the finished warm ups of the workers that are not running a job, `pump` does the others.
+
+        Returns:
+            dict: the warm up status of every model, see `warm_status`.
+        """
+        for worker in [w for w in self.warming if w not in self.running]:
+            if not worker.is_ready() and worker.is_alive():
+                # still starting up, dont wait on it
+                continue
+            try:
+                msg = worker.poll(timeout=0)
+            except WorkerDiedError as e:
+                self.warm_status[self.warming[worker][0]] = f"failed: {e}"
+                self._drop(worker)
+                continue
+            if msg is not None and msg.get("type") == "warmed":
+                self._warmed(worker, msg)
+        return self.warm_status
+
+    def busy(self) -> bool:
+        return bool(self.queue or self.running or self._failed or any(self.assigned.values()))
+
+    def can_admit(self, model_name, precision="fp32") -> bool:
+        """
+        Returns:
+            bool: if there is room to start one more worker for the given model right now.
+        """
+        ram, vram = get_available_memory()
+        # workers that are still loading have not claimed their memory yet
+        for worker in self.loading:
+            if worker in self.running:
+                loading_job = self.running[worker][1]
+                ram -= estimate_job_memory(loading_job.get("model_name"), loading_job.get("precision", "fp32"))
+                if vram is not None:
+                    vram -= estimate_model_memory(loading_job.get("model_name"), loading_job.get("precision", "fp32"))
+        if ram - RESERVED_RAM_GB * GB < estimate_job_memory(model_name, precision):
+            return False
+        if vram is not None and vram < estimate_model_memory(model_name, precision):
+            return False
+        return True
+
+    def duplicate_key(self, job):
+        """The file is hashed on a background thread, hashing a recording of a few GB takes
+        seconds, too long for the GUI thread that calls `pump`.
+
+        Returns:
+            str | None: jobs with the same key would give the same result, None if the job should never wait on another,
+                HASHING until the file's hash is known.
+        """
+        if not job.get("use_cache", True):
+            return None
+        future = self._hashes.get(job["input_file"])
+        if future is None:
+            if self._hasher is None:
+                self._hasher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="hash")
+            future = self._hashes[job["input_file"]] = self._hasher.submit(hash_file, job["input_file"])
+        if not future.done():
+            return HASHING
+        if future.exception() is not None:
+            return None
+        return make_key(future.result(), {k: v for k, v in job.items() if k != "input_file"})
+
+    @staticmethod
+    def batch_key(job):
+        """
+        Returns:
+            tuple | None: jobs with the same key can have their ASR batched in one worker, None if the
+                job's ASR engine does not batch across files, see transcribe_proc.prefetch.
+        """
+        from transcribe_proc import CustomAiEngine, DEFAULT_STAGES, get_asr_engine_spec
+
+        if "asr" not in (job.get("stages") or DEFAULT_STAGES) or int(job.get("asr_shards") or 1) > 1:
+            return None
+        # the raw lang, normalizing it would import pycountry on the GUI thread, different spellings just dont batch
+        factory, args, kwargs = get_asr_engine_spec(job.get("model_name"), job.get("lang", "eng"), job.get("asr_engine", "batchalign"), job.get("asr_batch_size"), job.get("asr_streaming", False), job.get("vad", False), job.get("precision", "fp32"), job.get("asr_backend", "hf"), job.get("asr_shards", 1), job.get("asr_device"))
+        if factory is not CustomAiEngine:
+            return None
+        return (args, tuple(sorted(kwargs.items())))
+
+    def _started_jobs(self):
+        """
+        Returns:
+            List[dict]: the jobs the workers have, running or waiting in them.
+        """
+        return [job for _, job, _ in self.running.values()] + [job for jobs in self.assigned.values() for _, job, _ in jobs]
+
+    def _take_batch(self, job, running_keys):
+        """Takes the queued jobs that can wait in the same worker as job and share its ASR batches.
+        The queue is spread evenly over the workers, so batching never leaves a worker without work.
+
+        Returns:
+            List[Tuple[Any, dict]]: the (tag, job) of every job taken out of the queue.
+        """
+        key = self.batch_key(job)
+        if key is None:
+            return []
+        same = [idx for idx, (_, other) in enumerate(self.queue)
+                if self.batch_key(other) == key and self.duplicate_key(other) not in running_keys | {HASHING}]
+        count = min(BATCH_JOBS, ceil((len(same) + 1) / max(1, self.limit or 1))) - 1
+        taken = [self.queue[idx] for idx in same[:max(0, count)]]
+        for idx in reversed(same[:max(0, count)]):
+            del self.queue[idx]
+        return taken
+
+    def _next_job(self):
+        """
+        Returns:
+            int | None: index in the queue of the next job that can start. Copies of a running file wait
+                for it to finish, so that they are loaded from its cached result instead of transcribed twice.
+                While a file is still being hashed it can only start when nothing else is running.
+        """
+        started = self._started_jobs()
+        running_keys = {self.duplicate_key(job) for job in started} - {None, HASHING}
+        for idx, (tag, job) in enumerate(self.queue):
+            key = self.duplicate_key(job)
+            if key == HASHING and not started or key != HASHING and key not in running_keys:
+                return idx
+        return None
+
+    def _start_next(self):
+        """Hands out queued jobs to idle workers, starting new workers while there is room."""
+        while self.queue:
+            idx = self._next_job()
+            if idx is None:
+                return
+            tag, job = self.queue[idx]
+            if self.limit is None:
+                self.limit = choose_concurrency(job.get("model_name"), self.max_workers, job.get("precision", "fp32"), self.shared_weights)
+            # a worker that has (or is loading) the job's model first, its jobs wait for the warm up to finish
+            key = self.model_key(job)
+            idle = sorted((w for w in self.workers if w not in self.running),
+                          key=lambda w: self.warmed.get(w, self.warming.get(w, (None,))[0]) != key)
+            if idle:
+                worker = idle[0]
+            elif self.shared_weights and not self.workers:
+                # the whole pool at once, loaded for the first job
+                worker = self._new_pool(self.limit, job)
+            elif len(self.workers) < self.limit and (not self.workers or self.can_admit(job.get("model_name"), job.get("precision", "fp32"))):
+                worker = self._new_worker(self.limit)
+            else:
+                return
+            del self.queue[idx]
+            self._unload(worker, key)
+            running_keys = {self.duplicate_key(started) for started in self._started_jobs()} - {None, HASHING}
+            batch = [(tag, job)] + self._take_batch(job, running_keys)
+            try:
+                job_ids = worker.submit_many([batch_job for _, batch_job in batch])
+            except WorkerDiedError as e:
+                print(f"Transcriber worker failed to start: {e}", flush=True)
+                self._drop(worker)
+                self._failed.append((tag, {"id": None, "error": str(e)}))
+                # the others go back in line for another worker
+                self.queue.extendleft(reversed(batch[1:]))
+                continue
+            self.running[worker] = (tag, job, job_ids[0])
+            self.progress[tag] = progress.new_state()
+            if len(batch) > 1:
+                self.assigned[worker] = deque((batch_tag, batch_job, batch_id) for (batch_tag, batch_job), batch_id in zip(batch[1:], job_ids[1:]))
+
+    def _new_worker(self, limit):
+        # split the cores between the workers so they dont fight over them
+        threads = str(max(1, (os.cpu_count() or 1) // limit))
+        worker = TranscribeWorker(env={"OMP_NUM_THREADS": threads, "MKL_NUM_THREADS": threads})
+        self.workers.append(worker)
+        self.loading.add(worker)
+        return worker
+
+    def _new_pool(self, size, job):
+        threads = str(max(1, (os.cpu_count() or 1) // size))
+        pool = TranscribeWorker.fork_pool(size, preload={k: v for k, v in job.items() if k != "input_file"},
+                                          env={"OMP_NUM_THREADS": threads, "MKL_NUM_THREADS": threads, "CUDA_VISIBLE_DEVICES": ""})
+        self.workers.extend(pool)
+        self.loading.update(pool)
+        return pool[0]
+
+    def memory_report(self) -> list:
+        """
+        Returns:
+            List[dict]: the memory of every worker (role "worker") and of the processes the shared
+                workers were forked off (role "shared"), see `process_memory`.
+        """
+        rows = []
+        parents = {w.proc.pid for w in self.workers if w.forked and w.is_alive()}
+        for pid, role in [(w.pid, "worker") for w in self.workers if w.pid is not None] + [(pid, "shared") for pid in parents]:
+            try:
+                rows.append({"pid": pid, "role": role, **process_memory(pid)})
+            except psutil.NoSuchProcess:
+                continue
+        return rows
+
+    def _drop(self, worker):
+        self.running.pop(worker, None)
+        # the jobs it had not started yet go back to the front of the queue
+        for tag, job, _ in reversed(self.assigned.pop(worker, ())):
+            self.queue.appendleft((tag, job))
+        self.loading.discard(worker)
+        self.warmed.pop(worker, None)
+        if worker in self.warming:
+            key = self.warming.pop(worker)[0]
+            if self.warm_status.get(key) == "loading":
+                del self.warm_status[key]
+        if worker in self.workers:
+            self.workers.remove(worker)
+
+    def pump(self, timeout=0.1):
+        """Collects progress and finished jobs, and starts the next ones. Never blocks for longer than
+        the timeout, so a GUI can call it with timeout=0 from a timer.
+
+        Args:
+            timeout (float): how long to wait for messages, in seconds.
+
+        Returns:
+            List[Tuple[Any, dict]]: the (tag, result message) for every job that finished.
+        """
+        self.poll_warm()
+        self._start_next()
+        finished, self._failed = self._failed, []
+        per_worker_timeout = timeout / max(1, len(self.running))
+        for worker in list(self.running):
+            # everything the worker sent since the last pump, only the first poll waits
+            wait = per_worker_timeout
+            while worker in self.running:
+                tag, job, job_id = self.running[worker]
+                try:
+                    msg = worker.poll(timeout=wait)
+                except WorkerDiedError as e:
+                    print(f"Transcriber worker stopped unexpectedly while working on {job.get('input_file')}: {e}", flush=True)
+                    self._drop(worker)
+                    self._finish(tag, str(e))
+                    finished.append((tag, {"id": job_id, "error": str(e)}))
+                    break
+                if msg is None:
+                    break
+                wait = 0
+                if msg.get("type") == "warmed":
+                    self._warmed(worker, msg)
+                elif msg.get("type") == "progress" and msg.get("id") == job_id and tag in self.progress:
+                    progress.update(self.progress[tag], msg)
+                elif msg.get("type") == "result" and msg.get("id") == job_id:
+                    del self.running[worker]
+                    self.loading.discard(worker)
+                    self._finish(tag, msg.get("error"))
+                    finished.append((tag, msg))
+                    if self.assigned.get(worker):
+                        # the worker already has its next job and starts it right away
+                        self.running[worker] = self.assigned[worker].popleft()
+                        self.progress[self.running[worker][0]] = progress.new_state()
+        self._start_next()
+        finished.extend(self._failed)
+        self._failed = []
+        return finished
+
+    def _finish(self, tag, error=None):
+        state = self.progress.get(tag)
+        if state is None:
+            return
+        state["finished"] = True
+        if error:
+            state["errors"].append(error.strip().splitlines()[-1])
+
+    def overall_progress(self) -> dict:
+        """Progress of the whole batch, from the progress of every started job.
+
+        Returns:
+            dict: done and total (jobs), speed (seconds of audio transcribed per second, over all the workers)
+                and eta (seconds) of the batch, None when unknown.
+        """
+        waiting = len(self.queue) + sum(len(jobs) for jobs in self.assigned.values())
+        total = len(self.progress) + waiting
+        estimates = [progress.estimate(state) for state in self.progress.values()]
+        done = sum(1 for state in self.progress.values() if state["finished"])
+        speeds = [e["speed"] for state, e in zip(self.progress.values(), estimates) if e["speed"] and not state["finished"]]
+        # jobs run side by side, so the batch is done when the slowest running one is, plus the queue spread over the workers
+        etas = [e["eta"] for state, e in zip(self.progress.values(), estimates) if e["eta"] is not None and not state["finished"]]
+        eta = None
+        if etas:
+            times = [time.monotonic() - state["started"] + e["eta"] for state, e in zip(self.progress.values(), estimates) if e["eta"] is not None]
+            per_job = sum(times) / len(times)
+            eta = max(etas) + per_job * waiting / max(1, len(self.running))
+        return {"done": done, "total": total, "speed": sum(speeds) if speeds else None, "eta": eta}
+
+    def close(self):
+        """Stops all the workers."""
+        for worker in self.workers:
+            worker.close()
+        if self._hasher is not None:
+            self._hasher.shutdown(wait=False, cancel_futures=True)
+            self._hasher = None
+        self._hashes = {}
+        self.workers = []
+        self.running = {}
+        self.assigned = {}
+        self.loading = set()
+        self.warming = {}
+        self.warmed = {}
+        self.warm_status = {}
@@ -0,0 +1,265 @@
+"""Transcribes one long recording with several processes at once.
+
+A 4 hour recording otherwise runs through one ASR model in one process, however
+many cores the machine has. In sharded mode the recording is cut into shards of
+about SHARD_S, each cut at the quietest pause near where it should be, and every
+shard is read with OVERLAP_S of extra audio on both sides so the words next to a
+cut still have context. A `ShardPool` of worker processes (that each load the model
+once, and are kept for the next recordings) transcribes the shards, then the word streams are put back on the recording's
+timeline: a word belongs to the shard that holds its middle, a word that both
+shards of a cut transcribed is only kept once, and the timestamps never go back.
+
+Only the ASR is sharded, the rest of the pipeline runs on the whole document, see
+CustomAiEngine.
+"""
+import math
+import re
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from multiprocessing import get_context
+
+import numpy as np
+
+import progress
+from vad import FRAME_MS, frame_energies
+
+# longest shard, in seconds, recordings are cut into more shards than workers when they are long enough
+SHARD_S = 600.0
+# shorter shards spend more time loading and in the overlaps than they save
+MIN_SHARD_S = 60.0
+# how far a cut can move away from an even split to find a pause, in seconds
+SEARCH_S = 30.0
+# audio read on each side of a cut, in seconds
+OVERLAP_S = 5.0
+# a pause is the quietest stretch this long, not just the quietest frame
+PAUSE_MS = 300
+# the same word from the shards on both sides of a cut starts within this many seconds
+DEDUPE_S = 0.5
+# what the words are compared on, ex: "Well," and "well" are the same word
+WORD_CHARS = re.compile(r"\W+")
+
+
+@dataclass
+class Shard:
+    """A piece of the recording, in seconds. The audio from start to end is transcribed,
+    and the words whose middle is between keep_start and keep_end are kept."""
+    index: int
+    start: float
+    end: float
+    keep_start: float
+    keep_end: float
+
+
+def shard_count(duration, workers, shard_s=SHARD_S) -> int:
+    """
+    Returns:
+        int: how many shards to cut the recording into, at least one per worker and none shorter than MIN_SHARD_S.
+    """
+    count = max(workers, math.ceil(duration / shard_s))
+    return max(1, min(count, int(duration // MIN_SHARD_S)))
+
+
+def find_cuts(energies, duration, count, frame_ms=FRAME_MS, search_s=SEARCH_S) -> list:
+    """Splits the recording evenly, then moves every cut to the quietest pause near it.
+
+    Args:
+        energies (np.ndarray): from `vad.frame_energies`.
+        duration (float): length of the recording in seconds.
+        count (int): how many shards.
+
+    Returns:
+        List[float]: the count - 1 cuts in seconds, in order.
+    """
+    if count <= 1:
+        return []
+    frame_s = frame_ms / 1000
+    # never so far that two cuts could swap places
+    search_s = min(search_s, duration / count / 4)
+    width = max(1, int(round(PAUSE_MS / frame_ms)))
+    smooth = np.convolve(energies, np.ones(width) / width, mode="same") if len(energies) else energies
+    cuts = []
+    for k in range(1, count):
+        target = duration * k / count
+        lo = max(0, int((target - search_s) / frame_s))
+        hi = min(len(smooth), int((target + search_s) / frame_s) + 1)
+        cuts.append((lo + int(np.argmin(smooth[lo:hi])) + 0.5) * frame_s if lo < hi else target)
+    return cuts
+
+
+def plan_shards(duration, cuts, overlap_s=OVERLAP_S) -> list:
+    """
+    Returns:
+        List[Shard]: one shard between every two cuts, read with overlap_s extra on each side.
+    """
+    bounds = [0.0, *cuts, duration]
+    return [
+        Shard(index=i, start=max(0.0, a - overlap_s), end=min(duration, b + overlap_s),
+              keep_start=a if i > 0 else float("-inf"), keep_end=b if i < len(cuts) else float("inf"))
+        for i, (a, b) in enumerate(zip(bounds, bounds[1:]))
+    ]
+
+
+def _word_key(word) -> str:
+    return WORD_CHARS.sub("", word["text"]).lower()
+
+
+def _drop_repeats(before, after, cut, dedupe_s=DEDUPE_S) -> list:
+    """Drops the words at the start of `after` that are already at the end of `before`, ex: a word
+    right at the cut that one shard timed just before it and the other just after."""
+    near = [w for w in before[-20:] if w["timestamp"][0] is not None and w["timestamp"][0] >= cut - 4 * dedupe_s]
+    kept = []
+    for word in after:
+        start = word["timestamp"][0]
+        repeat = start is not None and start < cut + 4 * dedupe_s and any(
+            _word_key(w) == _word_key(word) and abs(w["timestamp"][0] - start) <= dedupe_s for w in near)
+        if not repeat:
+            kept.append(word)
+    return kept
+
+
+def stitch_shards(shard_words, shards, dedupe_s=DEDUPE_S) -> list:
+    """Puts the words of every shard back on the timeline of the whole recording.
+
+    Args:
+        shard_words (List[List[dict]]): the word chunks of every shard, with timestamps from the start of the shard.
+        shards (List[Shard]): the shards, in order.
+
+    Returns:
+        List[dict]: the word chunks of the recording, like the HF pipeline's, in order.
+    """
+    words = []
+    for shard, chunks in zip(shards, shard_words):
+        kept = []
+        for word in chunks:
+            start, end = word["timestamp"]
+            start = start + shard.start if start is not None else None
+            end = end + shard.start if end is not None else None
+            middle = start if end is None else end if start is None else (start + end) / 2
+            if middle is not None and not (shard.keep_start <= middle < shard.keep_end):
+                continue
+            kept.append({**word, "timestamp": (start, end)})
+        words.extend(_drop_repeats(words, kept, shard.keep_start, dedupe_s) if words else kept)
+    # the shards can disagree by a few milliseconds about where a word at the cut ends
+    last = 0.0
+    for i, word in enumerate(words):
+        start, end = word["timestamp"]
+        if start is not None:
+            start = max(start, last)
+        if end is not None:
+            end = max(end, start if start is not None else last)
+        words[i] = {**word, "timestamp": (start, end)}
+        last = end if end is not None else start if start is not None else last
+    return words
+
+
+# the model of a shard worker process, loaded once by `_load_model`
+_model = None
+
+
+def shard_threads(workers) -> int:
+    """
+    Returns:
+        int: the torch threads of every shard process, an even share of the threads this process
+            was given, ex: by the scheduler's OMP_NUM_THREADS or the profile's ASR threads.
+    """
+    import torch
+    return max(1, torch.get_num_threads() // workers)
+
+
+def _load_model(model_kwargs, threads):
+    global _model
+    import torch
+    from ArbitraryASRModel import ArbatraryASRModel
+
+    torch.set_num_threads(threads)
+    _model = ArbatraryASRModel(**model_kwargs)
+
+
+def _warm_up():
+    import torch
+    _model.transcribe_words([torch.zeros(_model.sample_rate)])
+
+
+def _transcribe_shard(path, start, end):
+    import torch
+    from audio_io import iter_audio_blocks
+
+    audio = np.concatenate([np.zeros(0, dtype=np.float32), *iter_audio_blocks(path, _model.sample_rate, start_s=start, end_s=end)])
+    return _model.transcribe_words([torch.from_numpy(audio)])[0]
+
+
+class ShardPool:
+    """The processes that transcribe the shards, each with its own copy of the model.
+
+    Started for the first recording and kept for the next ones, loading the models is
+    most of what a pool costs. Started again when the threads it should use change.
+    """
+
+    def __init__(self, model_kwargs, workers):
+        """
+        Args:
+            model_kwargs (dict): kwargs of `ArbatraryASRModel`, ex: model, language, batch_size, precision.
+            workers (int): how many processes.
+        """
+        self.model_kwargs = model_kwargs
+        self.workers = max(1, int(workers))
+        self.threads = None
+        self._executor = None
+
+    def executor(self, threads=None) -> ProcessPoolExecutor:
+        """
+        Args:
+            threads (int, optional): torch threads of every process, defaults to `shard_threads`.
+
+        Returns:
+            ProcessPoolExecutor: the running pool.
+        """
+        threads = threads or shard_threads(self.workers)
+        if self._executor is not None and threads != self.threads:
+            self.close()
+        if self._executor is None:
+            # spawned, not forked, torch and CUDA do not survive a fork
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=get_context("spawn"),
+                                                 initializer=_load_model, initargs=(self.model_kwargs, threads))
+            self.threads = threads
+        return self._executor
+
+    def warm_up(self):
+        """Starts the processes and has them load their model and run it once."""
+        pool = self.executor()
+        # every task that finds no idle process starts another one
+        for future in [pool.submit(_warm_up) for _ in range(self.workers)]:
+            future.result()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+
+def transcribe_sharded(path, pool, shard_s=SHARD_S, overlap_s=OVERLAP_S, rate=16000):
+    """Transcribes a recording with the processes of a `ShardPool`.
+
+    Args:
+        path (str): an audio file soundfile can read, see `audio_io.can_stream`.
+        pool (ShardPool): the processes, the recording is cut into at least one shard per process.
+
+    Returns:
+        List[dict]: the word chunks of the whole recording. One too short to cut still runs in
+            the pool, as a single shard, so the caller does not need its own copy of the model.
+    """
+    from audio_io import iter_audio_blocks
+    import soundfile
+
+    duration = soundfile.info(str(path)).duration
+    count = shard_count(duration, pool.workers, shard_s)
+    cuts = find_cuts(frame_energies(iter_audio_blocks(path, rate), rate), duration, count) if count > 1 else []
+    shards = plan_shards(duration, cuts, overlap_s)
+    results = [None] * len(shards)
+    progress.report("chunks", done=0, total=len(shards))
+    executor = pool.executor()
+    futures = {executor.submit(_transcribe_shard, str(path), shard.start, shard.end): shard.index for shard in shards}
+    for done, future in enumerate(as_completed(futures), start=1):
+        results[futures[future]] = future.result()
+        progress.report("chunks", done=done, total=len(shards))
+    return stitch_shards(results, shards)
@@ -0,0 +1,13 @@
+"""Lets the tests import the transcriber modules, and the old implementations kept in the benchmarks, from anywhere.
+
+Run them with:
+    python -m pytest tests
+"""
+import sys
+from pathlib import Path
+
+REPO_DIR = Path(__file__).parent.parent.expanduser().resolve()
+
+for path in (REPO_DIR, REPO_DIR / "benchmarks"):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
@@ -0,0 +1,109 @@
+"""Cutting streamed audio into regions and windows, and putting the words of the windows back together, on synthetic samples.
+
+    - a region comes out the same as slicing the whole recording, however the stream is blocked,
+      also when regions overlap or go past the end of the audio
+    - every made up word comes back exactly once from the overlapping windows, on the recording's timeline
+"""
+from collections import deque
+
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("torchaudio")
+from audio_io import AudioWindow, count_windows, iter_regions, iter_windows, stitch_window_words
+
+RATE = 16000
+
+
+def blocked(audio, sizes):
+    """The audio as a stream of blocks of the given sizes, the last one takes the rest."""
+    return np.split(audio, np.cumsum(sizes)[np.cumsum(sizes) < len(audio)])
+
+
+@pytest.fixture
+def audio():
+    # every sample is its own index, so a slice shows where it came from
+    return np.arange(10 * RATE, dtype=np.float32)
+
+
+@pytest.mark.parametrize("sizes", [[10 * RATE], [RATE] * 10, [7777] * 30, [1, 2 * RATE, 3, 5 * RATE]])
+def test_regions_like_slicing(audio, sizes):
+    regions = [(0.5, 1.25), (2.0, 2.0), (3.1, 6.9), (9.5, 10.0)]
+    got = list(iter_regions(blocked(audio, sizes), regions, RATE))
+    assert len(got) == len(regions)
+    for (start, end), samples in zip(regions, got):
+        assert np.array_equal(samples, audio[int(start * RATE):int(end * RATE)])
+
+
+@pytest.mark.parametrize("sizes", [[10 * RATE], [3000] * 60])
+def test_overlapping_regions(audio, sizes):
+    # padded regions can overlap, and one can sit inside another
+    regions = [(1.0, 4.0), (3.5, 5.0), (4.5, 8.0), (5.0, 6.0)]
+    got = list(iter_regions(blocked(audio, sizes), regions, RATE))
+    for (start, end), samples in zip(regions, got):
+        assert np.array_equal(samples, audio[int(start * RATE):int(end * RATE)])
+
+
+def test_regions_past_the_end(audio):
+    got = list(iter_regions(blocked(audio, [RATE] * 10), [(9.0, 12.0), (11.0, 13.0)], RATE))
+    # cut short where the audio ends
+    assert np.array_equal(got[0], audio[9 * RATE:])
+    assert len(got[1]) == 0
+
+
+def test_no_regions(audio):
+    assert list(iter_regions([audio], [], RATE)) == []
+
+
+@pytest.mark.parametrize("seconds", [0.5, 25.0, 26.0, 44.0, 63.0, 100.0])
+def test_count_windows(seconds):
+    samples = int(seconds * RATE)
+    windows = list(iter_windows(blocked(np.zeros(samples, dtype=np.float32), [RATE * 7] * 20), RATE))
+    assert count_windows(samples, RATE) == len(windows)
+
+
+def made_up_words(seconds):
+    return [{"text": f"w{i}", "timestamp": (i * 0.4, i * 0.4 + 0.3)} for i in range(int(seconds / 0.4))]
+
+
+def fake_pipeline(inputs, windows, words):
+    """What the ASR would say for every window: the words inside it, on the window's own timeline."""
+    outputs = []
+    for inp, window in zip(inputs, list(windows)):
+        length = len(inp["raw"]) / inp["sampling_rate"]
+        outputs.append({"chunks": [{"text": w["text"], "timestamp": (w["timestamp"][0] - window.offset, w["timestamp"][1] - window.offset)}
+                                   for w in words if window.offset <= w["timestamp"][0] and w["timestamp"][1] <= window.offset + length]})
+    return outputs
+
+
+@pytest.mark.parametrize("seconds", [10.0, 60.0, 97.3])
+def test_windows_stitch_back(seconds):
+    words = made_up_words(seconds)
+    windows = deque()
+    inputs = list(iter_windows(blocked(np.zeros(int(seconds * RATE), dtype=np.float32), [RATE * 9] * 20), RATE, index=3, windows=windows))
+    outputs = fake_pipeline(inputs, windows, words)
+    stitched = stitch_window_words(outputs, windows)
+    assert list(stitched) == [3]
+    assert [w["text"] for w in stitched[3]] == [w["text"] for w in words]
+    for got, expected in zip(stitched[3], words):
+        assert got["timestamp"] == pytest.approx(expected["timestamp"])
+    # every window was used up
+    assert not windows
+
+
+def test_stitch_keeps_words_once_and_by_file():
+    windows = deque([
+        AudioWindow(index=0, offset=0.0, keep_start=0.0, keep_end=22.0),
+        AudioWindow(index=0, offset=19.0, keep_start=22.0, keep_end=float("inf")),
+        AudioWindow(index=1, offset=0.0, keep_start=0.0, keep_end=float("inf")),
+    ])
+    outputs = [
+        # "b" is in the overlap of both windows, the second one is further from its edge
+        {"chunks": [{"text": "a", "timestamp": (1.0, 1.5)}, {"text": "b", "timestamp": (22.5, 23.0)}]},
+        {"chunks": [{"text": "b", "timestamp": (3.5, 4.0)}, {"text": "c", "timestamp": (10.0, None)}]},
+        {"chunks": [{"text": "other", "timestamp": (0.0, 0.4)}]},
+    ]
+    stitched = stitch_window_words(outputs, windows)
+    assert stitched[0] == [{"text": "a", "timestamp": (1.0, 1.5)}, {"text": "b", "timestamp": (22.5, 23.0)}, {"text": "c", "timestamp": (29.0, None)}]
+    assert stitched[1] == [{"text": "other", "timestamp": (0.0, 0.4)}]
@@ -0,0 +1,97 @@
+"""Checkpoints of a file's progress, on a made up input file and document in a temp directory.
+
+    - a run interrupted after some stages resumes from the last one that finished, into the same output
+    - a changed input file or other settings discard the checkpoint
+    - a finished file only keeps a "done" marker, which is dropped when its output is gone
+"""
+import os
+
+import pytest
+
+from checkpoint import checkpoint_path, load_checkpoint, save_checkpoint
+
+STEPS = [("Whisper", ("openai/whisper-small", "eng"), ()), ("NemoSpeaker", (2,), ()), ("Wave2VecFA", (), ())]
+
+
+@pytest.fixture
+def audio(tmp_path):
+    path = tmp_path / "a.wav"
+    path.write_bytes(b"RIFF" + bytes(1000))
+    return str(path)
+
+
+def interrupted_run(audio, output_dir=None):
+    """What transcribe_file leaves behind when it is stopped during the third stage."""
+    output_file = f"{audio}.cha"
+    for completed in (1, 2):
+        save_checkpoint(audio, STEPS, output_file, completed, {"after": completed}, output_dir)
+    return output_file
+
+
+def test_resume_after_interrupted_stage(audio):
+    output_file = interrupted_run(audio)
+    checkpoint = load_checkpoint(audio, STEPS)
+    assert checkpoint["completed"] == 2
+    assert checkpoint["doc"] == {"after": 2}
+    assert checkpoint["output_file"] == output_file
+    assert not checkpoint["done"]
+
+
+def test_checkpoint_in_output_dir(audio, tmp_path):
+    output_dir = str(tmp_path / "out")
+    os.makedirs(output_dir)
+    interrupted_run(audio, output_dir)
+    assert os.path.isfile(os.path.join(output_dir, "a.wav.ckpt"))
+    assert not os.path.exists(checkpoint_path(audio))
+    assert load_checkpoint(audio, STEPS) is None
+    assert load_checkpoint(audio, STEPS, output_dir)["completed"] == 2
+
+
+def test_changed_input_discards(audio):
+    interrupted_run(audio)
+    with open(audio, "ab") as f:
+        f.write(b"more audio")
+    assert load_checkpoint(audio, STEPS) is None
+
+
+def test_touched_input_discards(audio):
+    interrupted_run(audio)
+    stat = os.stat(audio)
+    os.utime(audio, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert load_checkpoint(audio, STEPS) is None
+
+
+@pytest.mark.parametrize("steps", [
+    # another model
+    [("Whisper", ("openai/whisper-base", "eng"), ())] + STEPS[1:],
+    # another number of speakers
+    [STEPS[0], ("NemoSpeaker", (3,), ()), STEPS[2]],
+    # a stage more
+    STEPS + [("Stanza", ("eng",), ())],
+])
+def test_changed_settings_discard(audio, steps):
+    interrupted_run(audio)
+    assert load_checkpoint(audio, steps) is None
+
+
+def test_done_marker(audio):
+    output_file = interrupted_run(audio)
+    save_checkpoint(audio, STEPS, output_file, len(STEPS), {"after": 3})
+    with open(output_file, "w") as f:
+        f.write("@Begin\n@End\n")
+    checkpoint = load_checkpoint(audio, STEPS)
+    assert checkpoint["done"] and checkpoint["doc"] is None
+    # nothing to resume from once the output is gone
+    os.remove(output_file)
+    assert load_checkpoint(audio, STEPS) is None
+
+
+def test_unreadable_checkpoint(audio, capsys):
+    with open(checkpoint_path(audio), "wb") as f:
+        f.write(b"not a pickle")
+    assert load_checkpoint(audio, STEPS) is None
+    assert "unreadable checkpoint" in capsys.readouterr().out
+
+
+def test_no_checkpoint(audio):
+    assert load_checkpoint(audio, STEPS) is None
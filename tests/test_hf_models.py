@@ -0,0 +1,119 @@
+"""The model dropdown list, against a local stub of the HF API, so no network or token is needed.
+
+    - searching all the queries at once ranks the models like one after the other
+    - the list is kept on disk and read back fresh, then stale once the ttl is over
+    - a changed models.json does not use the kept list
+    - with the server gone (offline) the search gives up and the kept list is left alone
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from hf_models import fetch_model_list, load_model_list, rank_models, refresh_model_list, save_model_list, search_models
+
+QUERIES = [{"author": f"author{i}", "limit": 5, "filter": "automatic-speech-recognition"} for i in range(3)]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answers /api/models with made up models of the author, most downloaded first, and a model that is not for speech."""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != "/api/models":
+            self.send_error(404)
+            return
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        author = params.get("author", "someone")
+        models = [{"id": f"{author}/whisper-{i}", "pipeline_tag": "automatic-speech-recognition", "downloads": 1000 * len(author) - i}
+                  for i in range(int(params.get("limit", 10)))]
+        # not a speech model, should be filtered out
+        models.append({"id": f"{author}/bert", "pipeline_tag": "fill-mask", "downloads": 10**6})
+        body = json.dumps(models).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def endpoint():
+    """The address of a running stub server, it is shut down after the test."""
+    pytest.importorskip("requests")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def offline_endpoint():
+    # a port nothing listens on
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.server_close()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def test_rank_models():
+    results = [
+        [{"id": "a/x", "pipeline_tag": "automatic-speech-recognition", "downloads": 5},
+         {"id": "a/bert", "pipeline_tag": "fill-mask", "downloads": 50}],
+        [{"id": "b/y", "pipeline_tag": "automatic-speech-recognition", "downloads": 7},
+         {"id": "a/x", "pipeline_tag": "automatic-speech-recognition", "downloads": 5}],
+    ]
+    assert rank_models(results) == ["b/y", "a/x"]
+
+
+def test_concurrent_search_ranks_the_same(endpoint):
+    expected = rank_models([search_models(q, endpoint=endpoint) for q in QUERIES])
+    assert len(expected) == 5 * len(QUERIES)
+    assert not any(model.endswith("/bert") for model in expected)
+    assert fetch_model_list(QUERIES, endpoint=endpoint) == expected
+
+
+def test_refresh_keeps_the_list(endpoint, tmp_path):
+    path = tmp_path / "model_list.json"
+    assert load_model_list(QUERIES, path) == ([], False)
+    expected = fetch_model_list(QUERIES, endpoint=endpoint)
+    got = []
+    refresh_model_list(QUERIES, callback=got.append, endpoint=endpoint, path=path).join()
+    assert got == [expected]
+    assert load_model_list(QUERIES, path) == (expected, True)
+
+
+def test_offline_refresh_keeps_the_old_list(tmp_path):
+    pytest.importorskip("requests")
+    path = tmp_path / "model_list.json"
+    save_model_list(QUERIES, ["kept/model"], path)
+    got = []
+    assert fetch_model_list(QUERIES, endpoint=offline_endpoint()) is None
+    refresh_model_list(QUERIES, callback=got.append, endpoint=offline_endpoint(), path=path).join()
+    assert got == []
+    assert load_model_list(QUERIES, path) == (["kept/model"], True)
+
+
+def test_kept_list_goes_stale(tmp_path):
+    path = tmp_path / "model_list.json"
+    save_model_list(QUERIES, ["a/x", "b/y"], path)
+    assert load_model_list(QUERIES, path) == (["a/x", "b/y"], True)
+    assert load_model_list(QUERIES, path, ttl=0) == (["a/x", "b/y"], False)
+
+
+def test_changed_queries_dont_use_the_kept_list(tmp_path):
+    path = tmp_path / "model_list.json"
+    save_model_list(QUERIES, ["a/x"], path)
+    assert load_model_list(QUERIES[:1], path) == ([], False)
+
+
+def test_unreadable_list(tmp_path):
+    path = tmp_path / "model_list.json"
+    path.write_text("{not json", encoding="utf-8")
+    assert load_model_list(QUERIES, path) == ([], False)
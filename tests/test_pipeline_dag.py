@@ -0,0 +1,92 @@
+"""Scheduling of a batch pipelined across files, on stand-in stages that sleep for a set time per file, no model needed.
+
+    - every file still goes through its stages in order
+    - a stage's worker never runs two files at once
+    - the results come back under the index of their job
+    - the makespan is about the first file's time plus one slowest stage per other file
+"""
+import threading
+import time
+
+import pytest
+
+from pipeline_batch import STAGE_WORKERS, StagePipeline, expected_makespan
+
+# seconds per file of the stand-in stages, roughly in the proportions of a real run
+FAKE_STAGE_S = {"asr": 0.06, "speaker": 0.03, "disfluency": 0.005, "retrace": 0.005, "utr": 0.04, "fa": 0.025}
+FILES = 6
+
+
+def per_worker_seconds(stage_s):
+    per_worker = {}
+    for stage, seconds in stage_s.items():
+        per_worker[STAGE_WORKERS[stage]] = per_worker.get(STAGE_WORKERS[stage], 0.0) + seconds
+    return list(per_worker.values())
+
+
+@pytest.fixture(scope="module")
+def pipelined_run():
+    """Runs FILES stand-in files through a StagePipeline.
+
+    Returns:
+        dict: the results by job index, every (file, stage) in the order they ran, the most files any worker
+            ran at once and how long the batch took.
+    """
+    events, active, most = [], {}, {}
+    lock = threading.Lock()
+
+    def fake_transcribe(input_file, stage_runner):
+        for stage, seconds in FAKE_STAGE_S.items():
+            def work(stage=stage, seconds=seconds):
+                worker = STAGE_WORKERS[stage]
+                with lock:
+                    active[worker] = active.get(worker, 0) + 1
+                    most[worker] = max(most.get(worker, 0), active[worker])
+                    events.append((input_file, stage))
+                time.sleep(seconds)
+                with lock:
+                    active[worker] -= 1
+            stage_runner(stage, work)
+        return {"input_file": input_file}
+
+    jobs = [{"input_file": f"file{i}"} for i in range(FILES)]
+    results, errors = {}, []
+    start = time.perf_counter()
+    with StagePipeline() as pipeline:
+        for i, result, error in pipeline.map(fake_transcribe, jobs):
+            results[i] = result
+            if error is not None:
+                errors.append(error)
+    return {"jobs": jobs, "results": results, "errors": errors, "events": events, "most": most,
+            "seconds": time.perf_counter() - start}
+
+
+def test_results_by_job(pipelined_run):
+    assert pipelined_run["errors"] == []
+    assert [pipelined_run["results"][i]["input_file"] for i in range(FILES)] == [job["input_file"] for job in pipelined_run["jobs"]]
+
+
+def test_stages_in_order(pipelined_run):
+    for job in pipelined_run["jobs"]:
+        assert [stage for file, stage in pipelined_run["events"] if file == job["input_file"]] == list(FAKE_STAGE_S)
+
+
+def test_one_file_per_worker(pipelined_run):
+    assert set(pipelined_run["most"]) == set(STAGE_WORKERS[stage] for stage in FAKE_STAGE_S)
+    assert all(n == 1 for n in pipelined_run["most"].values()), pipelined_run["most"]
+
+
+def test_makespan(pipelined_run):
+    sequential, pipelined = expected_makespan(per_worker_seconds(FAKE_STAGE_S), FILES)
+    # threads and sleeps are not exact, but pipelining should get most of the way there
+    assert pipelined_run["seconds"] < pipelined * 1.25 + 0.1
+    assert pipelined_run["seconds"] < sequential
+
+
+def test_expected_makespan():
+    assert expected_makespan([1.0, 3.0, 2.0], 4) == (24.0, 6.0 + 3 * 3.0)
+    # one file gains nothing
+    assert expected_makespan([1.0, 3.0, 2.0], 1) == (6.0, 6.0)
+    assert expected_makespan([], 5) == (0.0, 0.0)
+    assert expected_makespan([1.0], 0) == (0.0, 0.0)
+
@@ -0,0 +1,117 @@
+"""words_to_turns against the old `pop(0)` sweep it replaced, see benchmarks/bench_postprocess.py.
+
+The text of the turns has to be the same as before. The speakers of diarized
+transcripts were changed on purpose (the old sweep put the first turn on speaker 0
+and dropped the last one), so those are checked against a brute force "most
+overlap" assignment instead.
+"""
+import random
+
+import numpy as np
+import pytest
+
+from bench_postprocess import reference_postprocess, synthetic_words
+from asr_postprocess import speaker_runs, words_to_turns
+
+SAMPLE_RATE = 16000
+
+
+def old_and_new(words, segments=None):
+    duration = (words[-1]["timestamp"][0] + 1) if words else 10.0
+    data_len = int(duration * SAMPLE_RATE)
+    return (reference_postprocess(words, data_len, SAMPLE_RATE, segments),
+            words_to_turns(words, data_len / SAMPLE_RATE, segments))
+
+
+def flatten(result):
+    return [element for turn in result["monologues"] for element in turn["elements"]]
+
+
+def random_segments(rng, frames):
+    """Speaker labels per diarization frame, in runs of random length."""
+    segments = []
+    while len(segments) < frames:
+        segments += [rng.choice([0, 1, 2])] * rng.randint(1, 80)
+    return segments[:frames]
+
+
+def most_overlap(start, end, runs):
+    """The speaker of the run the word overlaps the most, the earlier run on a tie."""
+    end = max(end or start, start)
+    if end == start:
+        return next((speaker for s, e, speaker in runs if s <= start < e), runs[-1][2])
+    overlaps = [min(end, e) - max(start, s) for s, e, _ in runs]
+    return runs[int(np.argmax(overlaps))][2]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_single_speaker_same_as_old(seed):
+    old, new = old_and_new(synthetic_words(2000, random.Random(seed)))
+    assert new == old
+
+
+def test_empty_input():
+    old, new = old_and_new([])
+    assert new == old == {"monologues": [{"elements": [], "speaker": 0}]}
+    # no words means no turns to split, whatever the diarization says
+    _, new = old_and_new([], [0] * 10 + [1] * 10 + [0] * 10)
+    assert new == {"monologues": [{"elements": [], "speaker": 0}]}
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_speakers_keep_old_text(seed):
+    rng = random.Random(seed)
+    words = synthetic_words(2000, rng)
+    segments = random_segments(rng, int(words[-1]["timestamp"][0] / 0.05))
+    old, new = old_and_new(words, segments)
+    assert flatten(new) == flatten(old)
+    assert all(turn["elements"] for turn in new["monologues"])
+    speakers = [turn["speaker"] for turn in new["monologues"]]
+    assert all(a != b for a, b in zip(speakers, speakers[1:]))
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_speakers_by_most_overlap(seed):
+    rng = random.Random(seed)
+    # plain words, so every word is exactly one element
+    words = []
+    t = 0.0
+    for i in range(1000):
+        t = round(t + rng.choice([0.0, 0.1, 0.2, 0.3, 0.5]), 2)
+        words.append({"text": f"w{i}", "timestamp": (t, rng.choice([round(t + rng.uniform(0.05, 1.5), 2), None]))})
+    duration = t + 1
+    segments = random_segments(rng, int(duration / 0.05))
+    runs = list(zip(*speaker_runs(segments, duration)))
+    expected = {word["text"]: most_overlap(*word["timestamp"], runs) for word in words}
+
+    result = words_to_turns(words, duration, segments)
+    for turn in result["monologues"]:
+        for element in turn["elements"]:
+            assert turn["speaker"] == expected[element["value"]], element
+
+
+def test_words_at_segment_boundaries():
+    # speaker 2, then 1, then 2 again, a second each
+    segments = [2] * 20 + [1] * 20 + [2] * 20
+    duration = 4.0
+    starts, ends, _ = speaker_runs(segments, duration)
+    second, third = starts[1], starts[2]
+    words = [
+        {"text": "first", "timestamp": (0.2, 0.5)},
+        # mostly before the turn change
+        {"text": "before", "timestamp": (second - 0.1, second + 0.04)},
+        # no length, right at the start of the second run
+        {"text": "point", "timestamp": (second, None)},
+        {"text": "on", "timestamp": (second, second + 0.3)},
+        # as much in the second run as in the third, the earlier run wins
+        {"text": "tie", "timestamp": (third - 0.1, third + 0.1)},
+        {"text": "across", "timestamp": (third - 0.1, third + 0.4)},
+        # after the last diarization frame, the last run is stretched to the end of the audio
+        {"text": "last", "timestamp": (3.5, 3.8)},
+    ]
+    result = words_to_turns(words, duration, segments)
+    assert [([e["value"] for e in turn["elements"]], turn["speaker"]) for turn in result["monologues"]] == [
+        (["first", "before"], 2),
+        (["point", "on", "tie"], 1),
+        (["across", "last"], 2),
+    ]
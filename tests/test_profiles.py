@@ -0,0 +1,105 @@
+"""Pipeline profiles, on made up profiles and real-time factor histories, nothing is loaded.
+
+    - a profile turns into transcribe_file kwargs, and whatever the job sets wins over it
+    - unknown profiles, stages and settings are rejected, and so is a device or batch size on a stage that cant use it
+    - the "standard" profile runs the same as no profile
+    - the estimate uses the recorded real-time factors of the same configuration, then of the same stage, then a guess
+"""
+import pytest
+
+from profiles import DEFAULT_RTF, PROFILES_DEFAULT, apply_profile, estimate, estimate_profiles, job_steps, load_profiles, profile_kwargs
+from profiling import rtf_key
+from transcribe_proc import DEFAULT_STAGES
+
+PROFILES = {
+    "quick": {
+        "description": "Words and speakers",
+        "stages": {"speaker": {}, "asr": {"device": "cuda", "batch_size": 16, "threads": 4}},
+        "options": {"asr_engine": "custom", "vad": True},
+    },
+    "text": {
+        "stages": {"asr": {"device": "auto"}, "disfluency": {"threads": 1, "device": "auto"}},
+    },
+}
+JOB = {"input_file": "a.wav", "model_name": "openai/whisper-small"}
+
+
+def test_profile_kwargs():
+    assert profile_kwargs("quick", PROFILES) == {
+        "asr_engine": "custom",
+        "vad": True,
+        # in the order they run, not the order of the profile
+        "stages": ["asr", "speaker"],
+        "asr_batch_size": 16,
+        "asr_device": "cuda",
+        "stage_threads": {"asr": 4},
+    }
+    # "auto" is what every stage does anyway
+    assert profile_kwargs("text", PROFILES) == {"stages": ["asr", "disfluency"], "stage_threads": {"disfluency": 1}}
+
+
+def test_job_wins_over_profile():
+    job = apply_profile({**JOB, "vad": False, "asr_batch_size": 2}, "quick", PROFILES)
+    assert job["vad"] is False and job["asr_batch_size"] == 2
+    assert job["asr_device"] == "cuda" and job["input_file"] == "a.wav"
+    assert apply_profile(JOB, None, PROFILES) == JOB
+
+
+@pytest.mark.parametrize("stages, message", [
+    ({"asr": {}, "transcode": {}}, "Unknown stage"),
+    ({"asr": {"beam_size": 5}}, "Unknown setting"),
+    ({"asr": {}, "speaker": {"device": "cuda"}}, "cant set device"),
+    ({"asr": {}, "fa": {"batch_size": 4}}, "cant set batch_size"),
+])
+def test_invalid_profiles(stages, message):
+    with pytest.raises(ValueError, match=message):
+        profile_kwargs("bad", {"bad": {"stages": stages}})
+
+
+def test_unknown_profile():
+    with pytest.raises(ValueError, match="Unknown profile"):
+        profile_kwargs("missing", PROFILES)
+
+
+def test_shipped_profiles():
+    profiles = load_profiles([PROFILES_DEFAULT])
+    for name in profiles:
+        profile_kwargs(name, profiles)
+    # the same steps with the same settings as a job without a profile
+    standard = profile_kwargs("standard", profiles)
+    assert standard == {"stages": list(DEFAULT_STAGES)}
+    assert job_steps(apply_profile(JOB, "standard", profiles)) == job_steps(JOB)
+
+
+def test_estimate_sources():
+    job = apply_profile(JOB, "quick", PROFILES)
+    (asr, asr_step), (speaker, speaker_step) = job_steps(job)
+    history = {
+        rtf_key(asr, asr_step, 4): [0.1, 0.5, 0.2],
+        # the same stage with other settings
+        rtf_key(speaker, ("NemoSpeaker", (3,), ()), None): [0.05],
+    }
+    result = estimate(job, 100.0, history)
+    assert [(s["stage"], s["source"]) for s in result["stages"]] == [("asr", "recorded"), ("speaker", "other settings")]
+    assert result["stages"][0]["rtf"] == pytest.approx(0.2)
+    assert result["seconds"] == pytest.approx(100.0 * (0.2 + 0.05))
+
+    guessed = estimate(job, 100.0, {})
+    assert [s["source"] for s in guessed["stages"]] == ["guess", "guess"]
+    assert guessed["seconds"] == pytest.approx(100.0 * (DEFAULT_RTF["asr"] + DEFAULT_RTF["speaker"]))
+
+
+def test_estimate_threads_are_part_of_the_configuration():
+    job = apply_profile(JOB, "quick", PROFILES)
+    (asr, asr_step), _ = job_steps(job)
+    # recorded with a different number of threads, so only "other settings"
+    result = estimate(job, 10.0, {rtf_key(asr, asr_step, 1): [0.4]})
+    assert result["stages"][0]["source"] == "other settings"
+
+
+def test_estimate_profiles():
+    results = estimate_profiles([JOB, JOB], [60.0, 30.0], PROFILES, {})
+    assert set(results) == set(PROFILES)
+    assert results["quick"]["description"] == "Words and speakers"
+    assert results["quick"]["seconds"] == pytest.approx(90.0 * (DEFAULT_RTF["asr"] + DEFAULT_RTF["speaker"]))
+    assert results["text"]["guess"] == ["asr", "disfluency"]
@@ -0,0 +1,85 @@
+"""The result cache, on small made up files and entries in a temp directory.
+
+    - a copy of a file somewhere else hits the entry of the original
+    - other settings, or a changed file, miss
+    - past the size limit the least recently used entries go first, and reading an entry counts as using it
+    - an unreadable entry is a miss, not an error
+"""
+import os
+import shutil
+
+import pytest
+
+from result_cache import ResultCache, hash_file, make_key
+
+SETTINGS = [("Whisper", ("openai/whisper-small", "eng"), ())]
+
+
+@pytest.fixture
+def audio(tmp_path):
+    path = tmp_path / "a.wav"
+    path.write_bytes(b"RIFF" + bytes(range(256)) * 64)
+    return path
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResultCache(tmp_path / "cache", max_bytes=10**6)
+
+
+def test_same_content_elsewhere_hits(audio, cache, tmp_path):
+    cache.put(make_key(hash_file(audio), SETTINGS), {"doc": 1})
+    copy = tmp_path / "elsewhere" / "renamed.wav"
+    copy.parent.mkdir()
+    shutil.copy(audio, copy)
+    assert cache.get(make_key(hash_file(copy), SETTINGS)) == {"doc": 1}
+
+
+def test_other_settings_miss(audio, cache):
+    cache.put(make_key(hash_file(audio), SETTINGS), {"doc": 1})
+    assert cache.get(make_key(hash_file(audio), [("Whisper", ("openai/whisper-base", "eng"), ())])) is None
+    assert cache.get(make_key(hash_file(audio), SETTINGS + [("NemoSpeaker", (2,), ())])) is None
+
+
+def test_changed_file_misses(audio, cache):
+    key = make_key(hash_file(audio), SETTINGS)
+    cache.put(key, {"doc": 1})
+    audio.write_bytes(audio.read_bytes() + b"more")
+    # a different size and mtime, so the remembered hash is not used
+    assert make_key(hash_file(audio), SETTINGS) != key
+
+
+def test_lru_eviction(tmp_path):
+    cache = ResultCache(tmp_path / "cache", max_bytes=10**9)
+    for i in range(4):
+        cache.put(f"k{i}", bytes(1000))
+        # whole seconds apart, whatever the resolution of the file system's mtimes
+        os.utime(cache._path(f"k{i}"), (1000 + i, 1000 + i))
+    size = cache._path("k0").stat().st_size
+    # read last, so it is the most recently used
+    assert cache.get("k0") == bytes(1000)
+    cache.max_bytes = 3 * size
+    cache.evict()
+    assert cache.get("k1") is None
+    assert [cache.get(k) is not None for k in ("k0", "k2", "k3")] == [True, True, True]
+
+    # a put past the limit evicts on its own
+    cache.max_bytes = 2 * size
+    for i, key in enumerate(("k2", "k3", "k0")):
+        os.utime(cache._path(key), (2000 + i, 2000 + i))
+    cache.put("k4", bytes(1000))
+    assert sorted(p.stem for p in cache.directory.glob("*.pkl")) == ["k0", "k4"]
+
+
+def test_corrupt_entry_is_a_miss(cache, capsys):
+    cache.put("key", {"doc": 1})
+    cache._path("key").write_bytes(b"not a pickle")
+    assert cache.get("key") is None
+    assert "unreadable cache entry" in capsys.readouterr().out
+    # and it can be written again
+    cache.put("key", {"doc": 2})
+    assert cache.get("key") == {"doc": 2}
+
+
+def test_missing_entry(cache):
+    assert cache.get("nothing") is None
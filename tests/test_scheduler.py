@@ -0,0 +1,123 @@
+"""How many workers the scheduler starts and which jobs share a worker, with the memory probes replaced by set numbers.
+
+    - the concurrency is the tightest of RAM, VRAM, cores and the user's limit, and never below 1
+    - workers that share their weights only pay for them once, and ignore the VRAM
+    - workers that are still loading count against the memory a new one can have
+    - jobs only batch when they run the "custom" ASR engine with the same configuration
+    - nvidia-smi is asked again only once its last answer is old
+"""
+import subprocess
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("psutil")
+import scheduler
+from scheduler import GB, RESERVED_RAM_GB, TranscribeScheduler, choose_concurrency, estimate_job_memory, estimate_model_memory
+
+# 2 GB of weights, 5 GB with the rest of the pipeline
+SMALL = "openai/whisper-small"
+
+
+@pytest.fixture
+def memory(monkeypatch):
+    """Sets what `get_available_memory` returns and how many cores there are, ex: memory(ram=12 * GB, vram=None, cpus=32)."""
+    def set_memory(ram, vram=None, cpus=32):
+        monkeypatch.setattr(scheduler, "get_available_memory", lambda: (ram, vram))
+        monkeypatch.setattr(scheduler.os, "cpu_count", lambda: cpus)
+    return set_memory
+
+
+def test_estimates():
+    assert estimate_model_memory(SMALL) == 2 * GB
+    assert estimate_job_memory(SMALL) == 5 * GB
+    # the first matching size wins
+    assert estimate_model_memory("openai/whisper-large-v3-turbo") == 6 * GB
+    assert estimate_model_memory(SMALL, "fp16") == 1 * GB
+    assert estimate_model_memory("someone/unknown") == estimate_model_memory("openai/whisper-medium")
+
+
+def test_concurrency_by_ram(memory):
+    memory(ram=(RESERVED_RAM_GB + 2 * 5) * GB)
+    assert choose_concurrency(SMALL) == 2
+    memory(ram=(RESERVED_RAM_GB + 2 * 5) * GB - 1)
+    assert choose_concurrency(SMALL) == 1
+
+
+def test_concurrency_by_vram_cores_and_limit(memory):
+    memory(ram=100 * GB, vram=5 * GB)
+    assert choose_concurrency(SMALL) == 2
+    # half precision weights fit twice as often
+    assert choose_concurrency(SMALL, precision="fp16") == 5
+    memory(ram=100 * GB, cpus=6)
+    assert choose_concurrency(SMALL) == 3
+    memory(ram=100 * GB)
+    assert choose_concurrency(SMALL, max_workers=4) == 4
+
+
+def test_concurrency_at_least_one(memory):
+    memory(ram=0, vram=0, cpus=1)
+    assert choose_concurrency(SMALL) == 1
+
+
+def test_shared_weights_concurrency(memory):
+    # one full job, then 1.5 GB per worker, the VRAM does not count since they run on the CPU
+    memory(ram=(RESERVED_RAM_GB + 5 + 3 * 1.5) * GB, vram=0)
+    assert choose_concurrency(SMALL, shared=True) == 4
+    assert choose_concurrency(SMALL, shared=False) == 1
+
+
+def test_can_admit(memory):
+    sched = TranscribeScheduler()
+    memory(ram=(RESERVED_RAM_GB + 5) * GB, vram=2 * GB)
+    assert sched.can_admit(SMALL)
+    memory(ram=(RESERVED_RAM_GB + 5) * GB, vram=2 * GB - 1)
+    assert not sched.can_admit(SMALL)
+    memory(ram=(RESERVED_RAM_GB + 5) * GB - 1, vram=None)
+    assert not sched.can_admit(SMALL)
+
+
+def test_can_admit_counts_loading_workers(memory):
+    sched = TranscribeScheduler()
+    memory(ram=(RESERVED_RAM_GB + 10) * GB, vram=4 * GB)
+    assert sched.can_admit(SMALL)
+    # still loading its model, the free memory does not show it yet
+    sched.loading.add("worker")
+    sched.running["worker"] = (None, {"model_name": SMALL}, 1)
+    assert sched.can_admit(SMALL)
+    sched.running["other"] = (None, {"model_name": SMALL}, 2)
+    sched.loading.add("other")
+    assert not sched.can_admit(SMALL)
+    # done loading, its memory is already taken off of what is free
+    sched.loading.clear()
+    assert sched.can_admit(SMALL)
+
+
+def test_batch_key():
+    custom = {"model_name": SMALL, "lang": "eng", "asr_engine": "custom", "asr_batch_size": 4}
+    assert TranscribeScheduler.batch_key(custom) is not None
+    assert TranscribeScheduler.batch_key(custom) == TranscribeScheduler.batch_key({**custom, "input_file": "other.wav", "num_speakers": 3})
+    assert TranscribeScheduler.batch_key(custom) != TranscribeScheduler.batch_key({**custom, "asr_batch_size": 8})
+    assert TranscribeScheduler.batch_key(custom) != TranscribeScheduler.batch_key({**custom, "lang": "spa"})
+    # the batchalign engine does not batch across files
+    assert TranscribeScheduler.batch_key({**custom, "asr_engine": "batchalign"}) is None
+    # sharded files already use every worker process they get
+    assert TranscribeScheduler.batch_key({**custom, "asr_shards": 2}) is None
+    assert TranscribeScheduler.batch_key({**custom, "stages": ["speaker", "fa"]}) is None
+
+
+def test_nvidia_smi_answer_is_reused(monkeypatch):
+    calls = []
+
+    def fake_run(*args, **kwargs):
+        calls.append(args)
+        return SimpleNamespace(stdout=f"{1024 * len(calls)}\n")
+
+    monkeypatch.setattr(scheduler, "_nvidia_smi_free", (float("-inf"), None))
+    monkeypatch.setattr(scheduler.shutil, "which", lambda exe: f"/usr/bin/{exe}")
+    monkeypatch.setattr(subprocess, "run", fake_run)
+    assert scheduler.nvidia_smi_free_memory() == 1 * GB
+    assert scheduler.nvidia_smi_free_memory() == 1 * GB
+    assert len(calls) == 1
+    assert scheduler.nvidia_smi_free_memory(max_age=0) == 2 * GB
+    assert len(calls) == 2
@@ -0,0 +1,89 @@
+"""Cutting a recording into shards and stitching the words back, on made up words, no model needed.
+
+    - the cuts land in the pauses near an even split
+    - words right at a cut, timed on both sides of it by the two shards, are kept once
+    - a word repeated on purpose next to a cut ("the the") is kept twice
+    - a word straddling a cut is kept once, by the shard that holds most of it
+    - the stitched timestamps never go back
+"""
+import numpy as np
+
+from sharding import find_cuts, plan_shards, shard_count, stitch_shards
+from vad import FRAME_MS
+
+CUT = 100.0
+
+
+def shard_view(words, shard, jitter=0.0):
+    """What a shard would transcribe: the words inside its audio, on its own timeline, with a bit of timing noise."""
+    return [{"text": w["text"], "timestamp": (w["timestamp"][0] - shard.start + jitter, w["timestamp"][1] - shard.start + jitter)}
+            for w in words if w["timestamp"][0] >= shard.start and w["timestamp"][1] <= shard.end]
+
+
+def words_around_cut():
+    words = [{"text": f"w{i}", "timestamp": (i * 0.5, i * 0.5 + 0.4)} for i in range(int(CUT / 0.5) - 4)]
+    # ends right before the cut
+    words.append({"text": "before", "timestamp": (CUT - 0.45, CUT - 0.02)})
+    # straddles the cut, most of it after
+    words.append({"text": "across", "timestamp": (CUT - 0.1, CUT + 0.5)})
+    # on purpose twice, right after the cut
+    words.append({"text": "the", "timestamp": (CUT + 0.55, CUT + 0.7)})
+    words.append({"text": "the", "timestamp": (CUT + 1.35, CUT + 1.5)})
+    words += [{"text": f"v{i}", "timestamp": (CUT + 2 + i * 0.5, CUT + 2.4 + i * 0.5)} for i in range(100)]
+    return words
+
+
+def test_shard_count():
+    # at least one shard per worker, none shorter than a minute
+    assert shard_count(3600.0, 4) == 6
+    assert shard_count(3600.0, 8) == 8
+    assert shard_count(150.0, 8) == 2
+    assert shard_count(30.0, 8) == 1
+
+
+def test_cuts_land_in_pauses():
+    frame_s = FRAME_MS / 1000
+    duration = 1800.0
+    energies = np.full(int(duration / frame_s), -20.0)
+    # a pause 12s after every even split point, and a louder dip right on it that is too short to be a pause
+    pauses = [612.0, 1212.0]
+    for pause in pauses:
+        energies[int(pause / frame_s):int((pause + 0.6) / frame_s)] = -60.0
+    for target in (600.0, 1200.0):
+        energies[int(target / frame_s)] = -70.0
+    cuts = find_cuts(energies, duration, 3)
+    assert all(p <= c <= p + 0.6 for p, c in zip(pauses, cuts)), f"cuts {cuts} missed the pauses {pauses}"
+
+
+def test_words_at_the_cut_kept_once():
+    words = words_around_cut()
+    shards = plan_shards(200.0, [CUT], overlap_s=5.0)
+    first, second = shard_view(words, shards[0]), shard_view(words, shards[1])
+    # the second shard hears "before" a little later, just across the cut, the first hears "across" a little earlier
+    for w in second:
+        if w["text"] == "before":
+            w["timestamp"] = (w["timestamp"][0] + 0.3, w["timestamp"][1] + 0.3)
+    for w in first:
+        if w["text"] == "across":
+            w["timestamp"] = (w["timestamp"][0] - 0.05, w["timestamp"][1] - 0.05)
+    stitched = stitch_shards([first, second], shards)
+    assert [w["text"] for w in stitched] == [w["text"] for w in words]
+    starts = [w["timestamp"][0] for w in stitched]
+    ends = [w["timestamp"][1] for w in stitched]
+    assert all(a <= b for a, b in zip(ends, starts[1:])), "timestamps go back"
+    assert all(s <= e for s, e in zip(starts, ends)), "words end before they start"
+
+
+def test_timing_noise_keeps_every_word_once():
+    words = words_around_cut()
+    shards = plan_shards(200.0, [70.0, 140.0], overlap_s=5.0)
+    stitched = stitch_shards([shard_view(words, s, jitter) for s, jitter in zip(shards, (0.0, 0.08, -0.08))], shards)
+    assert [w["text"] for w in stitched] == [w["text"] for w in words]
+
+
+def test_single_shard_is_the_whole_recording():
+    words = words_around_cut()
+    shards = plan_shards(200.0, [], overlap_s=5.0)
+    assert len(shards) == 1 and (shards[0].start, shards[0].end) == (0.0, 200.0)
+    stitched = stitch_shards([shard_view(words, shards[0])], shards)
+    assert [w["text"] for w in stitched] == [w["text"] for w in words]
@@ -0,0 +1,94 @@
+"""Voice activity detection on synthetic audio: tones for speech, faint noise for silence.
+
+    - the tones are found, padded a bit, and the silence around them is left out
+    - short pauses do not split a region, short clicks are not speech
+    - over-long regions are cut at their quietest point into pieces that fit in a whisper window
+"""
+import numpy as np
+import pytest
+
+from vad import FRAME_MS, MAX_REGION_S, MIN_REGION_S, PAD_MS, detect_speech, frame_energies, speech_regions, split_long_region
+
+RATE = 16000
+# one frame either way, plus the padding
+TOLERANCE_S = PAD_MS / 1000 + FRAME_MS / 1000
+
+
+def signal(*parts, seed=0):
+    """Concatenates ("tone" | "silence", seconds) parts into one recording."""
+    rng = np.random.default_rng(seed)
+    audio = []
+    for kind, seconds in parts:
+        n = int(seconds * RATE)
+        noise = rng.normal(0, 1e-4, n)
+        if kind == "tone":
+            audio.append(0.3 * np.sin(2 * np.pi * 220 * np.arange(n) / RATE) + noise)
+        else:
+            audio.append(noise)
+    return np.concatenate(audio).astype(np.float32)
+
+
+def test_finds_the_tones():
+    audio = signal(("silence", 2), ("tone", 3), ("silence", 4), ("tone", 2), ("silence", 3))
+    regions = detect_speech([audio], RATE)
+    assert len(regions) == 2
+    for (start, end), (expected_start, expected_end) in zip(regions, [(2, 5), (9, 11)]):
+        assert start == pytest.approx(expected_start - PAD_MS / 1000, abs=TOLERANCE_S)
+        assert end == pytest.approx(expected_end + PAD_MS / 1000, abs=TOLERANCE_S)
+
+
+def test_blocks_like_one_array():
+    audio = signal(("silence", 1), ("tone", 2), ("silence", 2), ("tone", 1), ("silence", 1))
+    blocks = np.array_split(audio, [1000, 7777, 40000, 40001])
+    assert np.allclose(frame_energies(blocks, RATE), frame_energies([audio], RATE))
+    assert detect_speech(blocks, RATE) == detect_speech([audio], RATE)
+
+
+def test_short_pause_and_click():
+    # a pause shorter than MIN_SILENCE_MS stays in the region
+    audio = signal(("silence", 2), ("tone", 2), ("silence", 0.3), ("tone", 2), ("silence", 2))
+    assert len(detect_speech([audio], RATE)) == 1
+    # shorter than MIN_SPEECH_MS is a click
+    audio = signal(("silence", 2), ("tone", 0.1), ("silence", 2))
+    assert detect_speech([audio], RATE) == []
+
+
+def test_silence_only():
+    assert detect_speech([signal(("silence", 5))], RATE) == []
+    assert speech_regions(np.zeros(0)) == []
+
+
+def test_long_speech_is_split():
+    # 70 seconds of speech with a short dip every 7 seconds, and enough silence around it for the noise floor
+    parts = []
+    for _ in range(10):
+        parts += [("tone", 6.8), ("silence", 0.2)]
+    regions = detect_speech([signal(("silence", 10), *parts, ("silence", 10))], RATE)
+    assert len(regions) >= 3
+    for (start, end), (next_start, _) in zip(regions, regions[1:]):
+        # the pieces follow each other without a gap or an overlap
+        assert end == next_start
+    for start, end in regions:
+        assert end - start <= MAX_REGION_S + 1e-9
+    for start, end in regions[:-1]:
+        assert end - start >= MIN_REGION_S - 1e-9
+    # the cuts land in the dips
+    for _, end in regions[:-1]:
+        assert (end - 10) % 7 == pytest.approx(6.9, abs=0.15)
+
+
+def test_split_long_region():
+    energies = np.full(100, -20.0)
+    energies[[30, 45, 70]] = -60.0
+    # the quietest frame between min and max from the start of every piece
+    assert split_long_region(0, 100, energies, max_frames=40, min_frames=10) == [(0, 30), (30, 45), (45, 70), (70, 100)]
+    # a region that fits is kept whole
+    assert split_long_region(5, 40, energies, max_frames=40, min_frames=10) == [(5, 40)]
+
+
+def test_split_long_region_without_pauses():
+    # nothing quieter, so every cut is as early as min_frames allows, and no piece is longer than max_frames
+    pieces = split_long_region(0, 95, np.full(95, -20.0), max_frames=30, min_frames=10)
+    assert pieces[0][0] == 0 and pieces[-1][1] == 95
+    assert all(end - start <= 30 for start, end in pieces)
+    assert all(a[1] == b[0] for a, b in zip(pieces, pieces[1:]))
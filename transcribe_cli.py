@@ -0,0 +1,343 @@
+"""Command line entry point for transcribing many files without the GUI.
+
+Never imports tkinter or the GUI, and never opens the outputs in a viewer, so it
+runs on servers without a display. The files are run by the same persistent
+workers as the GUI, see scheduler.py, or with --pipelined in this process with every
+stage on a different file, see pipeline_batch.py.
+
+Examples:
+    python transcribe_cli.py interview1.wav "recordings/**/*.mp4" --model openai/whisper-small.en --speakers 2
+    python transcribe_cli.py --manifest batch.csv --output-dir out/ --concurrency 2 --report out/report.json
+
+A manifest is a .csv with a header row, or a .jsonl with one object per line. Each
+row needs an `input_file` (or `file`/`path`) and can override any transcribe_file
+option for that file, ex: `lang`, `num_speakers`, `model_name`.
+"""
+import argparse
+import csv
+import glob
+import json
+import os
+import sys
+import time
+
+from ffmpeg_utils import convert_file_to_type, get_audio_file_types
+from profiling import audio_duration
+from profiles import apply_profile
+import progress
+from scheduler import TranscribeScheduler
+
+# manifest columns that can hold the media path
+PATH_COLUMNS = ("input_file", "file", "path")
+# manifest columns that are numbers, csv gives us strings
+INT_COLUMNS = ("num_speakers", "asr_batch_size", "asr_shards")
+BOOL_COLUMNS = ("asr_streaming", "vad", "use_cache", "resume", "parallel_stages")
+# how often the memory of the workers is sampled for the report, in seconds. Reading the
+# PSS walks every memory mapping of every worker, too slow to do on every pump
+MEMORY_SAMPLE_S = 5.0
+
+
+def expand_inputs(patterns):
+    """
+    Args:
+        patterns (List[str]): file paths or glob patterns ("**" matches any number of directories).
+
+    Returns:
+        List[str]: the matching files, in order, without duplicates.
+    """
+    files = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True)) if glob.has_magic(pattern) else [pattern]
+        if not matches:
+            print(f"Nothing matches {pattern}", file=sys.stderr)
+        for match in matches:
+            if os.path.isfile(match) and match not in files:
+                files.append(match)
+            elif not os.path.isfile(match):
+                print(f"Skipping {match}, it is not a file", file=sys.stderr)
+    return files
+
+
+def _parse_value(key, value):
+    if value in ("", None):
+        return None
+    if key in INT_COLUMNS:
+        return int(value)
+    if key in BOOL_COLUMNS and isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "y")
+    return value
+
+
+def read_manifest(path):
+    """
+    Returns:
+        List[dict]: the transcribe_file kwargs of every row, at least with an `input_file`.
+    """
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        if path.lower().endswith(".csv"):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+    jobs = []
+    base = os.path.dirname(os.path.abspath(path))
+    for i, row in enumerate(rows, start=1):
+        file = next((row[c] for c in PATH_COLUMNS if row.get(c)), None)
+        if not file:
+            print(f"Skipping row {i} of {path}, it has no {'/'.join(PATH_COLUMNS)}", file=sys.stderr)
+            continue
+        job = {k: _parse_value(k, v) for k, v in row.items() if k not in PATH_COLUMNS}
+        # relative paths are relative to the manifest
+        job["input_file"] = file if os.path.isabs(file) else os.path.join(base, file)
+        jobs.append({k: v for k, v in job.items() if v is not None})
+    return jobs
+
+
+def prepare_input(input_file):
+    """
+    Returns:
+        str | None: a file the pipeline can read, converted to 16 kHz wav if needed, None if the conversion failed.
+    """
+    if input_file.split('.')[-1].lower() in get_audio_file_types():
+        return input_file
+    return convert_file_to_type(input_file, ".wav")
+
+
+def build_report(rows, wall_seconds, workers=None):
+    """
+    Args:
+        workers (List[dict], optional): peak memory of every worker, see `TranscribeScheduler.memory_report`.
+
+    Returns:
+        dict: throughput, memory and failures of the batch.
+    """
+    audio = sum(r["audio_seconds"] or 0 for r in rows)
+    failed = [r for r in rows if not r["success"]]
+    return {
+        "files": len(rows),
+        "succeeded": len(rows) - len(failed),
+        "failed": len(failed),
+        "wall_seconds": wall_seconds,
+        "audio_seconds": audio,
+        # how many seconds of audio are transcribed per second
+        "throughput": audio / wall_seconds if wall_seconds else None,
+        "files_per_hour": len(rows) / wall_seconds * 3600 if wall_seconds else None,
+        "workers": workers or [],
+        # what the workers really took together, shared pages counted once
+        "total_pss_mb": sum(w["pss_mb"] for w in workers) if workers and all(w["pss_mb"] is not None for w in workers) else None,
+        "total_rss_mb": sum(w["rss_mb"] for w in workers) if workers else None,
+        "failures": [{"input_file": r["input_file"], "error": r["error"], "failed_steps": r["failed_steps"]} for r in failed],
+        "results": rows,
+    }
+
+
+def result_row(input_file, result, error=None) -> dict:
+    """
+    Returns:
+        dict: the row of a finished job in the report.
+    """
+    result = result or {}
+    return {
+        "input_file": input_file,
+        "output_file": result.get("output_file"),
+        "audio_seconds": (result.get("metrics") or {}).get("total", {}).get("audio_seconds") or audio_duration(input_file),
+        "success": bool(result.get("success")) and not error,
+        "error": error,
+        "failed_steps": [s["step"] for s in result.get("steps", []) if s["status"] == "FAILED"],
+        # with --parallel-stages, the longest chain of stages that waited on each other
+        "critical_path": result.get("critical_path"),
+        # stages ran at the same time, so their cpu and memory metrics include each other, see profiling.py
+        "shared_stage_metrics": (result.get("metrics") or {}).get("total", {}).get("shared", False),
+    }
+
+
+def run(jobs, concurrency=None, shared_weights=False, progress_interval=None):
+    """Runs the jobs on the scheduler's workers.
+
+    Args:
+        jobs (List[dict]): transcribe_file kwargs.
+        concurrency (int, optional): most files to run at once, defaults to what fits in memory.
+        shared_weights (bool): the workers share one copy of the model weights, see `TranscribeWorker.fork_pool`.
+        progress_interval (float, optional): print the progress of the running files this often, in seconds.
+
+    Returns:
+        Tuple[List[dict], List[dict]]: input, output, duration, success and errors of every job, in the order
+            they finished, and the peak memory of every worker process.
+    """
+    scheduler = TranscribeScheduler(max_workers=concurrency, shared_weights=shared_weights)
+    rows = []
+    # pid -> highest memory seen, sampled every MEMORY_SAMPLE_S and whenever a job finishes
+    memory = {}
+    last_progress = time.monotonic()
+    last_sample = 0.0
+    try:
+        for i, job in enumerate(jobs):
+            input_file = prepare_input(job["input_file"])
+            if input_file is None:
+                rows.append({"input_file": job["input_file"], "output_file": None, "audio_seconds": None, "success": False,
+                             "error": "could not convert the file to .wav", "failed_steps": []})
+                continue
+            # with the index, the same file twice in a batch would share its progress otherwise
+            scheduler.add(tag=(i, job["input_file"]), **{**job, "input_file": input_file})
+        while scheduler.busy():
+            finished = scheduler.pump(timeout=0.5)
+            for (_, path), msg in finished:
+                row = result_row(path, msg.get("result"), msg.get("error"))
+                print(f"[{len(rows) + 1}/{len(jobs)}] {'done' if row['success'] else 'FAILED'}: {path} -> {row['output_file']}", flush=True)
+                rows.append(row)
+            if progress_interval and time.monotonic() - last_progress >= progress_interval:
+                last_progress = time.monotonic()
+                for (_, path), state in scheduler.progress.items():
+                    if not state["finished"]:
+                        print(f"  {path}: {progress.describe(state)}", flush=True)
+            if not finished and time.monotonic() - last_sample < MEMORY_SAMPLE_S:
+                continue
+            last_sample = time.monotonic()
+            for sample in scheduler.memory_report():
+                peak = memory.setdefault(sample["pid"], sample)
+                for key in ("rss_mb", "pss_mb", "uss_mb"):
+                    if sample[key] is not None and (peak[key] is None or sample[key] > peak[key]):
+                        peak[key] = sample[key]
+    finally:
+        scheduler.close()
+    return rows, list(memory.values())
+
+
+def run_pipelined(jobs, queue_size=None, progress_interval=None):
+    """Runs the jobs in this process, every stage on a different file at the same time, see pipeline_batch.py.
+
+    Args:
+        queue_size (int, optional): how many files can wait in front of each stage.
+        progress_interval (float, optional): print what every stage is doing this often, in seconds.
+
+    Returns:
+        Tuple[List[dict], dict]: like `run` for every job, and how busy every stage was.
+    """
+    from pipeline_batch import QUEUE_SIZE, StagePipeline
+    from transcribe_proc import transcribe_file
+
+    rows, todo, tags = [], [], []
+    for job in jobs:
+        input_file = prepare_input(job["input_file"])
+        if input_file is None:
+            rows.append(result_row(job["input_file"], None, "could not convert the file to .wav"))
+            continue
+        todo.append({**job, "input_file": input_file})
+        tags.append(job["input_file"])
+    start = time.perf_counter()
+    with StagePipeline(queue_size or QUEUE_SIZE) as pipeline:
+        for i, result, error in pipeline.map(transcribe_file, todo, progress_interval,
+                                             lambda p: print(f"  {p.describe()}", flush=True)):
+            tag = tags[i]
+            row = result_row(tag, result, error)
+            print(f"[{len(rows) + 1}/{len(jobs)}] {'done' if row['success'] else 'FAILED'}: {tag} -> {row['output_file']}", flush=True)
+            rows.append(row)
+    return rows, pipeline.utilization(time.perf_counter() - start)
+
+
+def dry_run(jobs, selected=None, deadline_minutes=None):
+    """Prints how long the jobs would take with every profile, without transcribing anything.
+
+    Returns:
+        int: the exit code.
+    """
+    from profiles import estimate_profiles
+
+    durations = [audio_duration(job["input_file"]) for job in jobs]
+    for job, seconds in zip(jobs, durations):
+        if seconds is None:
+            print(f"Cant tell the length of {job['input_file']}, it is left out", file=sys.stderr)
+    known = [(job, seconds) for job, seconds in zip(jobs, durations) if seconds is not None]
+    base = [{k: v for k, v in job.items() if k != "profile"} for job, _ in known]
+    estimates = estimate_profiles(base, [seconds for _, seconds in known])
+    print(f"{len(known)} files, {sum(s for _, s in known) / 60:.1f} min of audio, one file after the other:")
+    for name, estimate in estimates.items():
+        fits = "" if deadline_minutes is None else "  fits" if estimate["seconds"] <= deadline_minutes * 60 else "  too slow"
+        guess = f"  (no runs yet of: {', '.join(estimate['guess'])})" if estimate["guess"] else ""
+        mark = "*" if name == selected else " "
+        print(f"{mark} {name:<24} {progress.format_duration(estimate['seconds']):>10}{fits}  {estimate['description']}{guess}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("inputs", nargs="*", help="media files or glob patterns")
+    parser.add_argument("--manifest", default=None, help="a .csv or .jsonl file listing the files and per file options")
+    parser.add_argument("--model", default=None, help="huggingface model id, ex: openai/whisper-small.en")
+    parser.add_argument("--lang", default="eng")
+    parser.add_argument("--speakers", type=int, default=2, help="number of speakers, 1 skips speaker diarization")
+    parser.add_argument("--concurrency", type=int, default=None, help="most files to transcribe at once, defaults to what fits in memory")
+    parser.add_argument("--shared-weights", action="store_true", help="the parallel workers share one copy of the model weights (POSIX, CPU only)")
+    parser.add_argument("--output-dir", default=None, help="where to write the .cha files, defaults to next to each input")
+    parser.add_argument("--profile", default=None, help="pipeline profile from cfg/profiles.json (stages, devices, threads, batch sizes), see profiles.py")
+    parser.add_argument("--dry-run", action="store_true", help="only estimate how long the files take with every profile, from the speed of earlier runs")
+    parser.add_argument("--deadline", type=float, default=None, metavar="MINUTES", help="with --dry-run, mark the profiles that are done in time")
+    # these default to None so that only the ones given win over the --profile
+    parser.add_argument("--precision", default=None, choices=["fp32", "bf16", "fp16", "int8"], help="defaults to fp32")
+    parser.add_argument("--asr-engine", default=None, choices=["batchalign", "custom"], help="defaults to batchalign")
+    parser.add_argument("--asr-backend", default=None, choices=["hf", "onnx"], help="defaults to hf")
+    parser.add_argument("--shards", type=int, default=None, help="split the ASR of long recordings over this many processes, best with --concurrency 1")
+    parser.add_argument("--parallel-stages", action="store_true", help="run speaker diarization next to the other stages instead of before them")
+    parser.add_argument("--pipelined", action="store_true", help="run the files in this process with every stage on a different file at once, instead of a file per worker")
+    parser.add_argument("--queue-size", type=int, default=None, help="with --pipelined, how many files can wait in front of each stage")
+    parser.add_argument("--stages", nargs="+", default=None, help="pipeline stages to run, see transcribe_proc.STAGES")
+    parser.add_argument("--no-cache", action="store_true", help="dont re-use previous results")
+    parser.add_argument("--resume", action="store_true", help="continue interrupted files and skip finished ones")
+    parser.add_argument("--profile-stage", default=None, help="write a cProfile .prof of this stage next to each output")
+    parser.add_argument("--progress", type=float, default=None, metavar="SECONDS", help="print the stage, chunks and ETA of the running files this often")
+    parser.add_argument("--report", default=None, help="where to write the json report, defaults to transcribe_report.json in the output dir (or the current dir)")
+    args = parser.parse_args(argv)
+
+    defaults = {
+        "model_name": args.model,
+        "lang": args.lang,
+        "num_speakers": args.speakers,
+        "use_cache": not args.no_cache,
+        "resume": args.resume,
+        "open_output": False,
+    }
+    for key, value in (("stages", args.stages), ("profile_stage", args.profile_stage), ("output_dir", args.output_dir),
+                       ("precision", args.precision), ("asr_engine", args.asr_engine), ("asr_backend", args.asr_backend),
+                       ("asr_shards", args.shards), ("parallel_stages", args.parallel_stages or None)):
+        if value is not None:
+            defaults[key] = value
+    jobs = [{**defaults, "input_file": f} for f in expand_inputs(args.inputs)]
+    if args.manifest:
+        # a manifest row can pick its own profile
+        jobs += [{**defaults, **job, "open_output": False} for job in read_manifest(args.manifest)]
+    if not jobs:
+        parser.error("no input files, pass some files, globs or a --manifest")
+    if args.dry_run:
+        return dry_run(jobs, args.profile, args.deadline)
+    try:
+        jobs = [apply_profile({k: v for k, v in job.items() if k != "profile"}, job.get("profile") or args.profile) for job in jobs]
+    except ValueError as e:
+        parser.error(str(e))
+
+    start = time.perf_counter()
+    if args.pipelined:
+        rows, stages = run_pipelined(jobs, args.queue_size, args.progress)
+        report = build_report(rows, time.perf_counter() - start)
+        report["stages"] = stages
+    else:
+        rows, workers = run(jobs, args.concurrency, args.shared_weights, args.progress)
+        report = build_report(rows, time.perf_counter() - start, workers)
+
+    report_file = args.report or os.path.join(args.output_dir or ".", "transcribe_report.json")
+    os.makedirs(os.path.dirname(os.path.abspath(report_file)), exist_ok=True)
+    with open(report_file, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nTranscribed {report['succeeded']}/{report['files']} files in {report['wall_seconds']:.1f}s", end="")
+    if report["throughput"]:
+        print(f", {report['audio_seconds'] / 60:.1f} min of audio at {report['throughput']:.2f}x real time", end="")
+    if report["total_pss_mb"] is not None:
+        print(f"\nWorkers: {len(workers)} processes, {report['total_rss_mb']:.0f}MB RSS, {report['total_pss_mb']:.0f}MB PSS", end="")
+    for stage, usage in report.get("stages", {}).items():
+        print(f"\n  {stage}: {usage['runs']} runs, busy {usage['busy_seconds']:.1f}s" + (f" ({usage['busy']:.0%})" if usage["busy"] is not None else ""), end="")
+    print(f"\nReport: {report_file}")
+    for failure in report["failures"]:
+        print(f"FAILED: {failure['input_file']} {failure['error'] or ', '.join(failure['failed_steps'])}")
+    return 0 if not report["failures"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
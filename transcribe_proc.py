@@ -1,15 +1,23 @@
-import batchalign as ba
-from tkinter import messagebox
+import gc
+import importlib
 import os
 import subprocess
 import sys
+import threading
 import json
+import time
 import traceback
+from contextlib import nullcontext
 from types import FunctionType
-from huggingface_hub.hf_api import repo_exists as is_valid_model_id
-import pycountry
-import soundfile
-# from CustomAiEngine import CustomAiEngine
+from pathlib import Path
+from transcribe_worker import FORK_FLAG, WORKER_FLAG, serve, serve_forked
+from result_cache import ResultCache, hash_file, make_key
+from checkpoint import checkpoint_path, load_checkpoint, save_checkpoint
+from profiling import StageProfiler, audio_duration, record_rtfs, rtf_key, running_stages
+from pipeline_dag import branches, build_graph, critical_path, run_graph
+from pipeline_batch import QUEUE_SIZE, StagePipeline
+import progress
+# batchalign (and with it torch) is only imported once a file is transcribed, see LazyEngine
 
 DEBUG_MODE = True
 
@@ -52,6 +60,8 @@ def open_file(file_path):
                 print(f"READY TO OPEN FILE: {file_path}", flush=True)
 
 def spawn_popup_activity(title, message, yes=None, no=None):
+    # only imported here so that the worker and the CLI run on machines without a display or Tk
+    from tkinter import messagebox
     result = messagebox.askyesno(title=title, message=message)
     if result and yes and type(yes) == FunctionType:
         return yes()
@@ -59,101 +69,606 @@ def spawn_popup_activity(title, message, yes=None, no=None):
         return no()
 
 
-def transcribe_file(input_file, model_name=None, num_speakers=2, lang="eng"):
+# every stage the pipeline knows, in the order they run
+STAGES = ("asr", "speaker", "disfluency", "retrace", "morphosyntax", "utr", "fa")
+# README: these are the stages that are actually run by default,
+# add "morphosyntax" to get %mor %gra etc.
+DEFAULT_STAGES = ("asr", "speaker", "disfluency", "retrace", "utr", "fa")
+
+# engines stay loaded here between jobs when running as a persistent worker
+class LazyEngine:
+    """Stands in for an engine class, the module is only imported when the engine is created.
+    So the worker only loads the engines its pipeline actually runs, and a bad job fails before
+    any of them are imported.
+    """
+    def __init__(self, module, name):
+        """
+        Args:
+            module (str): the module the engine class is in, ex: "batchalign".
+            name (str): the engine class, ex: "WhisperEngine".
+        """
+        self.module = module
+        self.__name__ = name
+
+    def __call__(self, *args, **kwargs):
+        return getattr(importlib.import_module(self.module), self.__name__)(*args, **kwargs)
+
+    def __repr__(self):
+        return f"{self.module}.{self.__name__}"
+
+
+CustomAiEngine = LazyEngine("CustomAiEngine", "CustomAiEngine")
+WhisperEngine = LazyEngine("batchalign", "WhisperEngine")
+NemoSpeakerEngine = LazyEngine("batchalign", "NemoSpeakerEngine")
+DisfluencyReplacementEngine = LazyEngine("batchalign", "DisfluencyReplacementEngine")
+NgramRetraceEngine = LazyEngine("batchalign", "NgramRetraceEngine")
+StanzaEngine = LazyEngine("batchalign", "StanzaEngine")
+WhisperUTREngine = LazyEngine("batchalign", "WhisperUTREngine")
+Wave2VecFAEngine = LazyEngine("batchalign", "Wave2VecFAEngine")
+
+ENGINE_CACHE = {}
+# the scheduler counts every worker as one ASR model when it decides how many fit in memory,
+# so loading another ASR engine unloads the one the worker had instead of keeping both
+ASR_ENGINES = (CustomAiEngine, WhisperEngine)
+# the stages of a pipelined batch (or of parallel_stages) get their engines from different threads,
+# held while an engine is loaded or unloaded, and while an ASR engine runs so it is not unloaded under it
+ENGINE_LOCK = threading.RLock()
+
+def get_engine(factory, *args, **kwargs):
+    """Returns a loaded engine, only creating it the first time it is asked for.
+
+    Args:
+        factory (Callable): the engine class/constructor.
+        *args, **kwargs: the engine configuration, ex: model, lang, num_speakers.
+
+    Returns:
+        the cached engine instance for the given configuration.
+    """
+    key = (factory.__name__, args, tuple(sorted(kwargs.items())))
+    engine = ENGINE_CACHE.get(key)
+    if engine is not None:
+        return engine
+    with ENGINE_LOCK:
+        if key not in ENGINE_CACHE:
+            if factory in ASR_ENGINES:
+                release_engines(ASR_ENGINES)
+            print(f"Loading {factory.__name__} {args} {kwargs}", flush=True)
+            ENGINE_CACHE[key] = factory(*args, **kwargs)
+        return ENGINE_CACHE[key]
+
+
+def release_engines(factories):
+    """Drops the cached engines made by any of the factories and gives their memory back.
+
+    Args:
+        factories (Iterable[Callable]): the engine classes/constructors, ex: `ASR_ENGINES`.
+    """
+    names = {factory.__name__ for factory in factories}
+    with ENGINE_LOCK:
+        stale = [key for key in ENGINE_CACHE if key[0] in names]
+        if not stale:
+            return
+        for key in stale:
+            print(f"Unloading {key[0]} {key[1]}", flush=True)
+            engine = ENGINE_CACHE.pop(key)
+            if hasattr(engine, "close"):
+                engine.close()
+        del engine
+    gc.collect()
+    # only if a model already brought torch in, dont import it just for this
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+def normalize_lang(lang) -> str:
+    """
+    Returns:
+        str: the 3 letter language code for the given language, defaults to 'eng'.
+    """
+    try:
+        import pycountry
+        return pycountry.languages.lookup(lang).alpha_3
+    except:
+        return 'eng'
+
+
+def get_asr_engine_spec(model_name, lang, asr_engine="batchalign", asr_batch_size=None, asr_streaming=False, vad=False, precision="fp32", asr_backend="hf", asr_shards=1, asr_device=None):
+    """
+    Args:
+        model_name (str): huggingface model id.
+        lang (str): 3 letter language code.
+        asr_engine (str): "batchalign" for the batchalign WhisperEngine, or "custom" for our CustomAiEngine.
+        asr_batch_size (int | "auto", optional): chunks per forward pass, only used by the "custom" engine.
+        asr_streaming (bool): read the audio block by block with bounded memory, only used by the "custom" engine.
+        vad (bool): skip the silence with a voice activity detection pass before whisper, only used by the "custom" engine.
+        precision (str): "fp32", "bf16", "fp16" or "int8", see `asr_backends.resolve_precision`.
+            The batchalign engine only runs in fp32, so any other precision uses the "custom" engine.
+        asr_backend (str): the inference engine of the "custom" engine, "hf" or "onnx", see asr_backends.
+            Anything but "hf" also uses the "custom" engine.
+        asr_shards (int): split the ASR of long recordings over this many processes, see sharding.py.
+            More than 1 also uses the "custom" engine.
+        asr_device (str, optional): "auto", "cpu" or "cuda", see `asr_backends.resolve_device`.
+            The batchalign engine picks its own device, so anything but "auto" uses the "custom" engine.
+
+    Returns:
+        Tuple[Callable, tuple, dict]: the (factory, args, kwargs) for `get_engine` of the ASR engine.
+    """
+    precision = str(precision or "fp32").lower()
+    asr_backend = str(asr_backend or "hf").lower()
+    asr_shards = max(1, int(asr_shards or 1))
+    asr_device = str(asr_device or "auto").lower()
+    if asr_engine == "custom" or precision != "fp32" or asr_backend != "hf" or asr_shards > 1 or asr_device != "auto":
+        # only passed when set, so the cache keys of the runs without them stay the same
+        sharding = {"shards": asr_shards} if asr_shards > 1 else {}
+        placement = {"device": asr_device} if asr_device != "auto" else {}
+        return (CustomAiEngine, (model_name, lang), dict(batch_size=asr_batch_size or 1, streaming=bool(asr_streaming), vad=bool(vad), precision=precision, backend=asr_backend, **sharding, **placement))
+    return (WhisperEngine, (model_name, lang), {})
+
+
+def get_asr_engine(*args, **kwargs):
+    """
+    Returns:
+        the (cached) ASR engine, see `get_asr_engine_spec` for the args.
+    """
+    factory, engine_args, engine_kwargs = get_asr_engine_spec(*args, **kwargs)
+    return get_engine(factory, *engine_args, **engine_kwargs)
+
+
+def warm_up(model_name=None, lang="eng", asr_engine="batchalign", asr_batch_size=None, asr_streaming=False, vad=False, precision="fp32", asr_backend="hf", asr_shards=1, asr_device=None):
+    """Loads the ASR engine (downloading the model if needed) and runs it once, before any file needs it.
+    Takes the same ASR args as `transcribe_file`, so the jobs that follow get the same cached engine.
+    The ASR engine the worker had before is unloaded, see `get_engine`.
+    """
+    engine = get_asr_engine(model_name, normalize_lang(lang), asr_engine, asr_batch_size, asr_streaming, vad, precision, asr_backend, asr_shards, asr_device)
+    if hasattr(engine, "warm_up"):
+        engine.warm_up()
+
+
+def preload(model_name=None, num_speakers=2, lang="eng", asr_engine="batchalign", asr_batch_size=None, asr_streaming=False, vad=False, precision="fp32", asr_backend="hf", asr_shards=1, stages=None, asr_device=None, **job):
+    """Loads every engine of a job's pipeline without running it, before the workers that share them are forked.
+    Takes the kwargs of `transcribe_file`, the ones that are not about the pipeline are ignored.
+    """
+    for stage, (factory, args, kwargs) in get_pipeline(model_name, int(num_speakers), normalize_lang(lang), asr_engine, asr_batch_size, asr_streaming, vad, precision, asr_backend, stages, asr_shards, asr_device):
+        get_engine(factory, *args, **kwargs)
+
+
+# torch's own thread count, from before a stage changed it
+_default_threads = None
+
+def set_stage_threads(threads=None):
+    """Sets the torch threads for the stage that is about to run, None goes back to torch's default.
+    It is for the whole process, so a stage that starts while others run (pipelined, parallel_stages)
+    keeps the threads they have, see `transcribe_file`.
+    """
+    global _default_threads
+    import torch
+    if _default_threads is None:
+        _default_threads = torch.get_num_threads()
+    torch.set_num_threads(threads or _default_threads)
+
+
+def describe_steps(pipeline_activity) -> list:
+    """
+    Returns:
+        list: a comparable description of every step and its configuration, for the cache keys and checkpoints.
+    """
+    return [(step_name(spec), tuple(spec[1]), tuple(sorted(spec[2].items()))) for spec in pipeline_activity]
+
+
+def step_name(spec) -> str:
+    """
+    Returns:
+        str: the display name of a pipeline step, ex: 'Whisper' for a WhisperEngine.
+    """
+    return spec[0].__name__.replace('Engine', '')
+
+
+def get_pipeline(model_name=None, num_speakers=2, lang="eng", asr_engine="batchalign", asr_batch_size=None, asr_streaming=False, vad=False, precision="fp32", asr_backend="hf", stages=None, asr_shards=1, asr_device=None) -> list:
+    """
+    Args:
+        lang (str): 3 letter language code, see `normalize_lang`.
+        stages (List[str], optional): some of STAGES, defaults to DEFAULT_STAGES.
+        see `transcribe_file` for the others.
+
+    Raises:
+        ValueError: for an unknown stage.
+
+    Returns:
+        List[Tuple[str, Tuple[Callable, tuple, dict]]]: the (stage, (factory, args, kwargs)) of every step to run, in order.
+    """
+    stages = DEFAULT_STAGES if stages is None else [str(stage).lower() for stage in stages]
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if unknown:
+        raise ValueError(f"Unknown pipeline stage(s) {', '.join(unknown)}, expected some of {', '.join(STAGES)}")
+
+    # each step is (engine, args, kwargs), the engines are only loaded once a step actually has to run
+    pipeline = [(stage, spec) for stage, spec in [
+        # README: this is the pipeline that is actually run, see DEFAULT_STAGES for which stages are on,
+        # and cfg/profiles.json (profiles.py) for the sets of stages and settings to pick from
+        # transcribe
+        ("asr", get_asr_engine_spec(model_name, lang, asr_engine, asr_batch_size, asr_streaming, vad, precision, asr_backend, asr_shards, asr_device)),
+        # split by speaker
+        ("speaker", (NemoSpeakerEngine, (num_speakers,), {}) if num_speakers > 1 else None),
+        # recognize pauses
+        ("disfluency", (DisfluencyReplacementEngine, (), {})),
+        # retrace for verbal backtracking/repetition
+        ("retrace", (NgramRetraceEngine, (), {})),
+        # morphotag to get %mor %gra etc.
+        ("morphosyntax", (StanzaEngine, (), {})),
+        # align
+        ("utr", (WhisperUTREngine, (), {})),
+        ("fa", (Wave2VecFAEngine, (), {})),
+    ] if spec and stage in stages]
+    return pipeline
+
+
+def transcribe_file(input_file, model_name=None, num_speakers=2, lang="eng", asr_engine="batchalign", asr_batch_size=None, asr_streaming=False, vad=False, precision="fp32", asr_backend="hf", use_cache=True, resume=False, stages=None, open_output=True, profile_stage=None, output_dir=None, asr_shards=1, parallel_stages=False, asr_device=None, stage_threads=None, stage_runner=None):
     debug_logs = []
     debug_logs.append(f"Transcriber version: {debug_get_version()}")
-    debug_logs.append(f"Args: {input_file} {model_name} {num_speakers} {lang}")
+    debug_logs.append(f"Args: {input_file} {model_name} {num_speakers} {lang} {asr_engine} {asr_batch_size} {asr_streaming} {vad} {precision} {asr_backend} {use_cache} {resume} {stages} {profile_stage} {output_dir} {asr_shards} {parallel_stages} {asr_device} {stage_threads}")
 
     try:
         num_speakers = int(num_speakers)
     except:
         num_speakers = 2
-    try:
-        lang = pycountry.languages.lookup(lang).alpha_3
-    except:
-        lang = 'eng'
-    # transcribe
-    # whisper = CustomAiEngine(model=model_name, lang=lang)
-    whisper = ba.WhisperEngine(model=model_name, lang=lang)
+    lang = normalize_lang(lang)
+    pipeline = get_pipeline(model_name, num_speakers, lang, asr_engine, asr_batch_size, asr_streaming, vad, precision, asr_backend, stages, asr_shards, asr_device)
+    # stage -> torch threads, from the profile, see profiles.py
+    stage_threads = {stage: int(n) for stage, n in (stage_threads or {}).items() if n}
+    pipeline_activity = [spec for _, spec in pipeline]
+    pipeline_stages = [stage for stage, _ in pipeline]
+    
+    steps = describe_steps(pipeline_activity)
+    checkpoint = load_checkpoint(input_file, steps, output_dir) if resume else None
+    if checkpoint is not None and checkpoint["done"]:
+        print(f"{input_file} was already transcribed completely, see {checkpoint['output_file']}", flush=True)
+        return {
+            "input_file": input_file,
+            "output_file": checkpoint["output_file"],
+            "steps": [{"step": step_name(spec), "stage": stage, "status": "RESUMED", "seconds": 0.0} for stage, spec in pipeline],
+            "success": True,
+        }
 
-    # split by speaker
-    diarization = ba.NemoSpeakerEngine(num_speakers=num_speakers)
+    if checkpoint is not None:
+        # keep writing to the output of the interrupted run
+        output_file = checkpoint["output_file"]
+    else:
+        # next to the input file unless asked otherwise
+        output_base = os.path.join(output_dir, os.path.basename(input_file)) if output_dir else input_file
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        n = 0
+        output_file = f"{output_base}{'_'+str(n) if n > 0 else ''}.cha"
+        while 1:
+            output_file = f"{output_base}{'_'+str(n) if n > 0 else ''}.cha"
+            if not os.path.exists(output_file):
+                break
+            n += 1
+    result = {"input_file": input_file, "output_file": output_file, "steps": []}
 
-    # recognize pauses
-    disfluency = ba.DisfluencyReplacementEngine()
+    # only imported once the job is known to be valid, the engines themselves load even later, see LazyEngine
+    import batchalign as ba
 
-    # retrace for verbal backtracking/repetition
-    retrace = ba.NgramRetraceEngine()
-    
-    # morphotag to get %mor %gra etc.
-    morphosyntax = ba.StanzaEngine()
-
-    # align
-    utr = ba.WhisperUTREngine()
-    fa = ba.Wave2VecFAEngine()
-
-    pipeline_activity = [action for action in [
-        # README: this is the pipeline that is actually run, 
-        # comment out each line for what you want to be run or not
-        # @todo: make this a text config file?
-        whisper,
-        diarization if num_speakers > 1 else None,
-        disfluency,
-        retrace,
-        # morphosyntax,
-        utr,
-        fa
-    ] if action]
-    
-    n = 0
-    output_file = f"{input_file}{'_'+str(n) if n > 0 else ''}.cha"
-    while 1:
-        output_file = f"{input_file}{'_'+str(n) if n > 0 else ''}.cha"
-        if not os.path.exists(output_file):
-            break
-        n += 1
-    doc = ba.Document.new(media_path=input_file, lang=lang)
-    for idx, activity in enumerate(pipeline_activity, start=1):
-        step_status = ["Started"]
-        nlp = ba.BatchalignPipeline(activity)
+    # the cache key of each step covers the audio content and every step up to and including it
+    cache, stage_keys, cached_steps = None, [], 0
+    if use_cache:
         try:
-            print(f"{input_file} - starting pipeline action: {idx}/{len(pipeline_activity)} - {(type(activity).__name__).replace('Engine','')}")
-            doc = nlp(doc)
-            chat = ba.CHATFile(doc=doc)
-            chat.write(output_file, write_wor=False)
-            step_status = ["SUCCESSFUL"]
-        except Exception as e:
-            step_status = traceback.format_exc().split("\n")
-            # using the soundfile LibsndfileError is not required if you want to run bare-bones
-            if isinstance(e, soundfile.LibsndfileError):
-                step_status.append("The input file type is not supported! Please convert the file type manually and try again!")
-            print(f"{input_file} had an error on step: {idx}/{len(pipeline_activity)} - {(type(activity).__name__).replace('Engine','')}")
+            audio_hash = hash_file(input_file)
+            cache = ResultCache()
+            stage_keys = [make_key(audio_hash, getattr(ba, '__version__', None), steps[:i]) for i in range(1, len(steps) + 1)]
+        except Exception:
+            print(f"Not using the result cache for {input_file}:")
             traceback.print_exc()
-        
+            cache = None
+    doc = None
+    if cache:
+        for i in reversed(range(checkpoint["completed"] if checkpoint else 0, len(stage_keys))):
+            doc = cache.get(stage_keys[i])
+            if doc is not None:
+                cached_steps = i + 1
+                break
+    resumed_steps = 0
+    if doc is None and checkpoint is not None:
+        doc, resumed_steps = checkpoint["doc"], checkpoint["completed"]
+        print(f"Resuming {input_file} after step {resumed_steps}/{len(pipeline_activity)}", flush=True)
+    if doc is None:
+        doc = ba.Document.new(media_path=input_file, lang=lang)
+    else:
+        # the cached result could come from an identical file somewhere else
+        if doc.media is not None:
+            doc.media.url = input_file
+            doc.media.name = Path(input_file).stem
+        ba.CHATFile(doc=doc).write(output_file, write_wor=False)
+
+    # resource usage of every stage, see profiling.py
+    metrics_file = f"{os.path.splitext(output_file)[0]}.metrics.json"
+    profile_file = f"{os.path.splitext(output_file)[0]}.{profile_stage}.prof" if profile_stage else None
+    profiler = StageProfiler(audio_duration(input_file), profile_stage, profile_file)
+    # for the GUI (or whoever runs the worker), see progress.py
+    progress.report("start", audio_seconds=profiler.audio_seconds, steps=len(pipeline_activity))
+
+    def run_step(idx, spec, doc, write_output=True):
+        """Runs step idx (from 1) on the document.
+
+        Returns:
+            Tuple[Document, List[str], dict]: the document (the one given if the step failed), the step status lines and its metrics.
+        """
+        if stage_runner is not None:
+            # the stage's worker runs it once the files before this one are through, see pipeline_batch.py
+            return stage_runner(pipeline_stages[idx - 1], lambda: run_step_here(idx, spec, doc, write_output))
+        return run_step_here(idx, spec, doc, write_output)
+
+    def run_step_here(idx, spec, doc, write_output=True):
+        step_status = ["Started"]
+        progress.report("stage_start", stage=pipeline_stages[idx - 1], step=idx, steps=len(pipeline_activity))
+        threads = stage_threads.get(pipeline_stages[idx - 1])
+        with profiler.stage(pipeline_stages[idx - 1]) as metrics:
+            try:
+                print(f"{input_file} - starting pipeline action: {idx}/{len(pipeline_activity)} - {step_name(spec)}")
+                # another thread asking for a different ASR engine waits until this one is done, see `get_engine`
+                with ENGINE_LOCK if spec[0] in ASR_ENGINES else nullcontext():
+                    nlp = ba.BatchalignPipeline(get_engine(spec[0], *spec[1], **spec[2]))
+                    # the torch threads are for the whole process, only changed when no other stage is running on them
+                    if (threads or _default_threads is not None) and len(running_stages()) == 1:
+                        set_stage_threads(threads)
+                    doc = nlp(doc)
+                if write_output:
+                    chat = ba.CHATFile(doc=doc)
+                    chat.write(output_file, write_wor=False)
+                step_status = ["SUCCESSFUL"]
+            except Exception as e:
+                step_status = traceback.format_exc().split("\n")
+                # using the soundfile LibsndfileError is not required if you want to run bare-bones
+                soundfile = sys.modules.get("soundfile")
+                if soundfile is not None and isinstance(e, soundfile.LibsndfileError):
+                    step_status.append("The input file type is not supported! Please convert the file type manually and try again!")
+                print(f"{input_file} had an error on step: {idx}/{len(pipeline_activity)} - {step_name(spec)}")
+                traceback.print_exc()
+                progress.report("error", stage=pipeline_stages[idx - 1], error=f"{type(e).__name__}: {e}")
+        metrics.update(step=step_name(spec), status="SUCCESSFUL" if step_status == ["SUCCESSFUL"] else "FAILED")
+        progress.report("stage_end", stage=pipeline_stages[idx - 1], step=idx, status=metrics["status"], seconds=metrics["wall_seconds"])
+        return doc, step_status, metrics
+
+    def log_step(idx, spec, step_status, metrics):
+        result["steps"].append({"step": step_name(spec), "stage": pipeline_stages[idx - 1], "status": metrics["status"], "seconds": metrics["wall_seconds"]})
         for i, line in enumerate(step_status, start=1):
-            debug_logs.append(f"Step {idx}/{len(pipeline_activity)} - {(type(activity).__name__).replace('Engine','')} - {i}/{len(step_status)} - {line}")
+            debug_logs.append(f"Step {idx}/{len(pipeline_activity)} - {step_name(spec)} - {i}/{len(step_status)} - {line}")
+        debug_logs.append(f"Step {idx}/{len(pipeline_activity)} - {step_name(spec)} - metrics - {profiler.summary(metrics)}")
+        print(f"Step {idx}/{len(pipeline_activity)} - {step_name(spec)}\n" + "\n".join(step_status))
+
+    graph = build_graph(pipeline_stages)
+    # a cached or resumed document is somewhere in the middle of the sequence, so it goes on in sequence
+    if parallel_stages and branches(graph) and not (cached_steps or resumed_steps):
+        # stages that dont need each other run at the same time, see pipeline_dag.py
+        index = {stage: idx for idx, stage in enumerate(pipeline_stages, start=1)}
+        ran = {}
+
+        def run_stage(stage, doc):
+            doc, step_status, metrics = run_step(index[stage], pipeline_activity[index[stage] - 1], doc, write_output=False)
+            ran[stage] = (step_status, metrics)
+            return doc
+
+        wall_start, cpu_start = time.perf_counter(), profiler.process_cpu_seconds()
+        doc, timings, rerun = run_graph(graph, run_stage, doc)
+        profiler.wall_seconds = time.perf_counter() - wall_start
+        profiler.cpu_seconds = profiler.process_cpu_seconds() - cpu_start
+        for idx, spec in enumerate(pipeline_activity, start=1):
+            log_step(idx, spec, *ran[pipeline_stages[idx - 1]])
+        for stage in rerun:
+            debug_logs.append(f"The {stage} stage could not be merged with the others and ran again at the end")
+        seconds, path = critical_path(graph, timings, rerun)
+        result["critical_path"] = {"seconds": seconds, "stages": path, "wall_seconds": profiler.wall_seconds}
+        debug_logs.append(f"Critical path - {seconds:.2f}s through {' -> '.join(path)}, wall {profiler.wall_seconds:.2f}s")
+        succeeded = all(step_status == ["SUCCESSFUL"] for step_status, _ in ran.values())
+        try:
+            ba.CHATFile(doc=doc).write(output_file, write_wor=False)
+        except Exception:
+            print(f"Failed to write {output_file}:")
+            traceback.print_exc()
+            succeeded = False
+        # only the final document matches a key, the ones in between never existed on their own
+        if succeeded and cache is not None:
+            try:
+                cache.put(stage_keys[-1], doc)
+            except Exception:
+                print(f"Failed to cache {input_file}:")
+                traceback.print_exc()
+        if succeeded:
+            try:
+                save_checkpoint(input_file, steps, output_file, len(steps), doc, output_dir)
+            except Exception:
+                print(f"Failed to checkpoint {input_file}:")
+                traceback.print_exc()
+    else:
+        # only cache and checkpoint while every step so far succeeded, otherwise the document does not match
+        cacheable = cache is not None
+        checkpointing = True
+        for idx, spec in enumerate(pipeline_activity, start=1):
+            if idx <= max(cached_steps, resumed_steps):
+                status, message = ("CACHED", "LOADED FROM CACHE") if cached_steps else ("RESUMED", "RESUMED FROM CHECKPOINT")
+                result["steps"].append({"step": step_name(spec), "stage": pipeline_stages[idx - 1], "status": status, "seconds": 0.0})
+                debug_logs.append(f"Step {idx}/{len(pipeline_activity)} - {step_name(spec)} - 1/1 - {message}")
+                print(f"Step {idx}/{len(pipeline_activity)} - {step_name(spec)}\n{message}")
+                progress.report("stage_end", stage=pipeline_stages[idx - 1], step=idx, status=status, seconds=0.0)
+                continue
+            doc, step_status, metrics = run_step(idx, spec, doc)
 
-        print(f"Step {idx}/{len(pipeline_activity)} - {(type(activity).__name__).replace('Engine','')}\n" + "\n".join(step_status))
+            if step_status == ["SUCCESSFUL"] and cacheable:
+                try:
+                    cache.put(stage_keys[idx - 1], doc)
+                except Exception:
+                    print(f"Failed to cache step {idx}/{len(pipeline_activity)} of {input_file}:")
+                    traceback.print_exc()
+            elif step_status != ["SUCCESSFUL"]:
+                cacheable = False
 
+            if step_status == ["SUCCESSFUL"] and checkpointing:
+                try:
+                    save_checkpoint(input_file, steps, output_file, idx, doc, output_dir)
+                except Exception:
+                    print(f"Failed to checkpoint step {idx}/{len(pipeline_activity)} of {input_file}:")
+                    traceback.print_exc()
+            elif step_status != ["SUCCESSFUL"]:
+                checkpointing = False
+
+            log_step(idx, spec, step_status, metrics)
+
+    result["metrics"] = {"total": profiler.total(), "stages": profiler.stages}
+    # for the runtime estimates of the profiles, see profiles.py. A stage that shared the process
+    # with others did not run at the speed (or with the threads) of its configuration
+    try:
+        record_rtfs({rtf_key(m["stage"], steps[pipeline_stages.index(m["stage"])], stage_threads.get(m["stage"])): m["rtf"]
+                     for m in profiler.stages if m["status"] == "SUCCESSFUL" and m.get("rtf") and not m.get("shared_with")})
+    except Exception:
+        print(f"Failed to record the real-time factors of {input_file}:")
+        traceback.print_exc()
+    if profiler.stages:
+        total = profiler.total()
+        debug_logs.append(f"Total - {total['wall_seconds']:.2f}s for {total['audio_seconds'] or 0:.1f}s of audio, full metrics in {os.path.basename(metrics_file)}")
+        if total["shared"]:
+            debug_logs.append("Some stages ran at the same time as others, their cpu, memory and cuda numbers include each other")
+        if profile_file and os.path.isfile(profile_file):
+            debug_logs.append(f"Profile of the {profile_stage} stage: {os.path.basename(profile_file)}")
     if DEBUG_MODE:
+        try:
+            profiler.write_json(metrics_file, input_file=input_file, output_file=output_file, version=debug_get_version(), critical_path=result.get("critical_path"))
+        except Exception:
+            print(f"Failed to write the metrics of {input_file}:")
+            traceback.print_exc()
         with open(output_file,'a',encoding='utf-8') as f:
             f.write(f"\n{DEBUG_PREAMBLE}\n")
             f.write("\n".join([f"{DEBUG_LINE_PREFIX} {line}" for line in debug_logs]))
-    print(f"Completed transcription for {input_file}! The output file can be found directly next to the input file in your file system with a '.cha' file extension: {output_file}", flush=True)
+    print(f"Completed transcription for {input_file}! The output file can be found {'in ' + output_dir if output_dir else 'directly next to the input file in your file system'} with a '.cha' file extension: {output_file}", flush=True)
     # uncomment this next block if you want the output file to automatically open
     # return spawn_popup_activity(title="COMPLETED!",message=f"Completed transcription of\n{input_file}\nOutput file can be found here:\n{output_file}\nOpen file now?", yes=lambda: open_file(output_file))
-    open_file(output_file)
+    if open_output:
+        open_file(output_file)
+    result["success"] = all(step["status"] in ("SUCCESSFUL", "CACHED", "RESUMED") for step in result["steps"])
+    if result["success"]:
+        # the transcript is written, a checkpoint that cant be written or removed is not worth failing it over
+        try:
+            if resume:
+                # remember that this file is done, so resuming the batch again skips it
+                save_checkpoint(input_file, steps, output_file, len(steps), None, output_dir)
+            elif os.path.isfile(checkpoint_path(input_file, output_dir)):
+                os.remove(checkpoint_path(input_file, output_dir))
+        except Exception:
+            print(f"Failed to update the checkpoint of {input_file}:")
+            traceback.print_exc()
+    return result
+
+
+def prefetch(jobs):
+    """Runs the ASR of the file that is about to start together with the files queued behind it
+    that use the same "custom" ASR engine, so their chunks share batches, see `CustomAiEngine.prefetch`.
+    Never raises, each file retries its own ASR and reports the error.
+
+    Args:
+        jobs (List[dict]): the kwargs for `transcribe_file` of the file that is about to start, then of the ones behind it.
+    """
+    def spec(job):
+        if "asr" not in (job.get("stages") or DEFAULT_STAGES):
+            return None
+        return get_asr_engine_spec(job.get("model_name"), normalize_lang(job.get("lang", "eng")), job.get("asr_engine", "batchalign"), job.get("asr_batch_size"), job.get("asr_streaming", False), job.get("vad", False), job.get("precision", "fp32"), job.get("asr_backend", "hf"), job.get("asr_shards", 1), job.get("asr_device"))
+
+    try:
+        forget_prefetched([job.get("input_file") for job in jobs])
+        if len(jobs) < 2:
+            return
+        first = spec(jobs[0])
+        # only the engine that is about to run, the others would load before they are needed
+        if first is None or first[0] is not CustomAiEngine:
+            return
+        files = [job["input_file"] for job in jobs if spec(job) == first]
+        if len(files) > 1:
+            factory, args, kwargs = first
+            with ENGINE_LOCK:
+                get_engine(factory, *args, **kwargs).prefetch(files)
+    except Exception:
+        traceback.print_exc()
+
+
+def forget_prefetched(keep=()):
+    """Drops the ASR results `prefetch` ran for files other than keep, so a file that never got to its
+    ASR (ex: it came from the cache) does not keep its result in a persistent worker.
+
+    Args:
+        keep (List[str]): the input files that are still to come.
+    """
+    with ENGINE_LOCK:
+        for key, engine in list(ENGINE_CACHE.items()):
+            if key[0] == CustomAiEngine.__name__:
+                engine.forget_prefetched(keep)
+
+
+def transcribe_files(jobs, pipelined=False, queue_size=QUEUE_SIZE):
+    """Transcribes several files. Files that use the "custom" ASR engine with the same
+    configuration get their ASR run together, so their chunks share batches, see `prefetch`.
+
+    Args:
+        jobs (List[dict]): the kwargs for `transcribe_file` of each file.
+        pipelined (bool): every stage works on a different file at the same time, see pipeline_batch.py.
+            The ASR worker then runs the files behind the one it is on along with it.
+        queue_size (int): with pipelined, how many files can wait in front of each stage.
+
+    Returns:
+        List[dict]: the result of each job.
+    """
+    if pipelined:
+        results = [None] * len(jobs)
+
+        def transcribe(stage_runner, job_index, **job):
+            # by index, the same file can be in the batch twice
+            behind = jobs[job_index:]
+
+            def run_stage(stage, fn):
+                if stage != "asr":
+                    return stage_runner(stage, fn)
+
+                def asr():
+                    # on the ASR worker, so the engine is still only used from there
+                    prefetch(behind)
+                    return fn()
+                return stage_runner(stage, asr)
+            return transcribe_file(**job, stage_runner=run_stage)
 
+        with StagePipeline(queue_size) as pipeline:
+            for i, result, error in pipeline.map(transcribe, [{**job, "job_index": i} for i, job in enumerate(jobs)]):
+                if error is not None:
+                    print(f"Failed to transcribe {jobs[i].get('input_file')}:\n{error}", flush=True)
+                    result = {"input_file": jobs[i].get("input_file"), "output_file": None, "steps": [], "success": False, "error": error}
+                print("Attempt completed for:", jobs[i].get('input_file', jobs[i]), flush=True)
+                results[i] = result
+        # what was run ahead for files that never got to their ASR
+        forget_prefetched()
+        return results
+    results = []
+    for i, job in enumerate(jobs):
+        print("Attempting to transcribe for:", job.get('input_file', job), flush=True)
+        prefetch(jobs[i:])
+        results.append(transcribe_file(**job))
+        print("Attempt completed for:", job.get('input_file', job), flush=True)
+    forget_prefetched()
+    return results
 
 
 if __name__ == "__main__":
     print(sys.argv, flush=True)
+    if len(sys.argv) > 2 and sys.argv[1] == WORKER_FLAG:
+        # persistent worker mode, see transcribe_worker.py
+        serve(sys.argv[2], transcribe_file, warm_up, handle_prefetch=prefetch)
+        sys.exit(0)
+    if len(sys.argv) > 2 and sys.argv[1] == FORK_FLAG:
+        # several workers sharing the engines loaded for this job, see TranscribeWorker.fork_pool
+        job = json.loads(sys.argv[3]) if len(sys.argv) > 3 else {}
+        serve_forked(sys.argv[2].split(","), transcribe_file, warm_up, preload=(lambda: preload(**job)) if job else None, handle_prefetch=prefetch)
+        sys.exit(0)
+    jobs = []
     for data in sys.argv[1:]:
         try:
-            args = json.loads(data)
+            jobs.append(json.loads(data))
         except:
             print(f"Failed to parse input data: {data}")
             continue
-        print("Attempting to transcribe for:", args.get('input_file',args), flush=True)
-        transcribe_file(**args)
-        print("Attempt completed for:", sys.argv[1:], flush=True)
+    transcribe_files(jobs)
@@ -0,0 +1,393 @@
+"""Long lived transcription worker.
+
+Instead of starting a new python interpreter (and re-loading every AI model) for
+each file, the GUI or a script can start a worker once and send it jobs.
+
+The controlling side creates a `TranscribeWorker`, which listens on a localhost
+socket and spawns `transcribe_proc.py --worker <address>`. The worker process
+connects back, keeps its engines loaded between jobs and answers every job with
+a result message.
+
+Messages are plain dicts:
+    controller -> worker: {"type": "job", "id": <int>, "args": {transcribe_file kwargs}}
+                          {"type": "jobs", "jobs": [{"id": <int>, "args": {...}}, ...]}, several jobs at once
+                          {"type": "warm", "id": <int>, "args": {transcribe_proc.warm_up kwargs}}
+                          {"type": "stop"}
+    worker -> controller: {"type": "hello", "pid": <int>}, once, right after connecting
+                          {"type": "result", "id": <int>, "result": {...}, "error": <str|None>}
+                          {"type": "warmed", "id": <int>, "error": <str|None>}
+                          {"type": "progress", "id": <int>, "event": <str>, ...}, while a job runs, see progress.py
+
+A background thread reads the worker's messages as they come, so `poll` never
+blocks the GUI for longer than its timeout and the worker never waits on the GUI.
+
+A "warm" message loads (downloading if needed) a model ahead of the jobs that will use it.
+
+The controller can send several jobs at once (see `scheduler.BATCH_JOBS`). They run one
+after the other and each gets its own result, but the ASR of the ones that are waiting
+is run together with the first, so short files share batches, see `transcribe_proc.prefetch`.
+
+`TranscribeWorker.fork_pool` starts several workers that share one copy of the
+model weights: one process (`transcribe_proc.py --forked-workers <addresses> <job>`)
+loads the engines and then forks the workers off, see `serve_forked`.
+
+This module must stay free of any heavy imports (batchalign, torch, tkinter) so
+that it can be used from the GUI and from headless scripts alike.
+"""
+import gc
+import json
+import os
+import queue
+import secrets
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from itertools import count, takewhile
+from multiprocessing.connection import Client, Listener
+from pathlib import Path
+
+import progress
+
+WORKER_FLAG = "--worker"
+FORK_FLAG = "--forked-workers"
+AUTHKEY_ENV = "TRANSCRIBER_WORKER_AUTHKEY"
+TRANSCRIBE_SUBPROC_FILENAME = Path(__file__).parent.expanduser().resolve() / "transcribe_proc.py"
+
+
+class WorkerDiedError(Exception):
+    """Raised when the worker process exits while we are waiting on it."""
+
+
+# put in the inbox when the worker's connection is closed
+_EOF = object()
+
+
+class TranscribeWorker:
+    _job_ids = count(1)
+
+    def __init__(self, cwd=None, extra_args=None, env=None, spawn=True, authkey=None):
+        """Spawns a worker process and waits for it to connect back to us.
+
+        Args:
+            cwd (str, optional): working directory for the worker. Defaults to the current one.
+            extra_args (List[str], optional): extra command line args for the worker process.
+            env (dict, optional): extra environment variables for the worker process.
+            spawn (bool): False when the worker is forked off another process instead, see `fork_pool`.
+            authkey (bytes, optional): the key the worker connects with, shared by the workers of a `fork_pool`.
+        """
+        authkey = authkey or secrets.token_bytes(32)
+        self._listener = Listener(("127.0.0.1", 0), authkey=authkey)
+        self._conn = None
+        self._accept_error = None
+        # jobs submitted before the worker connected back
+        self._outbox = []
+        # every message of the worker, read by the accept thread, then _EOF once the connection is gone
+        self.inbox = queue.Queue()
+        self.pending = {}
+        # pid of the worker, sent when it connects
+        self.pid = None
+        # forked off a process that holds the shared weights, see `fork_pool`
+        self.forked = not spawn
+        # the other workers forked off the same process
+        self.siblings = []
+        host, port = self._listener.address
+        self.address = f"{host}:{port}"
+        self._closed = False
+        self._accept_thread = threading.Thread(target=self._accept, daemon=True)
+        self.proc = None
+        if not spawn:
+            # fork_pool starts the process and the accept thread
+            return
+        self.proc = subprocess.Popen(
+            args=[sys.executable, str(TRANSCRIBE_SUBPROC_FILENAME), WORKER_FLAG, self.address, *(extra_args or [])],
+            cwd=cwd or os.getcwd(),
+            env={**os.environ, **(env or {}), AUTHKEY_ENV: authkey.hex()},
+            start_new_session=True,
+        )
+        self._accept_thread.start()
+
+    @classmethod
+    def fork_pool(cls, size, preload=None, cwd=None, env=None):
+        """Starts one process that loads the models once and then forks `size` workers off, which share
+        the (read-only) weights instead of each loading their own copy. POSIX only, and the models run
+        on the CPU, CUDA can not be used in forked processes.
+
+        Args:
+            size (int): number of workers.
+            preload (dict, optional): kwargs of a job whose engines are loaded before forking, see `transcribe_proc.preload`.
+            cwd (str, optional): working directory for the workers.
+            env (dict, optional): extra environment variables for the workers.
+
+        Returns:
+            List[TranscribeWorker]: the workers, they connect back like spawned ones.
+        """
+        authkey = secrets.token_bytes(32)
+        workers = [cls(spawn=False, authkey=authkey) for _ in range(size)]
+        proc = subprocess.Popen(
+            args=[sys.executable, str(TRANSCRIBE_SUBPROC_FILENAME), FORK_FLAG, ",".join(w.address for w in workers), json.dumps(preload or {})],
+            cwd=cwd or os.getcwd(),
+            env={**os.environ, **(env or {}), AUTHKEY_ENV: authkey.hex()},
+            start_new_session=True,
+        )
+        for worker in workers:
+            worker.proc = proc
+            worker.siblings = [w for w in workers if w is not worker]
+            worker._accept_thread.start()
+        return workers
+
+    def _accept(self):
+        try:
+            conn = self._listener.accept()
+            hello = conn.recv()
+            self.pid = hello.get("pid")
+            self._conn = conn
+        except Exception as e:
+            self._accept_error = e
+            return
+        finally:
+            self._listener.close()
+        try:
+            while True:
+                self.inbox.put(conn.recv())
+        except (EOFError, OSError):
+            pass
+        finally:
+            self.inbox.put(_EOF)
+
+    def is_alive(self) -> bool:
+        return self.proc.poll() is None
+
+    def is_ready(self) -> bool:
+        """
+        Returns:
+            bool: True once the worker process has connected back.
+        """
+        return self._conn is not None
+
+    def _wait_ready(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._conn is None:
+            if self._accept_error is not None:
+                raise WorkerDiedError(f"Worker failed to connect: {self._accept_error}")
+            if not self.is_alive():
+                raise WorkerDiedError(f"Worker exited with code {self.proc.returncode} before it was ready")
+            # poll(timeout=0) from the GUI thread must not block at all
+            remaining = 0.1 if deadline is None else min(0.1, deadline - time.monotonic())
+            if remaining <= 0:
+                return False
+            self._accept_thread.join(timeout=remaining)
+        return True
+
+    def submit(self, **job) -> int:
+        """Sends a job to the worker.
+
+        Args:
+            **job: the kwargs for `transcribe_proc.transcribe_file`
+
+        Returns:
+            int: the id of the submitted job, used to match up the result.
+        """
+        return self.submit_many([job])[0]
+
+    def submit_many(self, jobs) -> list:
+        """Sends several jobs to the worker in one message, so it knows about all of them when it starts the first.
+
+        Args:
+            jobs (List[dict]): the kwargs for `transcribe_proc.transcribe_file` of every job.
+
+        Returns:
+            List[int]: the id of every job, in the same order.
+        """
+        if self._accept_error is not None or not self.is_alive():
+            self._wait_ready()
+        job_ids = [next(TranscribeWorker._job_ids) for _ in jobs]
+        if len(jobs) == 1:
+            self._outbox.append({"type": "job", "id": job_ids[0], "args": jobs[0]})
+        else:
+            self._outbox.append({"type": "jobs", "jobs": [{"id": job_id, "args": job} for job_id, job in zip(job_ids, jobs)]})
+        self.pending.update(zip(job_ids, jobs))
+        self._flush()
+        return job_ids
+
+    def warm(self, **args) -> int:
+        """Asks the worker to load a model before any job needs it, jobs sent later wait for it.
+
+        Args:
+            **args: the kwargs for `transcribe_proc.warm_up`
+
+        Returns:
+            int: the id of the request, the "warmed" message has the same id.
+        """
+        if self._accept_error is not None or not self.is_alive():
+            self._wait_ready()
+        warm_id = next(TranscribeWorker._job_ids)
+        self._outbox.append({"type": "warm", "id": warm_id, "args": args})
+        self._flush()
+        return warm_id
+
+    def _flush(self):
+        if self._conn is None:
+            return
+        while self._outbox:
+            self._conn.send(self._outbox.pop(0))
+
+    def poll(self, timeout=0.0):
+        """Checks for a message from the worker.
+
+        Args:
+            timeout (float): how long to wait for a message in seconds.
+
+        Raises:
+            WorkerDiedError: If the worker process went away with jobs still pending.
+
+        Returns:
+            dict | None: the next message from the worker, or None if nothing arrived in time.
+        """
+        if self._conn is None:
+            if not self._wait_ready(timeout):
+                return None
+            timeout = 0.0
+        try:
+            self._flush()
+        except (EOFError, OSError) as e:
+            raise WorkerDiedError(f"Lost connection to the worker: {e}")
+        try:
+            msg = self.inbox.get(timeout=timeout) if timeout else self.inbox.get_nowait()
+        except queue.Empty:
+            if not self.is_alive() and self.inbox.empty():
+                raise WorkerDiedError(f"Worker exited with code {self.proc.returncode}")
+            return None
+        if msg is _EOF:
+            # so that the next poll fails too
+            self.inbox.put(_EOF)
+            raise WorkerDiedError("Lost connection to the worker")
+        if msg.get("type") == "result":
+            self.pending.pop(msg.get("id"), None)
+        return msg
+
+    def close(self, timeout=5):
+        """Asks the worker to stop and waits for it to exit."""
+        self._closed = True
+        try:
+            if self._conn is not None:
+                self._conn.send({"type": "stop"})
+                self._conn.close()
+        except (EOFError, OSError):
+            pass
+        if any(not w._closed for w in self.siblings):
+            # the forked process exits with its last worker
+            return
+        try:
+            self.proc.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+
+
+def serve(address: str, handle_job, handle_warm=None, authkey=None, handle_prefetch=None):
+    """Worker side main loop. Connects back to the controller and runs jobs until told to stop.
+
+    Args:
+        address (str): "host:port" of the controller.
+        handle_job (Callable[..., dict]): called with the job kwargs, returns the result dict.
+        handle_warm (Callable[..., None], optional): called with the warm kwargs, loads a model ahead of time.
+        authkey (bytes, optional): defaults to the one in the environment.
+        handle_prefetch (Callable[[List[dict]], None], optional): called before every job with its kwargs and those
+            of the jobs already waiting behind it, ex: to batch their ASR.
+    """
+    host, port = address.rsplit(":", 1)
+    authkey = authkey or bytes.fromhex(os.environ.pop(AUTHKEY_ENV))
+    conn = Client((host, int(port)), authkey=authkey)
+    conn.send({"type": "hello", "pid": os.getpid()})
+    # messages that were read ahead to see which jobs are waiting
+    backlog = deque()
+    try:
+        while True:
+            if backlog:
+                msg = backlog.popleft()
+            else:
+                try:
+                    msg = conn.recv()
+                except EOFError:
+                    # controller went away, nothing left to do
+                    break
+            if msg.get("type") == "stop":
+                break
+            if msg.get("type") == "jobs":
+                backlog.extendleft(reversed([{"type": "job", **job} for job in msg["jobs"]]))
+                continue
+            if msg.get("type") == "warm":
+                error = None
+                try:
+                    if handle_warm is not None:
+                        handle_warm(**msg["args"])
+                except Exception:
+                    error = traceback.format_exc()
+                    print(error, flush=True)
+                conn.send({"type": "warmed", "id": msg["id"], "error": error})
+                continue
+            if msg.get("type") != "job":
+                continue
+            # the jobs sent since, their ASR can run along with this one
+            try:
+                while conn.poll(0):
+                    more = conn.recv()
+                    backlog.extend([{"type": "job", **job} for job in more["jobs"]] if more.get("type") == "jobs" else [more])
+            except EOFError:
+                pass
+            result, error = None, None
+            # sends the job's progress events to the controller as they happen
+            progress.set_sink(lambda event, job_id=msg["id"]: conn.send({"type": "progress", "id": job_id, **event}))
+            try:
+                if handle_prefetch is not None:
+                    handle_prefetch([msg["args"]] + [m["args"] for m in takewhile(lambda m: m.get("type") == "job", backlog)])
+                result = handle_job(**msg["args"])
+            except Exception:
+                error = traceback.format_exc()
+                print(error, flush=True)
+            finally:
+                progress.set_sink(None)
+            conn.send({"type": "result", "id": msg["id"], "result": result, "error": error})
+    finally:
+        conn.close()
+
+
+def serve_forked(addresses, handle_job, handle_warm=None, preload=None, handle_prefetch=None):
+    """Loads the models once, then forks a worker per address that runs `serve`. The children share the
+    memory of everything loaded before the fork for as long as nobody writes to it, and model weights
+    are only ever read.
+
+    Args:
+        addresses (List[str]): "host:port" of every worker's controller side.
+        preload (Callable[[], None], optional): loads the engines that the workers will share.
+        handle_prefetch (Callable[[List[dict]], None], optional): see `serve`.
+    """
+    authkey = bytes.fromhex(os.environ.pop(AUTHKEY_ENV))
+    if preload is not None:
+        try:
+            preload()
+        except Exception:
+            # every worker loads its own engines then, like a spawned one
+            traceback.print_exc()
+    # the garbage collector writes to every object it looks at, which would copy their pages into
+    # each child, frozen objects are never looked at again
+    gc.collect()
+    gc.freeze()
+    children = []
+    for address in addresses:
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                serve(address, handle_job, handle_warm, authkey, handle_prefetch)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                sys.stdout.flush()
+                os._exit(code)
+        children.append(pid)
+    for pid in children:
+        os.waitpid(pid, 0)
@@ -0,0 +1,9 @@
+"""Where the per user files of the transcriber are kept.
+
+main.py copies its models.json and cache.json there on the first start, and the
+model list, profiles, result cache, onnx exports and real-time factor history sit
+next to them.
+"""
+from pathlib import Path
+
+CONFIG_DIR = Path(Path.home(), ".cfg").expanduser().resolve()
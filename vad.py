@@ -0,0 +1,127 @@
+"""Voice activity detection that runs on the CPU before the ASR model.
+
+Long stretches of silence or background noise cost a full whisper forward pass
+per 25 second window and are where whisper tends to hallucinate text. This
+finds the regions that contain speech, from the short-time energy of the audio
+compared to the recording's own noise floor, and cuts long regions at the
+quietest point (a natural pause) so that each region fits in one whisper window.
+"""
+from typing import Iterable, List, Tuple
+
+import numpy as np
+
+FRAME_MS = 30
+# how far above the noise floor a frame must be to count as speech, in dB
+THRESHOLD_DB = 12.0
+# frames quieter than this are always silence, in dBFS
+MIN_SPEECH_DB = -55.0
+# speech shorter than this is treated as a click/bump and dropped
+MIN_SPEECH_MS = 250
+# pauses shorter than this do not split a region
+MIN_SILENCE_MS = 500
+# audio kept on each side of a region so word onsets and endings are not clipped
+PAD_MS = 200
+# whisper reads 30 second windows, leave some headroom
+MAX_REGION_S = 25.0
+# dont cut a long region into pieces shorter than this
+MIN_REGION_S = 5.0
+
+
+def frame_energies(blocks: Iterable[np.ndarray], rate=16000, frame_ms=FRAME_MS) -> np.ndarray:
+    """Short-time energy of the audio, in dBFS per frame.
+
+    Args:
+        blocks (Iterable[np.ndarray]): mono float samples, ex: `[audio]` or `StreamingAudioFile.blocks()`.
+        rate (int): sample rate of the blocks.
+        frame_ms (int): frame length in milliseconds.
+
+    Returns:
+        np.ndarray: the energy of every frame.
+    """
+    frame = int(rate * frame_ms / 1000)
+    energies = []
+    rest = np.zeros(0, dtype=np.float32)
+    for data in blocks:
+        data = np.concatenate([rest, np.asarray(data, dtype=np.float32)])
+        n = len(data) // frame
+        if n:
+            frames = data[:n * frame].reshape(n, frame)
+            energies.append(10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10))
+        rest = data[n * frame:]
+    if len(rest):
+        energies.append(10 * np.log10(np.array([np.mean(rest ** 2)]) + 1e-10))
+    return np.concatenate(energies) if energies else np.zeros(0)
+
+
+def _runs(mask: np.ndarray) -> np.ndarray:
+    """[start, end) frame indices of every run of True in the mask."""
+    edges = np.diff(np.concatenate([[0], mask.astype(np.int8), [0]]))
+    return np.stack([np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)], axis=1)
+
+
+def split_long_region(start: int, end: int, energies: np.ndarray, max_frames: int, min_frames: int) -> List[Tuple[int, int]]:
+    """Cuts a region into pieces of at most max_frames, each cut at the quietest frame that keeps the pieces at least min_frames long."""
+    pieces = []
+    while end - start > max_frames:
+        search = energies[start + min_frames:start + max_frames]
+        cut = start + min_frames + int(np.argmin(search))
+        pieces.append((start, cut))
+        start = cut
+    pieces.append((start, end))
+    return pieces
+
+
+def speech_regions(energies: np.ndarray, frame_ms=FRAME_MS, max_region_s=MAX_REGION_S) -> List[Tuple[float, float]]:
+    """Finds the speech in a recording.
+
+    Args:
+        energies (np.ndarray): from `frame_energies`.
+        frame_ms (int): frame length used for the energies.
+        max_region_s (float): regions longer than this are split at their quietest point.
+
+    Returns:
+        List[Tuple[float, float]]: (start, end) in seconds of each speech region, in order.
+    """
+    if len(energies) == 0:
+        return []
+    noise_floor = np.percentile(energies, 10)
+    speech = energies > max(noise_floor + THRESHOLD_DB, MIN_SPEECH_DB)
+
+    to_frames = lambda ms: max(1, int(round(ms / frame_ms)))
+    runs = [tuple(r) for r in _runs(speech) if r[1] - r[0] >= to_frames(MIN_SPEECH_MS)]
+    if not runs:
+        return []
+
+    # close short pauses and pad the regions
+    merged = [list(runs[0])]
+    for start, end in runs[1:]:
+        if start - merged[-1][1] < to_frames(MIN_SILENCE_MS):
+            merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    pad = to_frames(PAD_MS)
+    padded = []
+    for start, end in merged:
+        start, end = max(0, start - pad), min(len(energies), end + pad)
+        if padded and start <= padded[-1][1]:
+            padded[-1] = (padded[-1][0], end)
+        else:
+            padded.append((start, end))
+
+    regions = []
+    for start, end in padded:
+        regions.extend(split_long_region(start, end, energies, to_frames(max_region_s * 1000), to_frames(MIN_REGION_S * 1000)))
+    return [(float(start * frame_ms / 1000), float(end * frame_ms / 1000)) for start, end in regions]
+
+
+def detect_speech(blocks: Iterable[np.ndarray], rate=16000, max_region_s=MAX_REGION_S) -> List[Tuple[float, float]]:
+    """
+    Args:
+        blocks (Iterable[np.ndarray]): mono float samples, ex: `[audio]` or `StreamingAudioFile.blocks()`.
+        rate (int): sample rate of the blocks.
+        max_region_s (float): longest region to return, in seconds.
+
+    Returns:
+        List[Tuple[float, float]]: (start, end) in seconds of each speech region, in order.
+    """
+    return speech_regions(frame_energies(blocks, rate), FRAME_MS, max_region_s)